@@ -6,54 +6,379 @@ CREATE TABLE IF NOT EXISTS scan_ingest_backlog (
     received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
 );
 
-CREATE INDEX IF NOT EXISTS idx_scan_ingest_backlog_received_at
-    ON scan_ingest_backlog (received_at DESC);
+-- Typed columns extracted once at insert time; the drain reads these instead of
+-- pulling the codes out of JSONB for every row. ADD COLUMN ... STORED rewrites an
+-- existing table once (ACCESS EXCLUSIVE), so run the upgrade while ingest is idle.
+ALTER TABLE scan_ingest_backlog
+    ADD COLUMN IF NOT EXISTS order_code TEXT
+        GENERATED ALWAYS AS (NULLIF(btrim(payload->>'order_code'), '')) STORED,
+    ADD COLUMN IF NOT EXISTS location_code TEXT
+        GENERATED ALWAYS AS (NULLIF(btrim(payload->>'location_code'), '')) STORED,
+    ADD COLUMN IF NOT EXISTS device_id TEXT
+        GENERATED ALWAYS AS (NULLIF(btrim(payload->>'device_id'), '')) STORED;
 
--- Optional target table (to be adjusted based on final schema)
-CREATE TABLE IF NOT EXISTS part_locations (
-    order_code TEXT PRIMARY KEY,
-    location_code TEXT NOT NULL,
-    device_id TEXT,
+-- Reject payloads without order/location codes at insert time. NOT VALID keeps rows
+-- that were queued before the upgrade; the drain still quarantines those.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'chk_scan_ingest_backlog_codes'
+          AND conrelid = 'scan_ingest_backlog'::regclass
+    ) THEN
+        ALTER TABLE scan_ingest_backlog
+            ADD CONSTRAINT chk_scan_ingest_backlog_codes
+            CHECK (order_code IS NOT NULL AND location_code IS NOT NULL) NOT VALID;
+    END IF;
+END;
+$$;
+
+-- Plain-layout indexes. After schema_partitioned.sql converts the backlog into a
+-- time-partitioned table these are skipped (that file defines its own indexes).
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scan_ingest_backlog'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    CREATE INDEX IF NOT EXISTS idx_scan_ingest_backlog_received_at
+        ON scan_ingest_backlog (received_at DESC);
+
+    -- Drain order (ORDER BY received_at, id LIMIT n) without a sort step.
+    CREATE INDEX IF NOT EXISTS idx_scan_ingest_backlog_drain_order
+        ON scan_ingest_backlog (received_at, id);
+
+    -- Idempotent ingest: a handheld retry carrying the same metadata.scan_id is ignored
+    -- (INSERT ... ON CONFLICT DO NOTHING) while the original row is still pending.
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_scan_ingest_backlog_scan_id
+        ON scan_ingest_backlog ((payload->'metadata'->>'scan_id'))
+        WHERE (payload->'metadata'->>'scan_id') IS NOT NULL;
+END;
+$$;
+
+-- Wake drain workers (LISTEN <channel>) as soon as rows arrive.
+-- Statement-level so a multi-row INSERT sends a single notification; PostgreSQL
+-- additionally folds identical notifications within one transaction.
+-- The channel is the trigger argument (TG_ARGV[0]); it must match BACKLOG_NOTIFY_CHANNEL
+-- and is taken from the scan_backlog.notify_channel setting (init_db.sh passes it via PGOPTIONS).
+CREATE OR REPLACE FUNCTION notify_scan_backlog()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify(COALESCE(TG_ARGV[0], 'scan_backlog'), '');
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION create_scan_backlog_notify_trigger()
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    channel TEXT := COALESCE(NULLIF(current_setting('scan_backlog.notify_channel', true), ''), 'scan_backlog');
+BEGIN
+    DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_notify ON scan_ingest_backlog;
+    EXECUTE format(
+        'CREATE TRIGGER trg_scan_ingest_backlog_notify
+             AFTER INSERT ON scan_ingest_backlog
+             FOR EACH STATEMENT
+             EXECUTE FUNCTION notify_scan_backlog(%L)',
+        channel
+    );
+    RETURN channel;
+END;
+$$;
+
+SELECT create_scan_backlog_notify_trigger();
+
+-- Pending-row counter maintained by triggers so backlog-status does not need COUNT(*).
+-- Statement-level triggers with transition tables append one delta row per INSERT/DELETE
+-- statement (not per row) instead of updating a shared row, so ingest and parallel drains
+-- never wait on each other's counter lock. pending = base row + SUM(deltas); the drain
+-- folds committed deltas into the base row periodically (compact_scan_backlog_stats()).
+-- Run refresh_scan_backlog_stats() to resync after manual edits.
+CREATE TABLE IF NOT EXISTS scan_ingest_backlog_stats (
+    table_name TEXT PRIMARY KEY,
+    pending BIGINT NOT NULL DEFAULT 0,
     updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
 );
 
--- Stored procedure for draining backlog (placeholder logic)
-CREATE OR REPLACE FUNCTION drain_scan_backlog(limit_count INTEGER DEFAULT 100)
-RETURNS INTEGER
+CREATE TABLE IF NOT EXISTS scan_ingest_backlog_stats_delta (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    delta BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION compact_scan_backlog_stats()
+RETURNS BIGINT
 LANGUAGE plpgsql
 AS $$
 DECLARE
-    processed INTEGER := 0;
-BEGIN
-    WITH candidates AS (
-        SELECT id, payload
-        FROM scan_ingest_backlog
-        ORDER BY received_at
-        LIMIT limit_count
-        FOR UPDATE SKIP LOCKED
+    folded BIGINT;
+BEGIN
+    -- Only committed deltas are visible, so in-flight ingest/drain transactions keep theirs.
+    WITH gone AS (
+        DELETE FROM scan_ingest_backlog_stats_delta
+        RETURNING table_name, delta
     ),
-    upsert AS (
-        INSERT INTO part_locations (order_code, location_code, device_id, updated_at)
-        SELECT
-            payload->>'order_code' AS order_code,
-            payload->>'location_code' AS location_code,
-            payload->>'device_id' AS device_id,
-            NOW() AS updated_at
-        FROM candidates
-        ON CONFLICT (order_code)
-        DO UPDATE SET
-            location_code = EXCLUDED.location_code,
-            device_id = EXCLUDED.device_id,
-            updated_at = NOW()
-        RETURNING 1
+    sums AS (
+        SELECT table_name, SUM(delta) AS delta, COUNT(*) AS rows_folded
+        FROM gone
+        GROUP BY table_name
     ),
-    deleted AS (
-        DELETE FROM scan_ingest_backlog
-        WHERE id IN (SELECT id FROM candidates)
+    base AS (
+        INSERT INTO scan_ingest_backlog_stats (table_name, pending)
+        SELECT table_name, delta FROM sums
+        ON CONFLICT (table_name) DO UPDATE
+        SET pending = scan_ingest_backlog_stats.pending + EXCLUDED.pending,
+            updated_at = NOW()
         RETURNING 1
     )
-    SELECT COALESCE(COUNT(*), 0) INTO processed FROM deleted;
+    SELECT COALESCE(SUM(rows_folded), 0) INTO folded FROM sums;
+    RETURN folded;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION track_scan_backlog_count()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    delta BIGINT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO delta FROM inserted;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT -COUNT(*) INTO delta FROM deleted;
+    ELSE
+        -- TRUNCATE holds ACCESS EXCLUSIVE, so no other transaction has pending deltas
+        DELETE FROM scan_ingest_backlog_stats_delta WHERE table_name = TG_TABLE_NAME;
+        UPDATE scan_ingest_backlog_stats
+        SET pending = 0, updated_at = NOW()
+        WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END IF;
+
+    IF delta <> 0 THEN
+        INSERT INTO scan_ingest_backlog_stats_delta (table_name, delta)
+        VALUES (TG_TABLE_NAME, delta);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- The partitioned layout (schema_partitioned.sql) replaces these triggers and
+-- refresh_scan_backlog_stats() with versions that only count unprocessed rows;
+-- skip them there so re-running this file does not swap the plain ones back in.
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scan_ingest_backlog'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_count_insert ON scan_ingest_backlog;
+    CREATE TRIGGER trg_scan_ingest_backlog_count_insert
+        AFTER INSERT ON scan_ingest_backlog
+        REFERENCING NEW TABLE AS inserted
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION track_scan_backlog_count();
+
+    DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_count_delete ON scan_ingest_backlog;
+    CREATE TRIGGER trg_scan_ingest_backlog_count_delete
+        AFTER DELETE ON scan_ingest_backlog
+        REFERENCING OLD TABLE AS deleted
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION track_scan_backlog_count();
+
+    DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_count_truncate ON scan_ingest_backlog;
+    CREATE TRIGGER trg_scan_ingest_backlog_count_truncate
+        AFTER TRUNCATE ON scan_ingest_backlog
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION track_scan_backlog_count();
+
+    CREATE OR REPLACE FUNCTION refresh_scan_backlog_stats()
+    RETURNS BIGINT
+    LANGUAGE plpgsql
+    AS $fn$
+    DECLARE
+        total BIGINT;
+    BEGIN
+        LOCK TABLE scan_ingest_backlog IN SHARE MODE;
+        SELECT COUNT(*) INTO total FROM scan_ingest_backlog;
+        DELETE FROM scan_ingest_backlog_stats_delta WHERE table_name = 'scan_ingest_backlog';
+        INSERT INTO scan_ingest_backlog_stats (table_name, pending)
+        VALUES ('scan_ingest_backlog', total)
+        ON CONFLICT (table_name) DO UPDATE
+        SET pending = EXCLUDED.pending, updated_at = NOW();
+        RETURN total;
+    END;
+    $fn$;
+
+    PERFORM refresh_scan_backlog_stats();
+END;
+$$;
+
+-- Quarantine for backlog rows that cannot be drained (missing order/location codes).
+-- Rows keep their original backlog id so they can be traced and requeued.
+CREATE TABLE IF NOT EXISTS scan_ingest_dead_letter (
+    id BIGINT PRIMARY KEY,
+    payload JSONB NOT NULL,
+    received_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    reason TEXT NOT NULL,
+    quarantined_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_scan_ingest_dead_letter_quarantined_at
+    ON scan_ingest_dead_letter (quarantined_at DESC);
+
+-- Optional target table (to be adjusted based on final schema)
+CREATE TABLE IF NOT EXISTS part_locations (
+    order_code TEXT PRIMARY KEY,
+    location_code TEXT NOT NULL,
+    device_id TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- Monotonic change sequence for delta sync (/api/v1/part-locations/changes). Every
+-- upsert takes a new value; the drain serializes upsert..commit with an advisory lock
+-- so values become visible in order. Adding the column backfills existing rows.
+CREATE SEQUENCE IF NOT EXISTS part_locations_change_seq;
+ALTER TABLE part_locations
+    ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('part_locations_change_seq');
+ALTER SEQUENCE part_locations_change_seq OWNED BY part_locations.change_seq;
+
+-- Also serves MAX(change_seq) for the listing ETag.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_part_locations_change_seq
+    ON part_locations (change_seq);
+
+-- Newest-first listing and keyset pagination on (updated_at, order_code).
+CREATE INDEX IF NOT EXISTS idx_part_locations_updated_order
+    ON part_locations (updated_at DESC, order_code DESC);
+
+-- Reverse lookup: orders currently at one location, newest first
+-- (GET /api/v1/locations/<location_code>/orders). Order lookups use the primary key.
+CREATE INDEX IF NOT EXISTS idx_part_locations_location_updated
+    ON part_locations (location_code, updated_at DESC, order_code DESC);
+
+-- Append-only movement trail written by the drain (one row per consumed scan,
+-- including scans superseded within a batch). moved_at is the scan's received_at.
+-- Rows arrive roughly in moved_at order, so a BRIN index keeps time-window scans
+-- cheap at a fraction of a btree's size; per-order trails use the btree.
+CREATE TABLE IF NOT EXISTS part_location_history (
+    id BIGSERIAL PRIMARY KEY,
+    backlog_id BIGINT,
+    order_code TEXT NOT NULL,
+    location_code TEXT NOT NULL,
+    device_id TEXT,
+    moved_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    recorded_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS brin_part_location_history_moved_at
+    ON part_location_history USING BRIN (moved_at);
+
+CREATE INDEX IF NOT EXISTS idx_part_location_history_order_moved
+    ON part_location_history (order_code, moved_at DESC, id DESC);
+
+-- Stored procedure for draining backlog (placeholder logic). The partitioned layout
+-- has its own version that marks rows processed, so it is skipped there as well.
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scan_ingest_backlog'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    CREATE OR REPLACE FUNCTION drain_scan_backlog(limit_count INTEGER DEFAULT 100)
+    RETURNS INTEGER
+    LANGUAGE plpgsql
+    AS $fn$
+    DECLARE
+        processed INTEGER := 0;
+        orders TEXT[];
+        locations TEXT[];
+        devices TEXT[];
+    BEGIN
+        WITH candidates AS (
+            SELECT id, payload, received_at, order_code, location_code, device_id
+            FROM scan_ingest_backlog
+            ORDER BY received_at, id
+            LIMIT limit_count
+            FOR UPDATE SKIP LOCKED
+        ),
+        quarantined AS (
+            -- Rows without order/location codes (queued before chk_scan_ingest_backlog_codes)
+            -- move to the dead-letter table
+            DELETE FROM scan_ingest_backlog
+            WHERE id IN (
+                SELECT id FROM candidates
+                WHERE order_code IS NULL OR location_code IS NULL
+            )
+            RETURNING id, payload, received_at, order_code
+        ),
+        dead_letter AS (
+            INSERT INTO scan_ingest_dead_letter (id, payload, received_at, reason)
+            SELECT
+                id,
+                payload,
+                received_at,
+                CASE
+                    WHEN order_code IS NULL THEN 'missing-order_code'
+                    ELSE 'missing-location_code'
+                END
+            FROM quarantined
+            ON CONFLICT (id) DO NOTHING
+            RETURNING 1
+        ),
+        latest AS (
+            -- Last write wins: keep only the newest scan per order_code in this batch
+            SELECT DISTINCT ON (order_code)
+                order_code,
+                location_code,
+                device_id
+            FROM candidates
+            WHERE order_code IS NOT NULL
+              AND location_code IS NOT NULL
+            ORDER BY order_code, received_at DESC, id DESC
+        ),
+        deleted AS (
+            DELETE FROM scan_ingest_backlog
+            WHERE id IN (SELECT id FROM candidates)
+              AND id NOT IN (SELECT id FROM quarantined)
+            RETURNING id, order_code, location_code, device_id, received_at
+        ),
+        history AS (
+            INSERT INTO part_location_history (backlog_id, order_code, location_code, device_id, moved_at)
+            SELECT id, order_code, location_code, device_id, received_at
+            FROM deleted
+            RETURNING 1
+        )
+        SELECT
+            (SELECT COUNT(*) FROM deleted),
+            array_agg(order_code),
+            array_agg(location_code),
+            array_agg(device_id)
+        INTO processed, orders, locations, devices
+        FROM latest;
+
+        -- change_seq is assigned in a second, short statement. The advisory lock (same key as
+        -- the Python drain) keeps change_seq order == commit order, and is held only from here
+        -- to the caller's commit, so concurrent drains overlap on select/consume/history.
+        IF orders IS NOT NULL THEN
+            PERFORM pg_advisory_xact_lock(hashtext('part_locations.change_seq'));
+            INSERT INTO part_locations (order_code, location_code, device_id, updated_at)
+            SELECT batch.order_code, batch.location_code, batch.device_id, NOW()
+            FROM unnest(orders, locations, devices) AS batch(order_code, location_code, device_id)
+            ON CONFLICT (order_code)
+            DO UPDATE SET
+                location_code = EXCLUDED.location_code,
+                device_id = EXCLUDED.device_id,
+                updated_at = NOW(),
+                change_seq = DEFAULT;
+        END IF;
 
-    RETURN processed;
+        RETURN processed;
+    END;
+    $fn$;
 END;
 $$;
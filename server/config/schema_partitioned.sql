@@ -0,0 +1,491 @@
+-- Optional time-partitioned layout for scan_ingest_backlog.
+--
+-- Apply after schema.sql (scripts/init_db.sh <dsn> partitioned [day|hour]). The first
+-- run converts the plain table in place; later runs only refresh functions/triggers.
+-- The drain marks rows with processed_at instead of deleting them, and
+-- drop_drained_scan_backlog_partitions() drops whole partitions once every row in a
+-- past range is processed, so sustained ingest does not leave dead tuples behind.
+-- Upcoming partitions are pre-created by every run of this file and then by the app's
+-- partition maintainer (or cron); see ensure_scan_backlog_partitions().
+-- Partition bounds are UTC; keep the same granularity for the lifetime of the table.
+
+-- Create partitions from from_ts (default: now) up to `premake` ranges ahead.
+CREATE OR REPLACE FUNCTION ensure_scan_backlog_partitions(
+    granularity TEXT DEFAULT 'day',
+    premake INTEGER DEFAULT 2,
+    from_ts TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    parent TEXT DEFAULT 'scan_ingest_backlog'
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    step INTERVAL;
+    suffix_format TEXT;
+    lower_bound TIMESTAMP;
+    last_bound TIMESTAMP;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    IF granularity = 'day' THEN
+        step := INTERVAL '1 day';
+        suffix_format := 'YYYYMMDD';
+    ELSIF granularity = 'hour' THEN
+        step := INTERVAL '1 hour';
+        suffix_format := 'YYYYMMDDHH24';
+    ELSE
+        RAISE EXCEPTION 'unsupported partition granularity: %', granularity;
+    END IF;
+
+    lower_bound := date_trunc(granularity, COALESCE(LEAST(from_ts, NOW()), NOW()) AT TIME ZONE 'UTC');
+    last_bound := date_trunc(granularity, NOW() AT TIME ZONE 'UTC') + step * premake;
+
+    WHILE lower_bound <= last_bound LOOP
+        partition_name := format('%s_p%s', parent, to_char(lower_bound, suffix_format));
+        IF to_regclass(partition_name) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name,
+                    parent,
+                    lower_bound AT TIME ZONE 'UTC',
+                    (lower_bound + step) AT TIME ZONE 'UTC'
+                );
+                created := created + 1;
+            EXCEPTION WHEN others THEN
+                -- e.g. the default partition already holds rows for this range
+                RAISE WARNING 'could not create partition %: %', partition_name, SQLERRM;
+            END;
+        END IF;
+        lower_bound := lower_bound + step;
+    END LOOP;
+
+    RETURN created;
+END;
+$$;
+
+-- Past range partitions whose rows are all processed. The check is a plain SELECT on each
+-- partition (ACCESS SHARE only, served by idx_scan_ingest_backlog_pending), so partitions
+-- that still hold pending rows are never locked. `bound` is the partition bound clause
+-- ("FOR VALUES FROM (...) TO (...)") and `detach_pending` marks a CONCURRENTLY detach that
+-- was interrupted and needs FINALIZE.
+CREATE OR REPLACE FUNCTION drained_scan_backlog_partitions(parent TEXT DEFAULT 'scan_ingest_backlog')
+RETURNS TABLE (partition_name TEXT, bound TEXT, detach_pending BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    part RECORD;
+    part_bound TEXT;
+    upper_bound TIMESTAMP WITH TIME ZONE;
+    has_pending BOOLEAN;
+BEGIN
+    -- pg_get_expr() and the SELECT both take ACCESS SHARE on the partition; skip partitions
+    -- another session is detaching instead of queueing behind it.
+    SET LOCAL lock_timeout = '200ms';
+    FOR part IN
+        SELECT i.inhrelid::regclass AS rel, i.inhdetachpending
+        FROM pg_inherits i
+        WHERE i.inhparent = parent::regclass
+    LOOP
+        BEGIN
+            SELECT pg_get_expr(c.relpartbound, c.oid) INTO part_bound FROM pg_class c WHERE c.oid = part.rel;
+            IF part_bound = 'DEFAULT' THEN
+                CONTINUE;
+            END IF;
+
+            upper_bound := substring(part_bound FROM 'TO \(''([^'']+)''\)')::timestamptz;
+            IF upper_bound IS NULL OR upper_bound > NOW() THEN
+                CONTINUE;
+            END IF;
+
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE processed_at IS NULL)', part.rel)
+                INTO has_pending;
+        EXCEPTION WHEN lock_not_available THEN
+            CONTINUE;
+        END;
+        IF NOT has_pending THEN
+            partition_name := part.rel::text;
+            bound := part_bound;
+            detach_pending := part.inhdetachpending;
+            RETURN NEXT;
+        END IF;
+    END LOOP;
+END;
+$$;
+
+-- Detach and drop one drained partition in the caller's transaction; returns false (and
+-- leaves it attached) when the parent lock is busy or pending rows arrived since it was
+-- listed (e.g. spool replay with the original received_at). A plain DETACH needs ACCESS
+-- EXCLUSIVE on the parent, so the wait is capped and the caller should commit right after.
+-- DETACH ... CONCURRENTLY is not allowed inside a function or while a default partition
+-- exists; the Python maintenance uses it when the layout has no default partition.
+CREATE OR REPLACE FUNCTION drop_scan_backlog_partition(
+    partition_name TEXT,
+    parent TEXT DEFAULT 'scan_ingest_backlog'
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    has_pending BOOLEAN;
+BEGIN
+    SET LOCAL lock_timeout = '200ms';
+    BEGIN
+        EXECUTE format('ALTER TABLE %s DETACH PARTITION %s', parent::regclass, partition_name::regclass);
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE processed_at IS NULL)', partition_name::regclass)
+            INTO has_pending;
+        IF has_pending THEN
+            -- roll back the detach with this block
+            RAISE EXCEPTION 'partition % received pending rows', partition_name USING ERRCODE = 'object_in_use';
+        END IF;
+        EXECUTE format('DROP TABLE %s', partition_name::regclass);
+        RETURN TRUE;
+    EXCEPTION WHEN others THEN
+        RAISE WARNING 'kept backlog partition %: %', partition_name, SQLERRM;
+        RETURN FALSE;
+    END;
+END;
+$$;
+
+-- For deployments that only use SQL (cron): drop every drained past partition, each in its
+-- own exception block so one busy partition does not abort the rest, and purge processed
+-- rows that landed in the default partition. Locks of dropped partitions are held until
+-- the caller commits; the Python maintenance commits after every partition instead.
+CREATE OR REPLACE FUNCTION drop_drained_scan_backlog_partitions(parent TEXT DEFAULT 'scan_ingest_backlog')
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    drained RECORD;
+    default_partition REGCLASS;
+    dropped INTEGER := 0;
+BEGIN
+    SELECT NULLIF(partdefid, 0)::regclass INTO default_partition
+    FROM pg_partitioned_table
+    WHERE partrelid = parent::regclass;
+    IF default_partition IS NOT NULL THEN
+        EXECUTE format('DELETE FROM %s WHERE processed_at IS NOT NULL', default_partition);
+    END IF;
+
+    FOR drained IN SELECT * FROM drained_scan_backlog_partitions(parent) LOOP
+        IF drop_scan_backlog_partition(drained.partition_name, parent) THEN
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+
+    RETURN dropped;
+END;
+$$;
+
+-- Drop and re-attach helpers for the Python maintenance after DETACH ... CONCURRENTLY
+-- (which must run as a top-level statement outside a transaction block).
+CREATE OR REPLACE FUNCTION finish_scan_backlog_partition_detach(
+    partition_name TEXT,
+    bound TEXT,
+    parent TEXT DEFAULT 'scan_ingest_backlog'
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    has_pending BOOLEAN;
+BEGIN
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE processed_at IS NULL)', partition_name::regclass)
+        INTO has_pending;
+    IF has_pending THEN
+        -- ATTACH only needs SHARE UPDATE EXCLUSIVE on the parent
+        EXECUTE format('ALTER TABLE %s ATTACH PARTITION %s %s', parent::regclass, partition_name::regclass, bound);
+        RETURN FALSE;
+    END IF;
+    EXECUTE format('DROP TABLE %s', partition_name::regclass);
+    RETURN TRUE;
+END;
+$$;
+
+-- Convert the plain backlog table into the partitioned layout (no-op once converted).
+-- Rows that would violate chk_scan_ingest_backlog_codes go to the dead-letter table.
+CREATE OR REPLACE FUNCTION partition_scan_backlog(granularity TEXT DEFAULT 'day', premake INTEGER DEFAULT 2)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    oldest TIMESTAMP WITH TIME ZONE;
+    moved BIGINT := 0;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'scan_ingest_backlog'::regclass) = 'p' THEN
+        RETURN 0;
+    END IF;
+
+    LOCK TABLE scan_ingest_backlog IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE scan_ingest_backlog RENAME TO scan_ingest_backlog_legacy;
+    ALTER INDEX scan_ingest_backlog_pkey RENAME TO scan_ingest_backlog_legacy_pkey;
+    DROP INDEX IF EXISTS idx_scan_ingest_backlog_received_at;
+    DROP INDEX IF EXISTS idx_scan_ingest_backlog_drain_order;
+    DROP INDEX IF EXISTS uq_scan_ingest_backlog_scan_id;
+
+    CREATE TABLE scan_ingest_backlog (
+        id BIGINT NOT NULL DEFAULT nextval('scan_ingest_backlog_id_seq'),
+        payload JSONB NOT NULL,
+        received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        order_code TEXT GENERATED ALWAYS AS (NULLIF(btrim(payload->>'order_code'), '')) STORED,
+        location_code TEXT GENERATED ALWAYS AS (NULLIF(btrim(payload->>'location_code'), '')) STORED,
+        device_id TEXT GENERATED ALWAYS AS (NULLIF(btrim(payload->>'device_id'), '')) STORED,
+        processed_at TIMESTAMP WITH TIME ZONE,
+        PRIMARY KEY (id, received_at),
+        CONSTRAINT chk_scan_ingest_backlog_codes
+            CHECK (order_code IS NOT NULL AND location_code IS NOT NULL)
+    ) PARTITION BY RANGE (received_at);
+
+    CREATE TABLE scan_ingest_backlog_default PARTITION OF scan_ingest_backlog DEFAULT;
+
+    SELECT MIN(received_at) INTO oldest FROM scan_ingest_backlog_legacy;
+    PERFORM ensure_scan_backlog_partitions(granularity, premake, oldest);
+
+    INSERT INTO scan_ingest_dead_letter (id, payload, received_at, reason)
+    SELECT
+        id,
+        payload,
+        received_at,
+        CASE WHEN order_code IS NULL THEN 'missing-order_code' ELSE 'missing-location_code' END
+    FROM scan_ingest_backlog_legacy
+    WHERE order_code IS NULL OR location_code IS NULL
+    ON CONFLICT (id) DO NOTHING;
+
+    INSERT INTO scan_ingest_backlog (id, payload, received_at)
+    SELECT id, payload, received_at
+    FROM scan_ingest_backlog_legacy
+    WHERE order_code IS NOT NULL AND location_code IS NOT NULL;
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    -- Keep the id sequence (and therefore dead-letter ids) continuous.
+    ALTER SEQUENCE scan_ingest_backlog_id_seq OWNED BY scan_ingest_backlog.id;
+    DROP TABLE scan_ingest_backlog_legacy;
+    DELETE FROM scan_ingest_backlog_stats WHERE table_name = 'scan_ingest_backlog_legacy';
+    DELETE FROM scan_ingest_backlog_stats_delta WHERE table_name = 'scan_ingest_backlog_legacy';
+
+    RETURN moved;
+END;
+$$;
+
+SELECT partition_scan_backlog(
+    COALESCE(NULLIF(current_setting('scan_backlog.partition_granularity', true), ''), 'day')
+);
+
+-- Pre-create upcoming partitions on every run, not only on conversion, so ingest never
+-- depends on the drain having run maintenance (the app and cron keep this going afterwards).
+-- The granularity of existing partitions wins over the setting so a re-run never creates
+-- overlapping ranges.
+DO $$
+DECLARE
+    requested TEXT := COALESCE(NULLIF(current_setting('scan_backlog.partition_granularity', true), ''), 'day');
+    existing TEXT;
+BEGIN
+    SELECT CASE
+               WHEN substring(bound FROM 'TO \(''([^'']+)''\)')::timestamptz
+                    - substring(bound FROM 'FROM \(''([^'']+)''\)')::timestamptz <= INTERVAL '1 hour'
+               THEN 'hour'
+               ELSE 'day'
+           END
+    INTO existing
+    FROM (
+        SELECT pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'scan_ingest_backlog'::regclass
+    ) parts
+    WHERE bound <> 'DEFAULT'
+    LIMIT 1;
+
+    IF existing IS NOT NULL AND existing <> requested THEN
+        RAISE WARNING 'scan_ingest_backlog is partitioned by %, ignoring requested granularity %', existing, requested;
+    END IF;
+    PERFORM ensure_scan_backlog_partitions(
+        COALESCE(existing, requested),
+        COALESCE(NULLIF(current_setting('scan_backlog.partition_premake', true), ''), '2')::integer
+    );
+END;
+$$;
+
+-- Pending rows in drain order; processed rows drop out of the index.
+CREATE INDEX IF NOT EXISTS idx_scan_ingest_backlog_pending
+    ON scan_ingest_backlog (received_at, id)
+    WHERE processed_at IS NULL;
+
+-- Triggers: the conversion replaces the table, so (re)create them on the new parent.
+-- Statement-level triggers on the partitioned parent fire once per statement.
+SELECT create_scan_backlog_notify_trigger();
+
+-- Pending counter: inserts add, marking processed (or deleting unprocessed rows) subtracts.
+CREATE OR REPLACE FUNCTION track_scan_backlog_pending()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    delta BIGINT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO delta FROM inserted WHERE processed_at IS NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT -COUNT(*) INTO delta FROM deleted WHERE processed_at IS NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT -COUNT(*) INTO delta
+        FROM deleted o
+        JOIN inserted n ON n.id = o.id
+        WHERE o.processed_at IS NULL AND n.processed_at IS NOT NULL;
+    ELSE
+        DELETE FROM scan_ingest_backlog_stats_delta WHERE table_name = TG_TABLE_NAME;
+        UPDATE scan_ingest_backlog_stats
+        SET pending = 0, updated_at = NOW()
+        WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END IF;
+
+    -- Append-only delta rows (see schema.sql): no shared row lock between ingest and drains
+    IF delta <> 0 THEN
+        INSERT INTO scan_ingest_backlog_stats_delta (table_name, delta)
+        VALUES (TG_TABLE_NAME, delta);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_count_insert ON scan_ingest_backlog;
+CREATE TRIGGER trg_scan_ingest_backlog_count_insert
+    AFTER INSERT ON scan_ingest_backlog
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION track_scan_backlog_pending();
+
+DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_count_delete ON scan_ingest_backlog;
+CREATE TRIGGER trg_scan_ingest_backlog_count_delete
+    AFTER DELETE ON scan_ingest_backlog
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION track_scan_backlog_pending();
+
+DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_count_update ON scan_ingest_backlog;
+CREATE TRIGGER trg_scan_ingest_backlog_count_update
+    AFTER UPDATE ON scan_ingest_backlog
+    REFERENCING OLD TABLE AS deleted NEW TABLE AS inserted
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION track_scan_backlog_pending();
+
+DROP TRIGGER IF EXISTS trg_scan_ingest_backlog_count_truncate ON scan_ingest_backlog;
+CREATE TRIGGER trg_scan_ingest_backlog_count_truncate
+    AFTER TRUNCATE ON scan_ingest_backlog
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION track_scan_backlog_pending();
+
+CREATE OR REPLACE FUNCTION refresh_scan_backlog_stats()
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    total BIGINT;
+BEGIN
+    LOCK TABLE scan_ingest_backlog IN SHARE MODE;
+    SELECT COUNT(*) INTO total FROM scan_ingest_backlog WHERE processed_at IS NULL;
+    DELETE FROM scan_ingest_backlog_stats_delta WHERE table_name = 'scan_ingest_backlog';
+    INSERT INTO scan_ingest_backlog_stats (table_name, pending)
+    VALUES ('scan_ingest_backlog', total)
+    ON CONFLICT (table_name) DO UPDATE
+    SET pending = EXCLUDED.pending, updated_at = NOW();
+    RETURN total;
+END;
+$$;
+
+SELECT refresh_scan_backlog_stats();
+
+-- Same drain as schema.sql, but processed rows are marked instead of deleted.
+-- Deployments that only use this procedure must also schedule
+-- ensure_scan_backlog_partitions() / drop_drained_scan_backlog_partitions() (e.g. cron).
+CREATE OR REPLACE FUNCTION drain_scan_backlog(limit_count INTEGER DEFAULT 100)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    processed INTEGER := 0;
+    orders TEXT[];
+    locations TEXT[];
+    devices TEXT[];
+BEGIN
+    WITH candidates AS (
+        SELECT id, payload, received_at, order_code, location_code, device_id
+        FROM scan_ingest_backlog
+        WHERE processed_at IS NULL
+        ORDER BY received_at, id
+        LIMIT limit_count
+        FOR UPDATE SKIP LOCKED
+    ),
+    quarantined AS (
+        DELETE FROM scan_ingest_backlog
+        WHERE id IN (
+            SELECT id FROM candidates
+            WHERE order_code IS NULL OR location_code IS NULL
+        )
+        RETURNING id, payload, received_at, order_code
+    ),
+    dead_letter AS (
+        INSERT INTO scan_ingest_dead_letter (id, payload, received_at, reason)
+        SELECT
+            id,
+            payload,
+            received_at,
+            CASE
+                WHEN order_code IS NULL THEN 'missing-order_code'
+                ELSE 'missing-location_code'
+            END
+        FROM quarantined
+        ON CONFLICT (id) DO NOTHING
+        RETURNING 1
+    ),
+    latest AS (
+        SELECT DISTINCT ON (order_code)
+            order_code,
+            location_code,
+            device_id
+        FROM candidates
+        WHERE order_code IS NOT NULL
+          AND location_code IS NOT NULL
+        ORDER BY order_code, received_at DESC, id DESC
+    ),
+    marked AS (
+        UPDATE scan_ingest_backlog
+        SET processed_at = NOW()
+        WHERE id IN (SELECT id FROM candidates)
+          AND id NOT IN (SELECT id FROM quarantined)
+        RETURNING id, order_code, location_code, device_id, received_at
+    ),
+    history AS (
+        INSERT INTO part_location_history (backlog_id, order_code, location_code, device_id, moved_at)
+        SELECT id, order_code, location_code, device_id, received_at
+        FROM marked
+        RETURNING 1
+    )
+    SELECT
+        (SELECT COUNT(*) FROM marked),
+        array_agg(order_code),
+        array_agg(location_code),
+        array_agg(device_id)
+    INTO processed, orders, locations, devices
+    FROM latest;
+
+    -- change_seq is assigned in a second, short statement. The advisory lock (same key as
+    -- the Python drain) keeps change_seq order == commit order, and is held only from here
+    -- to the caller's commit, so concurrent drains overlap on select/consume/history.
+    IF orders IS NOT NULL THEN
+        PERFORM pg_advisory_xact_lock(hashtext('part_locations.change_seq'));
+        INSERT INTO part_locations (order_code, location_code, device_id, updated_at)
+        SELECT batch.order_code, batch.location_code, batch.device_id, NOW()
+        FROM unnest(orders, locations, devices) AS batch(order_code, location_code, device_id)
+        ON CONFLICT (order_code)
+        DO UPDATE SET
+            location_code = EXCLUDED.location_code,
+            device_id = EXCLUDED.device_id,
+            updated_at = NOW(),
+            change_seq = DEFAULT;
+    END IF;
+
+    RETURN processed;
+END;
+$$;
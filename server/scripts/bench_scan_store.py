@@ -0,0 +1,92 @@
+"""Benchmark the ring-buffer scan store against the previous deque buffer.
+
+DB 不要。容量ごとにバッファを満杯にし、保持メモリ（tracemalloc）、保存スループット、
+`recent(50)` の 1 回あたりの時間を比べる。
+
+    python scripts/bench_scan_store.py --capacities 10000,100000,1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List
+
+from raspberrypiserver.repositories.scans import ScanRingBuffer
+
+
+class DequeStore:
+    """The former InMemoryScanRepository buffer (full dicts, copy on every recent())."""
+
+    def __init__(self, capacity: int) -> None:
+        self._items: Deque[Dict] = deque(maxlen=capacity)
+
+    def append(self, payload: Dict) -> None:
+        self._items.append(payload)
+
+    def recent(self, limit: int) -> List[Dict]:
+        return list(self._items)[-limit:]
+
+
+def payloads(count: int) -> Iterable[Dict]:
+    # JSON から作り直し、実運用と同じく文字列が毎回別オブジェクトになるようにする
+    for index in range(count):
+        yield json.loads(
+            json.dumps(
+                {
+                    "order_code": f"ORD-{index % 20000:06d}",
+                    "location_code": f"RACK-{index % 200:03d}",
+                    "device_id": f"PIZERO-{index % 8:02d}",
+                    "metadata": {"scan_id": f"scan-{index}"},
+                }
+            )
+        )
+
+
+def measure(factory: Callable[[int], object], capacity: int, recent_calls: int) -> Dict[str, float]:
+    gc.collect()
+    tracemalloc.start()
+    store = factory(capacity)
+    started = time.perf_counter()
+    for payload in payloads(capacity):
+        store.append(payload)
+    save_seconds = time.perf_counter() - started
+    retained, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(recent_calls):
+        store.recent(50)
+    recent_seconds = (time.perf_counter() - started) / recent_calls
+    return {
+        "mib": retained / (1024 * 1024),
+        "saves_per_sec": capacity / save_seconds if save_seconds else 0.0,
+        "recent_us": recent_seconds * 1_000_000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark in-memory scan stores")
+    parser.add_argument("--capacities", default="10000,100000,1000000", help="Comma separated capacities")
+    parser.add_argument("--recent-calls", type=int, default=200, help="recent(50) calls per measurement")
+    args = parser.parse_args()
+
+    capacities = [int(value) for value in args.capacities.split(",") if value.strip()]
+    print(f"{'capacity':>9} {'impl':>6} {'MiB':>9} {'saves/s':>12} {'recent(50) µs':>14}")
+    for capacity in capacities:
+        for name, factory in (("deque", DequeStore), ("ring", ScanRingBuffer)):
+            # deque は recent() が全件コピーなので大容量では呼び出し回数を減らす
+            calls = max(1, args.recent_calls * 10000 // capacity) if name == "deque" else args.recent_calls
+            result = measure(factory, capacity, calls)
+            print(
+                f"{capacity:>9} {name:>6} {result['mib']:>9.1f} "
+                f"{result['saves_per_sec']:>12.0f} {result['recent_us']:>14.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
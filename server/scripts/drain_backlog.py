@@ -4,9 +4,14 @@ from __future__ import annotations
 
 import argparse
 import logging
+import multiprocessing
 
 import psycopg
 
+from raspberrypiserver.services.backlog import BacklogDrainService
+from raspberrypiserver.services.backlog_listener import BacklogNotifyListener
+from raspberrypiserver.services.drain_worker import DrainWorker
+
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
@@ -19,13 +24,167 @@ def drain(dsn: str, limit_count: int) -> int:
         return processed
 
 
+def drain_partition(dsn: str, limit_count: int, partitions: int, partition: int, layout: str = "plain") -> int:
+    """Drain one order_code hash partition until it is empty."""
+    service = BacklogDrainService(
+        dsn=dsn, limit=limit_count, partitions=partitions, partition=partition, layout=layout
+    )
+    total = 0
+    while True:
+        drained = service.drain_once()
+        total += drained
+        if drained + service.last_run["quarantined"] == 0:
+            return total
+
+
+def maintain_partitions(dsn: str, granularity: str, premake: int) -> dict:
+    """Create upcoming partitions and drop drained ones once (for cron, independent of draining)."""
+    service = BacklogDrainService(
+        dsn=dsn, layout="partitioned", partition_granularity=granularity, partition_premake=premake
+    )
+    return service.maintain_partitions()
+
+
+def drain_parallel(dsn: str, limit_count: int, workers: int, layout: str = "plain") -> int:
+    """
+    Drain with `workers` processes, each owning a disjoint set of order_codes.
+
+    同じ order_code は常に同じプロセスが受信順に処理するため、古い所在で上書きされない。
+    """
+    if workers <= 1:
+        return drain_partition(dsn, limit_count, 1, 0, layout)
+    with multiprocessing.Pool(processes=workers) as pool:
+        results = pool.starmap(
+            drain_partition,
+            [(dsn, limit_count, workers, partition, layout) for partition in range(workers)],
+        )
+    return sum(results)
+
+
+def follow(
+    dsn: str,
+    limit_count: int,
+    min_batch: int,
+    target_ms: int,
+    idle_seconds: float,
+    listen: bool = False,
+    partitions: int = 1,
+    partition: int = 0,
+    layout: str = "plain",
+) -> None:
+    """Run the adaptive drain worker in the foreground until interrupted."""
+    service = BacklogDrainService(
+        dsn=dsn, limit=limit_count, partitions=partitions, partition=partition, layout=layout
+    )
+    worker = DrainWorker(
+        service,
+        max_batch=limit_count,
+        min_batch=min_batch,
+        target_duration=target_ms / 1000,
+        idle_interval=idle_seconds,
+    )
+    listener = BacklogNotifyListener(dsn, on_notify=worker.signal).start() if listen else None
+    LOGGER.info(
+        "Drain worker started (max_batch=%s, idle=%ss, listen=%s, partition=%s/%s)",
+        limit_count,
+        idle_seconds,
+        listen,
+        partition,
+        partitions,
+    )
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        LOGGER.info("Drain worker stopped: %s", worker.stats())
+    finally:
+        if listener:
+            listener.stop()
+
+
+def follow_parallel(args: argparse.Namespace) -> None:
+    processes = [
+        multiprocessing.Process(
+            target=follow,
+            args=(
+                args.dsn,
+                args.limit,
+                args.min_batch,
+                args.target_ms,
+                args.idle_seconds,
+                args.listen,
+                args.workers,
+                partition,
+                args.layout,
+            ),
+            name=f"drain-worker-{partition}",
+        )
+        for partition in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Drain scan backlog")
     parser.add_argument("--dsn", required=True, help="PostgreSQL DSN")
-    parser.add_argument("--limit", type=int, default=100, help="Records to drain per run")
+    parser.add_argument("--limit", type=int, default=100, help="Records to drain per run (max batch with --follow)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Drain with N processes partitioned by order_code hash (0 = stored procedure, single run)",
+    )
+    parser.add_argument("--follow", action="store_true", help="Keep draining with adaptive batch sizing")
+    parser.add_argument("--min-batch", type=int, default=10, help="Smallest batch size with --follow")
+    parser.add_argument("--target-ms", type=int, default=200, help="Target duration per drain with --follow")
+    parser.add_argument("--idle-seconds", type=float, default=5.0, help="Sleep when backlog is empty (--follow)")
+    parser.add_argument(
+        "--listen",
+        action="store_true",
+        help="Wake on NOTIFY scan_backlog (--follow); --idle-seconds becomes the fallback poll",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=("plain", "partitioned"),
+        default="plain",
+        help="Backlog table layout (partitioned = mark processed rows, see schema_partitioned.sql)",
+    )
+    parser.add_argument(
+        "--maintain-partitions",
+        action="store_true",
+        help="Only create upcoming partitions and drop drained ones, then exit (partitioned layout, e.g. cron)",
+    )
+    parser.add_argument("--granularity", choices=("day", "hour"), default="day", help="Partition granularity")
+    parser.add_argument("--premake", type=int, default=2, help="Partitions to create ahead")
 
     args = parser.parse_args()
-    processed = drain(args.dsn, args.limit)
+    if args.maintain_partitions:
+        LOGGER.info("Partition maintenance: %s", maintain_partitions(args.dsn, args.granularity, args.premake))
+        return
+    if args.follow:
+        if args.workers > 1:
+            follow_parallel(args)
+        else:
+            follow(
+                args.dsn,
+                args.limit,
+                args.min_batch,
+                args.target_ms,
+                args.idle_seconds,
+                args.listen,
+                layout=args.layout,
+            )
+        return
+    if args.workers > 0:
+        processed = drain_parallel(args.dsn, args.limit, args.workers, args.layout)
+    else:
+        processed = drain(args.dsn, args.limit)
     LOGGER.info("Processed %s records", processed)
 
 
@@ -2,11 +2,23 @@
 set -euo pipefail
 
 if [[ -z "${1:-}" ]]; then
-  echo "Usage: $0 <dsn>"
+  echo "Usage: $0 <dsn> [plain|partitioned] [day|hour] [premake] [notify_channel]"
   exit 1
 fi
 
 dsn="$1"
+layout="${2:-plain}"
+granularity="${3:-day}"
+premake="${4:-2}"
+# BACKLOG_NOTIFY_CHANNEL と同じ値にする（INSERT トリガーがこのチャネルへ NOTIFY する）
+channel="${5:-scan_backlog}"
 
 dir="$(dirname "$0")/.."
-psql "$dsn" -f "$dir/config/schema.sql"
+PGOPTIONS="-c scan_backlog.notify_channel=$channel" psql "$dsn" -f "$dir/config/schema.sql"
+
+if [[ "$layout" == "partitioned" ]]; then
+  # 初回は既存の scan_ingest_backlog を時間パーティション構成へ移行する。
+  # 毎回 premake 区間先までのパーティションを作っておく（ドレインの有無に依存しない）
+  PGOPTIONS="-c scan_backlog.partition_granularity=$granularity -c scan_backlog.partition_premake=$premake -c scan_backlog.notify_channel=$channel" \
+    psql "$dsn" -v ON_ERROR_STOP=1 -f "$dir/config/schema_partitioned.sql"
+fi
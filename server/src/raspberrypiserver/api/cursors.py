@@ -0,0 +1,53 @@
+"""Opaque keyset pagination cursors shared by the read APIs."""
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last returned row (datetimes as ISO 8601)."""
+    plain = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(plain, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str], size: int) -> Optional[List[Any]]:
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    未指定なら None、壊れている／要素数が合わない場合は ValueError。
+    """
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as exc:
+        raise ValueError("invalid-cursor") from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("invalid-cursor")
+    return values
+
+
+def decode_time_cursor(token: Optional[str], key_type: type) -> Optional[List[Any]]:
+    """
+    Decode a `(timestamp, key)` cursor and check both element types.
+
+    時刻は ISO 8601 文字列、キーは `key_type`（order_code なら str、履歴 id なら int）。
+    型が合わないと DB 側で空結果になり 200 を返してしまうため、ここで ValueError にする。
+    """
+    values = decode_cursor(token, 2)
+    if values is None:
+        return None
+    stamp, key = values
+    if not isinstance(stamp, str) or not isinstance(key, key_type) or isinstance(key, bool):
+        raise ValueError("invalid-cursor")
+    try:
+        datetime.fromisoformat(stamp)
+    except ValueError as exc:
+        raise ValueError("invalid-cursor") from exc
+    return values
@@ -6,7 +6,13 @@ from http import HTTPStatus
 
 from flask import Blueprint, current_app, jsonify, request
 
-from raspberrypiserver.services.backlog import BacklogDrainService
+from raspberrypiserver.database import ConnectionPool
+from raspberrypiserver.repositories import (
+    CachedPartLocationRepository,
+    DatabaseScanRepository,
+    LogScanRepository,
+)
+from raspberrypiserver.services.backlog import BacklogDrainService, DeadLetterStillInvalid
 
 maintenance_bp = Blueprint("maintenance", __name__, url_prefix="/api/v1/admin")
 
@@ -68,15 +74,124 @@ def backlog_status():
             HTTPStatus.OK,
         )
 
-    pending = service.count_backlog()
-    return (
-        jsonify(
-            {
-                "status": "ok",
-                "pending": pending,
-                "drain_limit": service.limit,
-                "auto_drain_on_ingest": auto_limit,
-            }
-        ),
-        HTTPStatus.OK,
-    )
+    exact = request.args.get("exact", "").lower() in {"1", "true", "yes"}
+    stats = service.backlog_stats(exact=exact)
+    body = {
+        "status": "ok",
+        "pending": stats["pending"],
+        "pending_mode": stats["pending_mode"],
+        "oldest_pending_age_seconds": stats["oldest_pending_age_seconds"],
+        "drain_limit": service.limit,
+        "auto_drain_on_ingest": auto_limit,
+        "dead_letter": service.count_dead_letters(),
+        "metrics": service.metrics(),
+    }
+    if stats.get("stale"):
+        # DB への問い合わせに失敗したため前回の値を返している
+        body["stale"] = True
+    trigger = current_app.config.get("BACKLOG_DRAIN_TRIGGER")
+    if trigger is not None:
+        body["auto_drain"] = trigger.stats()
+    worker = current_app.config.get("BACKLOG_DRAIN_WORKER")
+    if worker is not None:
+        body["worker"] = worker.stats()
+    listener = current_app.config.get("BACKLOG_NOTIFY_LISTENER")
+    if listener is not None:
+        body["notify"] = listener.stats()
+    replayer = current_app.config.get("SCAN_SPOOL_REPLAYER")
+    if replayer is not None:
+        body["spool"] = replayer.stats()
+    repo = current_app.config.get("SCAN_REPOSITORY")
+    if isinstance(repo, DatabaseScanRepository) and repo.durability != "sync":
+        body["write_behind"] = repo.stats()
+    return jsonify(body), HTTPStatus.OK
+
+
+@maintenance_bp.route("/dead-letters", methods=["GET"])
+def list_dead_letters():
+    """List quarantined backlog rows (newest first)."""
+    service: BacklogDrainService | None = current_app.config.get("BACKLOG_DRAIN_SERVICE")
+    if not service or not service.is_configured():
+        return jsonify({"status": "disabled", "entries": []}), HTTPStatus.OK
+
+    limit = request.args.get("limit", default=50, type=int)
+    limit = max(1, min(limit, 500))
+    entries = [
+        {
+            "id": row.get("id"),
+            "payload": row.get("payload"),
+            "reason": row.get("reason"),
+            "received_at": str(row.get("received_at")) if row.get("received_at") else None,
+            "quarantined_at": str(row.get("quarantined_at")) if row.get("quarantined_at") else None,
+        }
+        for row in service.list_dead_letters(limit)
+    ]
+    return jsonify({"status": "ok", "entries": entries}), HTTPStatus.OK
+
+
+@maintenance_bp.route("/dead-letters/requeue", methods=["POST"])
+def requeue_dead_letters():
+    """
+    Move quarantined rows back into the backlog.
+
+    JSON ペイロード {"ids": [1, 2], "patch": {"location_code": "RACK-A1"}} を受け付け、
+    `patch` は payload にマージしてから戻す。
+    """
+    service: BacklogDrainService | None = current_app.config.get("BACKLOG_DRAIN_SERVICE")
+    if not service or not service.is_configured():
+        return (
+            jsonify({"status": "skipped", "reason": "backlog-drain-disabled"}),
+            HTTPStatus.SERVICE_UNAVAILABLE,
+        )
+
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get("ids")
+    patch = payload.get("patch")
+    if (
+        not isinstance(ids, list)
+        or not ids
+        or not all(isinstance(item, int) and not isinstance(item, bool) for item in ids)
+    ):
+        return jsonify({"status": "error", "reason": "invalid-ids"}), HTTPStatus.BAD_REQUEST
+    if patch is not None and not isinstance(patch, dict):
+        return jsonify({"status": "error", "reason": "invalid-patch"}), HTTPStatus.BAD_REQUEST
+
+    try:
+        requeued = service.requeue_dead_letters(ids, patch=patch)
+    except DeadLetterStillInvalid as exc:
+        invalid = [{"id": row_id, "reason": reason} for row_id, reason in sorted(exc.reasons.items())]
+        return jsonify({"status": "error", "reason": "still-invalid", "invalid": invalid}), HTTPStatus.BAD_REQUEST
+    except Exception as exc:  # noqa: BLE001
+        current_app.logger.warning("Dead-letter requeue failed: %s", exc)
+        return (
+            jsonify({"status": "error", "reason": "requeue-failed"}),
+            HTTPStatus.SERVICE_UNAVAILABLE,
+        )
+    return jsonify({"status": "ok", "requeued": requeued}), HTTPStatus.OK
+
+
+@maintenance_bp.route("/db-pool", methods=["GET"])
+def db_pool_status():
+    """Return shared connection pool statistics (in use, waiting, wait time)."""
+    pool: ConnectionPool | None = current_app.config.get("DB_POOL")
+    if pool is None:
+        return jsonify({"status": "disabled"}), HTTPStatus.OK
+    return jsonify({"status": "ok", "pool": pool.stats()}), HTTPStatus.OK
+
+
+@maintenance_bp.route("/part-location-cache", methods=["GET"])
+def part_location_cache_status():
+    """Return read-through cache statistics for the part-locations API (hits, misses, version)."""
+    repo = current_app.config.get("PART_LOCATION_REPOSITORY")
+    if not isinstance(repo, CachedPartLocationRepository):
+        return jsonify({"status": "disabled"}), HTTPStatus.OK
+    return jsonify({"status": "ok", "cache": repo.stats()}), HTTPStatus.OK
+
+
+@maintenance_bp.route("/scan-log", methods=["GET"])
+def scan_log_status():
+    """Return append-only scan log statistics (segments, fsync counters)."""
+    repo = current_app.config.get("SCAN_REPOSITORY")
+    if not isinstance(repo, LogScanRepository):
+        return jsonify({"status": "disabled"}), HTTPStatus.OK
+    return jsonify({"status": "ok", "log": repo.stats()}), HTTPStatus.OK
@@ -2,28 +2,227 @@
 
 from __future__ import annotations
 
+import hashlib
+from datetime import datetime, timezone
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional
+
 from flask import Blueprint, current_app, jsonify, request
 
-from raspberrypiserver.repositories import PartLocationRepository
+from raspberrypiserver.api.cursors import decode_cursor, decode_time_cursor, encode_cursor
+from raspberrypiserver.repositories import PartLocationHistoryRepository, PartLocationRepository
 
 part_locations_bp = Blueprint("part_locations", __name__, url_prefix="/api/v1")
 
 
 @part_locations_bp.route("/part-locations", methods=["GET"])
 def list_part_locations():
+    """
+    Return latest locations (newest first), keyset paginated on `(updated_at, order_code)`.
+
+    リポジトリが `snapshot()`（最新 `change_seq`）を返せる場合は強い ETag を付け、
+    `If-None-Match` が一致すれば行を読まずに 304 を返す。
+    """
+    limit = request.args.get("limit", default=200, type=int)
+    limit = max(1, min(limit, 500))
+    cursor = request.args.get("cursor")
+    try:
+        after = decode_time_cursor(cursor, str)
+    except ValueError:
+        return jsonify({"status": "error", "reason": "invalid-cursor"}), HTTPStatus.BAD_REQUEST
+
+    repo: PartLocationRepository = current_app.config["PART_LOCATION_REPOSITORY"]
+    etag = _listing_etag(repo, limit, cursor)
+    if etag and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=HTTPStatus.NOT_MODIFIED)
+        response.set_etag(etag)
+        return response
+
+    rows = list(repo.list(limit + 1, after=after) if after else repo.list(limit + 1))
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit and page:
+        next_cursor = encode_cursor([page[-1].get("updated_at"), page[-1].get("order_code")])
+
+    entries = [_location_entry(item) for item in page]
+    response = jsonify({"entries": entries, "next_cursor": next_cursor})
+    if etag:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _listing_etag(repo: PartLocationRepository, limit: int, cursor: Optional[str]) -> Optional[str]:
+    snapshot = getattr(repo, "snapshot", None)
+    latest = snapshot() if snapshot is not None else None
+    if latest is None:
+        return None
+    raw = f"{_isoformat(latest)}|{limit}|{cursor or ''}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+@part_locations_bp.route("/part-locations/changes", methods=["GET"])
+def part_location_changes():
+    """
+    Return rows upserted since the `since` cursor (oldest change first).
+
+    `since` は前回レスポンスの `next_cursor`。省略すると先頭から（全件同期）。
+    `next_cursor` は変更が無くても常に返すので、クライアントはそれを保持して
+    次回の差分取得に使う。`has_more` が true の間は続けて取得する。
+    """
     limit = request.args.get("limit", default=200, type=int)
     limit = max(1, min(limit, 500))
+    try:
+        since_key = decode_cursor(request.args.get("since"), 1)
+    except ValueError:
+        return jsonify({"status": "error", "reason": "invalid-cursor"}), HTTPStatus.BAD_REQUEST
+    since = since_key[0] if since_key else 0
+    if not isinstance(since, int) or isinstance(since, bool) or since < 0:
+        return jsonify({"status": "error", "reason": "invalid-cursor"}), HTTPStatus.BAD_REQUEST
 
     repo: PartLocationRepository = current_app.config["PART_LOCATION_REPOSITORY"]
-    entries = []
-    for item in repo.list(limit):
-        entries.append(
-            {
-                "order_code": item.get("order_code"),
-                "location_code": item.get("location_code"),
-                "device_id": item.get("device_id"),
-                "updated_at": str(item.get("updated_at")) if item.get("updated_at") else None,
-            }
-        )
-
-    return jsonify({"entries": entries})
+    changes = getattr(repo, "changes", None)
+    rows = list(changes(since, limit + 1)) if changes is not None else []
+    page = rows[:limit]
+    last_seq = page[-1].get("change_seq") if page else since
+
+    entries = [
+        {
+            "order_code": row.get("order_code"),
+            "location_code": row.get("location_code"),
+            "device_id": row.get("device_id"),
+            "updated_at": _isoformat(row.get("updated_at")),
+        }
+        for row in page
+    ]
+    # 現状 part_locations から行を消す経路は無いため deleted は常に空
+    body = {
+        "changes": entries,
+        "deleted": [],
+        "next_cursor": encode_cursor([last_seq]),
+        "has_more": len(rows) > limit,
+    }
+    return jsonify(body), HTTPStatus.OK
+
+
+@part_locations_bp.route("/orders/<order_code>/location", methods=["GET"])
+def get_part_location(order_code: str):
+    """
+    Return the current location of one order (404 if unknown).
+
+    `/part-locations/<order_code>` だと `changes` という注文を引けないため、
+    `/locations/<location_code>/orders` と対になる別の接頭辞に置く。
+    """
+    repo: PartLocationRepository = current_app.config["PART_LOCATION_REPOSITORY"]
+    get = getattr(repo, "get", None)
+    row = get(order_code) if get is not None else None
+    if row is None:
+        return jsonify({"status": "error", "reason": "not-found"}), HTTPStatus.NOT_FOUND
+    return jsonify({"status": "ok", "entry": _location_entry(row)}), HTTPStatus.OK
+
+
+@part_locations_bp.route("/locations/<location_code>/orders", methods=["GET"])
+def list_orders_at_location(location_code: str):
+    """Return orders currently at `location_code` (newest first, up to `limit`)."""
+    limit = request.args.get("limit", default=200, type=int)
+    limit = max(1, min(limit, 500))
+    repo: PartLocationRepository = current_app.config["PART_LOCATION_REPOSITORY"]
+    by_location = getattr(repo, "by_location", None)
+    rows = by_location(location_code, limit) if by_location is not None else []
+    entries = [_location_entry(row) for row in rows]
+    return jsonify({"status": "ok", "location_code": location_code, "entries": entries}), HTTPStatus.OK
+
+
+def _location_entry(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "order_code": item.get("order_code"),
+        "location_code": item.get("location_code"),
+        "device_id": item.get("device_id"),
+        "updated_at": _isoformat(item.get("updated_at")),
+    }
+
+
+@part_locations_bp.route("/orders/<order_code>/history", methods=["GET"])
+def part_location_trail(order_code: str):
+    """Return the movement trail of one order (newest first, keyset paginated)."""
+    history: PartLocationHistoryRepository | None = current_app.config.get("PART_LOCATION_HISTORY_REPOSITORY")
+    if history is None:
+        return jsonify({"status": "disabled", "entries": [], "next_cursor": None}), HTTPStatus.OK
+
+    limit = _history_limit()
+    try:
+        before = decode_time_cursor(request.args.get("cursor"), int)
+    except ValueError:
+        return jsonify({"status": "error", "reason": "invalid-cursor"}), HTTPStatus.BAD_REQUEST
+
+    rows = history.trail(order_code, limit=limit + 1, before=before)
+    return jsonify(_history_page(rows, limit, order_code=order_code)), HTTPStatus.OK
+
+
+@part_locations_bp.route("/part-location-history", methods=["GET"])
+def part_location_moves():
+    """
+    Return every move within `from` <= moved_at < `to` (oldest first, keyset paginated).
+
+    `from` / `to` は ISO 8601（タイムゾーン省略時は UTC）。監査用途でも稼働中の
+    `part_locations` / backlog は読まない。
+    """
+    history: PartLocationHistoryRepository | None = current_app.config.get("PART_LOCATION_HISTORY_REPOSITORY")
+    if history is None:
+        return jsonify({"status": "disabled", "entries": [], "next_cursor": None}), HTTPStatus.OK
+
+    start = _parse_time(request.args.get("from"))
+    end = _parse_time(request.args.get("to"))
+    if start is None or end is None or start >= end:
+        return jsonify({"status": "error", "reason": "invalid-range"}), HTTPStatus.BAD_REQUEST
+
+    limit = _history_limit()
+    try:
+        after = decode_time_cursor(request.args.get("cursor"), int)
+    except ValueError:
+        return jsonify({"status": "error", "reason": "invalid-cursor"}), HTTPStatus.BAD_REQUEST
+
+    rows = history.window(start, end, limit=limit + 1, after=after)
+    return jsonify(_history_page(rows, limit)), HTTPStatus.OK
+
+
+def _history_limit() -> int:
+    limit = request.args.get("limit", default=100, type=int)
+    return max(1, min(limit, 500))
+
+
+def _history_page(rows: List[Dict[str, Any]], limit: int, **extra: Any) -> Dict[str, Any]:
+    # limit + 1 件取得し、溢れた分があれば最後に返した行のキーを次の cursor にする
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit and page:
+        last = page[-1]
+        next_cursor = encode_cursor([last.get("moved_at"), last.get("id")])
+    entries = [
+        {
+            "order_code": row.get("order_code"),
+            "location_code": row.get("location_code"),
+            "device_id": row.get("device_id"),
+            "moved_at": _isoformat(row.get("moved_at")),
+        }
+        for row in page
+    ]
+    return {"status": "ok", **extra, "entries": entries, "next_cursor": next_cursor}
+
+
+def _isoformat(value: Any) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value) if value else None
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
@@ -2,14 +2,16 @@
 
 from __future__ import annotations
 
+import json
 import logging
 from http import HTTPStatus
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from flask import Blueprint, current_app, jsonify, request
 
 from raspberrypiserver.repositories import ScanRepository
-from raspberrypiserver.services import BroadcastService
+from raspberrypiserver.services import BroadcastService, DrainTrigger, DrainWorker, ScanDeduplicator
+from raspberrypiserver.services.dedup import extract_scan_id, normalize_scan_id
 
 logger = logging.getLogger(__name__)
 
@@ -34,31 +36,245 @@ def ingest_scan():
             HTTPStatus.BAD_REQUEST,
         )
 
+    if _is_duplicate(payload):
+        logger.info("Duplicate scan payload ignored: %s", payload)
+        return (
+            jsonify(
+                {
+                    "status": "duplicate",
+                    "scan_id": extract_scan_id(payload),
+                    "app": current_app.config.get("APP_NAME"),
+                }
+            ),
+            HTTPStatus.OK,
+        )
+
     # TODO: integrate with actual persistence / Socket.IO broadcast
     logger.info("Received scan payload: %s", payload)
     repo: ScanRepository = current_app.config["SCAN_REPOSITORY"]
-    repo.save(payload)
-
-    broadcaster: BroadcastService | None = current_app.config.get("BROADCAST_SERVICE")
-    if broadcaster:
-        broadcaster.emit("scan.ingested", payload)
+    try:
+        stored = repo.save(payload)
+    except Exception as exc:  # noqa: BLE001
+        return _persistence_failed([payload], exc)
+    _remember([payload])
+    if not stored:
+        # DB の一意インデックスで捨てられた（重複インデックスの TTL 切れ・再起動後の再送など）
+        logger.info("Duplicate scan payload dropped by storage: %s", payload)
+        return (
+            jsonify(
+                {
+                    "status": "duplicate",
+                    "scan_id": extract_scan_id(payload),
+                    "app": current_app.config.get("APP_NAME"),
+                }
+            ),
+            HTTPStatus.OK,
+        )
 
-    drained = None
-    auto_limit = int(current_app.config.get("AUTO_DRAIN_ON_INGEST", 0) or 0)
-    backlog_service = current_app.config.get("BACKLOG_DRAIN_SERVICE")
-    if auto_limit > 0 and backlog_service and backlog_service.is_configured():
-        drained = backlog_service.drain_once(limit=auto_limit)
+    _broadcast([payload])
+    drain_queued = _signal_auto_drain()
 
     response = {
         "status": "accepted",
         "received": payload,
         "app": current_app.config.get("APP_NAME"),
     }
-    if drained is not None:
-        response["backlog_drained"] = drained
+    if drain_queued:
+        response["backlog_drain"] = "queued"
     return jsonify(response), HTTPStatus.ACCEPTED
 
 
+@scans_bp.route("/scans/batch", methods=["POST"])
+def ingest_scan_batch():
+    """
+    Ingest several scans in one request (JSON array or NDJSON body).
+
+    各要素を `_normalize_payload` で検証し、受理できたものだけを 1 回の書き込みで保存する。
+    レスポンスの `results` には要素ごとの accepted / error を入力順で返す。
+    """
+    try:
+        raw_items = _parse_batch_body()
+    except ValueError as exc:
+        return jsonify({"status": "error", "reason": str(exc)}), HTTPStatus.BAD_REQUEST
+
+    max_items = int(current_app.config.get("SCAN_BATCH_MAX_ITEMS", 500) or 0)
+    if max_items > 0 and len(raw_items) > max_items:
+        return (
+            jsonify({"status": "error", "reason": "batch-too-large", "max_items": max_items}),
+            HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    accepted: List[Dict[str, Any]] = []
+    results: List[Dict[str, Any]] = []
+    accepted_results: List[Dict[str, Any]] = []
+    batch_scan_ids = set()
+    duplicates = 0
+    for index, raw_item in enumerate(raw_items):
+        try:
+            payload = _normalize_payload(raw_item)
+        except ValueError as exc:
+            logger.info("Rejected scan payload in batch: index=%s %s (%s)", index, raw_item, exc)
+            results.append({"index": index, "status": "error", "reason": str(exc)})
+            continue
+        scan_id = extract_scan_id(payload)
+        if _is_duplicate(payload) or (scan_id is not None and scan_id in batch_scan_ids):
+            duplicates += 1
+            results.append({"index": index, "status": "duplicate"})
+            continue
+        if scan_id is not None:
+            batch_scan_ids.add(scan_id)
+        accepted.append(payload)
+        results.append({"index": index, "status": "accepted"})
+        accepted_results.append(results[-1])
+
+    if accepted:
+        logger.info(
+            "Received scan batch: accepted=%s duplicates=%s rejected=%s",
+            len(accepted),
+            duplicates,
+            len(raw_items) - len(accepted) - duplicates,
+        )
+        repo: ScanRepository = current_app.config["SCAN_REPOSITORY"]
+        try:
+            stored = repo.save_many(accepted)
+        except Exception as exc:  # noqa: BLE001
+            return _persistence_failed(accepted, exc)
+        _remember(accepted)
+        stored_ids = {id(payload) for payload in stored}
+        for payload, result in zip(accepted, accepted_results):
+            if id(payload) not in stored_ids:
+                # DB の一意インデックスで捨てられた行は重複として返し、配信もしない
+                result["status"] = "duplicate"
+                duplicates += 1
+        accepted = list(stored)
+        _broadcast(accepted)
+
+    drain_queued = _signal_auto_drain() if accepted else False
+
+    rejected = len(raw_items) - len(accepted) - duplicates
+    if not accepted and not rejected:
+        status, http_status = "duplicate", HTTPStatus.OK
+    elif not accepted:
+        # 受理 0 件で不正な要素がある場合は（重複が混ざっていても）受理扱いにしない
+        status, http_status = "rejected", HTTPStatus.BAD_REQUEST
+    elif rejected:
+        status, http_status = "partial", HTTPStatus.ACCEPTED
+    else:
+        status, http_status = "accepted", HTTPStatus.ACCEPTED
+
+    response: Dict[str, Any] = {
+        "status": status,
+        "accepted": len(accepted),
+        "duplicates": duplicates,
+        "rejected": rejected,
+        "results": results,
+        "app": current_app.config.get("APP_NAME"),
+    }
+    if drain_queued:
+        response["backlog_drain"] = "queued"
+    return jsonify(response), http_status
+
+
+def _is_duplicate(payload: Dict[str, Any]) -> bool:
+    """Check `metadata.scan_id` against the in-memory dedup index (recorded by `_remember`)."""
+    dedup: ScanDeduplicator | None = current_app.config.get("SCAN_DEDUP_INDEX")
+    scan_id = extract_scan_id(payload)
+    if dedup is None or scan_id is None:
+        return False
+    return dedup.seen(scan_id)
+
+
+def _remember(payloads: List[Dict[str, Any]]) -> None:
+    """
+    Record scan ids in the dedup index once the repository has taken the payloads.
+
+    保存に成功した後（DB の一意インデックスで捨てられた重複も含む）にだけ記録する。
+    保存前に記録すると、失敗した要求のハンディ再送が TTL の間ずっと重複扱いになる。
+    """
+    dedup: ScanDeduplicator | None = current_app.config.get("SCAN_DEDUP_INDEX")
+    if dedup is None:
+        return
+    for payload in payloads:
+        scan_id = extract_scan_id(payload)
+        if scan_id is not None:
+            dedup.add(scan_id)
+
+
+def _persistence_failed(payloads: List[Dict[str, Any]], exc: Exception):
+    """Answer 503 for payloads that were not stored (their scan ids were never recorded)."""
+    logger.warning("Scan persistence failed (rows=%s): %s", len(payloads), exc)
+    return (
+        jsonify(
+            {
+                "status": "error",
+                "reason": "persistence-failed",
+                "app": current_app.config.get("APP_NAME"),
+            }
+        ),
+        HTTPStatus.SERVICE_UNAVAILABLE,
+    )
+
+
+def _broadcast(payloads: List[Dict[str, Any]]) -> None:
+    broadcaster: BroadcastService | None = current_app.config.get("BROADCAST_SERVICE")
+    if not broadcaster:
+        return
+    for payload in payloads:
+        broadcaster.emit("scan.ingested", payload)
+
+
+def _signal_auto_drain() -> bool:
+    """Signal the background drain trigger; returns True when a drain was queued."""
+    worker: DrainWorker | None = current_app.config.get("BACKLOG_DRAIN_WORKER")
+    if worker is not None:
+        # 常駐ワーカーがいる場合はスリープ中でも即座に起こす
+        worker.signal()
+        return True
+
+    # トリガーは initialize_services が AUTO_DRAIN_ON_INGEST に従って 1 度だけ作る
+    trigger: DrainTrigger | None = current_app.config.get("BACKLOG_DRAIN_TRIGGER")
+    if trigger is None:
+        return False
+    trigger.signal()
+    return True
+
+
+def _parse_batch_body() -> List[Any]:
+    """Return raw batch items from a JSON array or NDJSON request body."""
+    mimetype = request.mimetype or ""
+    if mimetype in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return _parse_ndjson(request.get_data(as_text=True))
+
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        items: List[Any] = body
+    elif isinstance(body, dict) and isinstance(body.get("scans"), list):
+        items = body["scans"]
+    elif body is None and request.get_data():
+        items = _parse_ndjson(request.get_data(as_text=True))
+    else:
+        raise ValueError("invalid-batch")
+
+    if not items:
+        raise ValueError("empty-batch")
+    return items
+
+
+def _parse_ndjson(text: str) -> List[Any]:
+    items: List[Any] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            # 行単位の JSON 破損はその要素だけを invalid-json として扱う
+            items.append(None)
+    if not items:
+        raise ValueError("empty-batch")
+    return items
+
+
 def _normalize_payload(raw_payload: Any) -> Dict[str, Any]:
     if not isinstance(raw_payload, dict):
         raise ValueError("invalid-json")
@@ -85,6 +301,13 @@ def _normalize_payload(raw_payload: Any) -> Dict[str, Any]:
 
     metadata = raw_payload.get("metadata")
     if isinstance(metadata, dict):
+        metadata = dict(metadata)
+        if "scan_id" in metadata:
+            scan_id = normalize_scan_id(metadata["scan_id"])
+            if scan_id is None:
+                raise ValueError("invalid-scan_id")
+            # 保存値も正規化し、DB の一意インデックス・スプールと重複判定を揃える
+            metadata["scan_id"] = scan_id
         normalized["metadata"] = metadata
 
     return normalized
@@ -8,25 +8,44 @@ server code into a more modular structure.
 
 from __future__ import annotations
 
+import atexit
 import os
+import weakref
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+import psycopg
 from flask import Flask, jsonify, current_app
 from flask_socketio import SocketIO
 
+from raspberrypiserver.database import CircuitBreaker, ConnectionPool
 from raspberrypiserver.repositories import (
+    CachedPartLocationRepository,
+    DatabasePartLocationHistoryRepository,
     DatabasePartLocationRepository,
     DatabaseScanRepository,
     InMemoryPartLocationRepository,
     InMemoryScanRepository,
+    LogScanRepository,
     PartLocationRepository,
     ScanRepository,
+    ScanSpool,
+    SQLiteDatabase,
+    SQLitePartLocationHistoryRepository,
+    SQLitePartLocationRepository,
+    SQLiteScanRepository,
 )
 from raspberrypiserver.services import (
     BroadcastService,
     SocketIOBroadcastService,
     BacklogDrainService,
+    BacklogNotifyListener,
+    BacklogPartitionMaintainer,
+    DrainTrigger,
+    DrainWorker,
+    ScanDeduplicator,
+    SpoolReplayer,
+    SQLiteBacklogDrainService,
 )
 
 DEFAULT_CONFIG: Dict[str, Any] = {
@@ -37,8 +56,51 @@ DEFAULT_CONFIG: Dict[str, Any] = {
     "SCAN_REPOSITORY_CAPACITY": 250,
     "SCAN_REPOSITORY_BACKEND": "memory",
     "SCAN_REPOSITORY_BUFFER": 500,
+    "SCAN_REPOSITORY_DURABILITY": "sync",
+    "SCAN_REPOSITORY_FLUSH_SIZE": 200,
+    "SCAN_REPOSITORY_FLUSH_INTERVAL_MS": 20,
+    "SCAN_REPOSITORY_QUEUE_SIZE": 10000,
+    "SCAN_REPOSITORY_OVERFLOW": "flush",
+    "SCAN_LOG_DIR": "var/scan-log",
+    "SCAN_LOG_SEGMENT_MB": 64,
+    "SCAN_LOG_MAX_SEGMENTS": 16,
+    "SCAN_LOG_FSYNC_INTERVAL_MS": 50,
+    "SCAN_LOG_FSYNC_BATCH": 256,
+    "SCAN_SPOOL_DIR": "",
+    "SCAN_SPOOL_SEGMENT_MB": 8,
+    "SCAN_SPOOL_MAX_SEGMENTS": 64,
+    "SCAN_SPOOL_FSYNC_INTERVAL_MS": 50,
+    "SCAN_SPOOL_REPLAY_INTERVAL_SECONDS": 5.0,
+    "SCAN_SPOOL_MAX_REPLAY_FAILURES": 3,
+    "SQLITE_PATH": "var/raspberrypiserver.sqlite3",
+    "SQLITE_SYNCHRONOUS": "NORMAL",
+    "SCAN_BATCH_MAX_ITEMS": 500,
+    "SCAN_DEDUP_CAPACITY": 20000,
+    "SCAN_DEDUP_TTL_SECONDS": 86400,
     "SOCKET_BROADCAST_EVENT": "scan.ingested",
     "AUTO_DRAIN_ON_INGEST": 0,
+    "AUTO_DRAIN_MIN_INTERVAL_MS": 500,
+    "AUTO_DRAIN_MAX_BATCH": 0,
+    "BACKLOG_DRAIN_PARTITIONS": 1,
+    "BACKLOG_DRAIN_PARTITION": 0,
+    "BACKLOG_COUNT_MODE": "counter",
+    "BACKLOG_STATS_TTL_SECONDS": 2,
+    "BACKLOG_STATS_COMPACT_SECONDS": 30,
+    "BACKLOG_TABLE_LAYOUT": "plain",
+    "BACKLOG_PARTITION_GRANULARITY": "day",
+    "BACKLOG_PARTITION_PREMAKE": 2,
+    "BACKLOG_PARTITION_MAINTENANCE_SECONDS": 300,
+    "PART_LOCATION_HISTORY_TABLE": "part_location_history",
+    "PART_LOCATION_CACHE_TTL_SECONDS": 5,
+    "PART_LOCATION_CACHE_MAX_ENTRIES": 64,
+    "PART_LOCATION_MEMORY_CAPACITY": 10000,
+    "BACKLOG_DRAIN_WORKER_ENABLED": False,
+    "BACKLOG_DRAIN_WORKER_MIN_BATCH": 10,
+    "BACKLOG_DRAIN_WORKER_TARGET_MS": 200,
+    "BACKLOG_DRAIN_WORKER_IDLE_SECONDS": 5.0,
+    "BACKLOG_NOTIFY_ENABLED": False,
+    "BACKLOG_NOTIFY_CHANNEL": "scan_backlog",
+    "BACKLOG_NOTIFY_FALLBACK_SECONDS": 60.0,
     "database": {"dsn": ""},
 }
 
@@ -60,17 +122,27 @@ def create_app() -> Flask:
 
     @app.route("/healthz", methods=["GET"])
     def healthz():
-        """Return application health information."""
-        return (
-            jsonify(
-                {
-                    "status": "ok",
-                    "app": app.config.get("APP_NAME"),
-                    "api_prefix": app.config.get("REST_API_PREFIX"),
-                }
-            ),
-            200,
-        )
+        """Return application health information (DB circuit state and scan spool when configured)."""
+        body: Dict[str, Any] = {
+            "status": "ok",
+            "app": app.config.get("APP_NAME"),
+            "api_prefix": app.config.get("REST_API_PREFIX"),
+        }
+        breaker: CircuitBreaker | None = app.config.get("DB_CIRCUIT_BREAKER")
+        if breaker is not None:
+            body["database"] = breaker.stats()
+            if body["database"]["state"] != "closed":
+                body["status"] = "degraded"
+        replayer: SpoolReplayer | None = app.config.get("SCAN_SPOOL_REPLAYER")
+        if replayer is not None:
+            spool = replayer.spool.stats()
+            body["spool"] = {
+                key: spool[key] for key in ("depth", "segments", "max_segments", "full", "quarantined_segments")
+            }
+            # 満杯（ingest を拒否中）や隔離セグメントは運用者が対処するまで degraded
+            if spool["full"] or spool["quarantined_segments"]:
+                body["status"] = "degraded"
+        return jsonify(body), 200
 
     return app
 
@@ -125,16 +197,110 @@ def initialize_services(app: Flask) -> None:
     backend = str(app.config.get("SCAN_REPOSITORY_BACKEND", "memory")).lower()
     app.config["SOCKETIO_INSTANCE"] = socketio
 
+    database_cfg = app.config.get("database") or {}
+    dsn = database_cfg.get("dsn", "")
+    previous_trigger: DrainTrigger | None = app.config.get("BACKLOG_DRAIN_TRIGGER")
+    if previous_trigger:
+        previous_trigger.stop()
+    app.config["BACKLOG_DRAIN_TRIGGER"] = None
+    previous_worker: DrainWorker | None = app.config.get("BACKLOG_DRAIN_WORKER")
+    if previous_worker:
+        previous_worker.stop()
+    app.config["BACKLOG_DRAIN_WORKER"] = None
+    previous_listener: BacklogNotifyListener | None = app.config.get("BACKLOG_NOTIFY_LISTENER")
+    if previous_listener:
+        previous_listener.stop()
+    app.config["BACKLOG_NOTIFY_LISTENER"] = None
+    previous_maintainer: BacklogPartitionMaintainer | None = app.config.get("BACKLOG_PARTITION_MAINTAINER")
+    if previous_maintainer:
+        previous_maintainer.stop()
+    app.config["BACKLOG_PARTITION_MAINTAINER"] = None
+    previous_replayer: SpoolReplayer | None = app.config.get("SCAN_SPOOL_REPLAYER")
+    if previous_replayer:
+        previous_replayer.stop()
+    app.config["SCAN_SPOOL_REPLAYER"] = None
+    previous_repo = app.config.get("SCAN_REPOSITORY")
+    if isinstance(previous_repo, (DatabaseScanRepository, LogScanRepository)):
+        previous_repo.close()
+    # 前のリポジトリの最終フラッシュがスプール・プールを使うため、それらは最後に閉じる
+    if previous_replayer:
+        previous_replayer.spool.close()
+    previous_pool: ConnectionPool | None = app.config.get("DB_POOL")
+    if previous_pool:
+        previous_pool.close()
+    # 終了時にキューへ残ったスキャンの書き出し・未 fsync の追記の同期を行う（登録はモジュールで 1 回だけ）
+    _LIVE_APPS.add(app)
+    previous_sqlite: SQLiteDatabase | None = app.config.get("SQLITE_DATABASE")
+    if previous_sqlite:
+        previous_sqlite.close()
+    sqlite_db = (
+        SQLiteDatabase(
+            app.config.get("SQLITE_PATH", "var/raspberrypiserver.sqlite3"),
+            synchronous=str(app.config.get("SQLITE_SYNCHRONOUS", "NORMAL")).upper(),
+        )
+        if backend == "sqlite"
+        else None
+    )
+    app.config["SQLITE_DATABASE"] = sqlite_db
+    pool = create_connection_pool(database_cfg) if backend == "db" and dsn else None
+    app.config["DB_POOL"] = pool
+    connect = pool.connect if pool else psycopg.connect
+    breaker = create_circuit_breaker(database_cfg) if backend == "db" else None
+    app.config["DB_CIRCUIT_BREAKER"] = breaker
+    if breaker is not None:
+        # DB 停止中は接続タイムアウトを待たずに失敗させる（保存・一覧・ドレイン共通）
+        connect = breaker.wrap(connect)
+
     if backend == "db":
-        database_cfg = app.config.get("database") or {}
-        dsn = database_cfg.get("dsn", "")
         buffer_size = int(app.config.get("SCAN_REPOSITORY_BUFFER", 500))
-        repo = DatabaseScanRepository(dsn=dsn, buffer_size=buffer_size)
+        spool_dir = app.config.get("SCAN_SPOOL_DIR") if dsn else ""
+        spool = create_scan_spool(app, spool_dir) if spool_dir else None
+        repo = DatabaseScanRepository(
+            dsn=dsn,
+            buffer_size=buffer_size,
+            connect_factory=connect,
+            durability=str(app.config.get("SCAN_REPOSITORY_DURABILITY", "sync")).lower(),
+            flush_size=int(app.config.get("SCAN_REPOSITORY_FLUSH_SIZE", 200)),
+            flush_interval=float(app.config.get("SCAN_REPOSITORY_FLUSH_INTERVAL_MS", 20)) / 1000,
+            queue_size=int(app.config.get("SCAN_REPOSITORY_QUEUE_SIZE", 10000)),
+            overflow=str(app.config.get("SCAN_REPOSITORY_OVERFLOW", "flush")).lower(),
+            layout=str(app.config.get("BACKLOG_TABLE_LAYOUT", "plain")).lower(),
+            spool=spool,
+            history_table=app.config.get("PART_LOCATION_HISTORY_TABLE", "part_location_history") or "",
+        )
+        if spool is not None:
+            app.config["SCAN_SPOOL_REPLAYER"] = SpoolReplayer(
+                repo,
+                spool,
+                breaker=breaker,
+                interval=float(app.config.get("SCAN_SPOOL_REPLAY_INTERVAL_SECONDS", 5.0)),
+                max_failures=int(app.config.get("SCAN_SPOOL_MAX_REPLAY_FAILURES", 3)),
+            ).start()
+    elif sqlite_db is not None:
+        repo = SQLiteScanRepository(sqlite_db, buffer_size=int(app.config.get("SCAN_REPOSITORY_BUFFER", 500)))
+    elif backend == "log":
+        repo = LogScanRepository(
+            app.config.get("SCAN_LOG_DIR", "var/scan-log"),
+            segment_bytes=int(float(app.config.get("SCAN_LOG_SEGMENT_MB", 64)) * 1024 * 1024),
+            max_segments=int(app.config.get("SCAN_LOG_MAX_SEGMENTS", 16)),
+            fsync_interval=float(app.config.get("SCAN_LOG_FSYNC_INTERVAL_MS", 50)) / 1000,
+            fsync_batch=int(app.config.get("SCAN_LOG_FSYNC_BATCH", 256)),
+        )
     else:
         repo = InMemoryScanRepository(capacity=capacity)
 
     app.config["SCAN_REPOSITORY"] = repo
 
+    dedup_capacity = int(app.config.get("SCAN_DEDUP_CAPACITY", 20000) or 0)
+    app.config["SCAN_DEDUP_INDEX"] = (
+        ScanDeduplicator(
+            capacity=dedup_capacity,
+            ttl=float(app.config.get("SCAN_DEDUP_TTL_SECONDS", 86400)),
+        )
+        if dedup_capacity > 0
+        else None
+    )
+
     if not app.config.get("BROADCAST_SERVICE"):
         namespace = app.config.get("SOCKETIO_NAMESPACE", "/")
         event_name = app.config.get("SOCKET_BROADCAST_EVENT", "scan.ingested")
@@ -146,24 +312,201 @@ def initialize_services(app: Flask) -> None:
 
     if backend == "db":
         backlog_service = BacklogDrainService(
-            dsn=database_cfg.get("dsn", ""),
+            dsn=dsn,
             limit=int(app.config.get("BACKLOG_DRAIN_LIMIT", 200)),
             backlog_table=app.config.get("BACKLOG_TABLE", "scan_ingest_backlog"),
             target_table=app.config.get("TARGET_TABLE", "part_locations"),
+            connect=connect,
+            dead_letter_table=app.config.get("DEAD_LETTER_TABLE", "scan_ingest_dead_letter"),
+            partitions=int(app.config.get("BACKLOG_DRAIN_PARTITIONS", 1)),
+            partition=int(app.config.get("BACKLOG_DRAIN_PARTITION", 0)),
+            count_mode=app.config.get("BACKLOG_COUNT_MODE", "counter"),
+            stats_ttl=float(app.config.get("BACKLOG_STATS_TTL_SECONDS", 2)),
+            stats_compact_interval=float(app.config.get("BACKLOG_STATS_COMPACT_SECONDS", 30)),
+            layout=str(app.config.get("BACKLOG_TABLE_LAYOUT", "plain")).lower(),
+            partition_granularity=str(app.config.get("BACKLOG_PARTITION_GRANULARITY", "day")).lower(),
+            partition_premake=int(app.config.get("BACKLOG_PARTITION_PREMAKE", 2)),
+            partition_maintenance_interval=float(app.config.get("BACKLOG_PARTITION_MAINTENANCE_SECONDS", 300)),
+            history_table=app.config.get("PART_LOCATION_HISTORY_TABLE", "part_location_history"),
         )
         app.config["BACKLOG_DRAIN_SERVICE"] = backlog_service
-        part_repo: PartLocationRepository = DatabasePartLocationRepository(database_cfg.get("dsn", ""))
+        if backlog_service.layout == "partitioned" and backlog_service.is_configured():
+            # パーティションの作成・削除はドレインの有無に関係なく続ける
+            app.config["BACKLOG_PARTITION_MAINTAINER"] = BacklogPartitionMaintainer(
+                backlog_service, interval=backlog_service.partition_maintenance_interval
+            ).start()
+        if app.config.get("BACKLOG_DRAIN_WORKER_ENABLED") and backlog_service.is_configured():
+            worker = create_drain_worker(app, backlog_service)
+            if app.config.get("BACKLOG_NOTIFY_ENABLED"):
+                # NOTIFY で起こすので、ポーリングは取りこぼし対策の低頻度フォールバックだけにする
+                worker.idle_interval = float(app.config.get("BACKLOG_NOTIFY_FALLBACK_SECONDS", 60.0))
+                app.config["BACKLOG_NOTIFY_LISTENER"] = BacklogNotifyListener(
+                    dsn,
+                    on_notify=worker.signal,
+                    channel=app.config.get("BACKLOG_NOTIFY_CHANNEL", "scan_backlog"),
+                ).start()
+            app.config["BACKLOG_DRAIN_WORKER"] = worker.start()
+        part_repo = wrap_part_location_cache(
+            app, DatabasePartLocationRepository(dsn, connect=connect), backlog_service
+        )
+        history_table = app.config.get("PART_LOCATION_HISTORY_TABLE", "part_location_history")
+        app.config["PART_LOCATION_HISTORY_REPOSITORY"] = (
+            DatabasePartLocationHistoryRepository(dsn, connect=connect, table=history_table)
+            if history_table
+            else None
+        )
+    elif sqlite_db is not None:
+        history_enabled = bool(app.config.get("PART_LOCATION_HISTORY_TABLE", "part_location_history"))
+        backlog_service = SQLiteBacklogDrainService(
+            sqlite_db,
+            limit=int(app.config.get("BACKLOG_DRAIN_LIMIT", 200)),
+            history=history_enabled,
+        )
+        app.config["BACKLOG_DRAIN_SERVICE"] = backlog_service
+        if app.config.get("BACKLOG_DRAIN_WORKER_ENABLED"):
+            app.config["BACKLOG_DRAIN_WORKER"] = create_drain_worker(app, backlog_service).start()
+        part_repo = wrap_part_location_cache(app, SQLitePartLocationRepository(sqlite_db), backlog_service)
+        app.config["PART_LOCATION_HISTORY_REPOSITORY"] = (
+            SQLitePartLocationHistoryRepository(sqlite_db) if history_enabled else None
+        )
     else:
         app.config["BACKLOG_DRAIN_SERVICE"] = None
-        part_repo = InMemoryPartLocationRepository(repo)
+        app.config["PART_LOCATION_HISTORY_REPOSITORY"] = None
+        part_repo = InMemoryPartLocationRepository(
+            repo,
+            capacity=int(app.config.get("PART_LOCATION_MEMORY_CAPACITY", 10000)),
+        )
 
     app.config["PART_LOCATION_REPOSITORY"] = part_repo
+    if app.config.get("BACKLOG_DRAIN_WORKER") is None:
+        app.config["BACKLOG_DRAIN_TRIGGER"] = create_drain_trigger(app, app.config.get("BACKLOG_DRAIN_SERVICE"))
+
+
+def wrap_part_location_cache(
+    app: Flask, part_repo: PartLocationRepository, backlog_service: BacklogDrainService
+) -> PartLocationRepository:
+    """Put the read-through cache in front of `part_repo` unless `PART_LOCATION_CACHE_TTL_SECONDS` is 0."""
+    cache_ttl = float(app.config.get("PART_LOCATION_CACHE_TTL_SECONDS", 5) or 0)
+    if cache_ttl <= 0:
+        return part_repo
+    cached = CachedPartLocationRepository(
+        part_repo,
+        ttl=cache_ttl,
+        max_entries=int(app.config.get("PART_LOCATION_CACHE_MAX_ENTRIES", 64)),
+    )
+    # ドレインが part_locations を更新したらキャッシュを無効化する
+    backlog_service.on_upsert = cached.bump
+    return cached
+
+
+def create_drain_trigger(app: Flask, service: Optional[BacklogDrainService]) -> Optional[DrainTrigger]:
+    """Build the ingest-driven drain trigger when `AUTO_DRAIN_ON_INGEST` is enabled."""
+    auto_limit = int(app.config.get("AUTO_DRAIN_ON_INGEST", 0) or 0)
+    if auto_limit <= 0 or service is None or not service.is_configured():
+        return None
+    return DrainTrigger(
+        service,
+        per_signal=auto_limit,
+        min_interval=float(app.config.get("AUTO_DRAIN_MIN_INTERVAL_MS", 500)) / 1000,
+        max_batch=int(app.config.get("AUTO_DRAIN_MAX_BATCH", 0) or 0) or None,
+    )
+
+
+def create_drain_worker(app: Flask, service: BacklogDrainService) -> DrainWorker:
+    """Build the continuous drain worker from `BACKLOG_DRAIN_*` settings."""
+    return DrainWorker(
+        service,
+        max_batch=int(app.config.get("BACKLOG_DRAIN_LIMIT", 200)),
+        min_batch=int(app.config.get("BACKLOG_DRAIN_WORKER_MIN_BATCH", 10)),
+        target_duration=float(app.config.get("BACKLOG_DRAIN_WORKER_TARGET_MS", 200)) / 1000,
+        idle_interval=float(app.config.get("BACKLOG_DRAIN_WORKER_IDLE_SECONDS", 5.0)),
+    )
+
+
+def create_scan_spool(app: Flask, directory: str) -> ScanSpool:
+    """Build the local spool used while PostgreSQL is unreachable."""
+    return ScanSpool(
+        directory,
+        segment_bytes=int(float(app.config.get("SCAN_SPOOL_SEGMENT_MB", 8)) * 1024 * 1024),
+        max_segments=int(app.config.get("SCAN_SPOOL_MAX_SEGMENTS", 64)),
+        fsync_interval=float(app.config.get("SCAN_SPOOL_FSYNC_INTERVAL_MS", 50)) / 1000,
+    )
+
+
+def create_connection_pool(database_cfg: Dict[str, Any]) -> ConnectionPool:
+    """Build the shared connection pool from the `[database]` config section."""
+    return ConnectionPool(
+        dsn=database_cfg.get("dsn", ""),
+        min_size=int(database_cfg.get("pool_min_size", 1)),
+        max_size=int(database_cfg.get("pool_max_size", 4)),
+        max_idle=float(database_cfg.get("pool_max_idle", 300.0)),
+        timeout=float(database_cfg.get("pool_timeout", 5.0)),
+        check_interval=float(database_cfg.get("pool_check_interval", 30.0)),
+    )
+
+
+def create_circuit_breaker(database_cfg: Dict[str, Any]) -> Optional[CircuitBreaker]:
+    """Build the shared DB circuit breaker (`breaker_failures = 0` disables it)."""
+    failures = int(database_cfg.get("breaker_failures", 3))
+    if failures <= 0:
+        return None
+    return CircuitBreaker(
+        failure_threshold=failures,
+        probe_interval=float(database_cfg.get("breaker_probe_interval", 5.0)),
+    )
+
+
+def shutdown_services(app: Flask) -> None:
+    """Flush buffered writes and release pooled connections."""
+    _LIVE_APPS.discard(app)
+    trigger = app.config.get("BACKLOG_DRAIN_TRIGGER")
+    if trigger:
+        trigger.stop()
+    worker: DrainWorker | None = app.config.get("BACKLOG_DRAIN_WORKER")
+    if worker:
+        worker.stop()
+    listener: BacklogNotifyListener | None = app.config.get("BACKLOG_NOTIFY_LISTENER")
+    if listener:
+        listener.stop()
+    maintainer: BacklogPartitionMaintainer | None = app.config.get("BACKLOG_PARTITION_MAINTAINER")
+    if maintainer:
+        maintainer.stop()
+    replayer: SpoolReplayer | None = app.config.get("SCAN_SPOOL_REPLAYER")
+    if replayer:
+        replayer.stop()
+    repo = app.config.get("SCAN_REPOSITORY")
+    if isinstance(repo, (DatabaseScanRepository, LogScanRepository)):
+        repo.close()
+    if replayer:
+        replayer.spool.close()
+    # SQLite のリポジトリ・ドレインは共有接続を使うだけなので、停止後に接続ごと閉じる
+    sqlite_db: SQLiteDatabase | None = app.config.get("SQLITE_DATABASE")
+    if sqlite_db:
+        sqlite_db.close()
+    pool: ConnectionPool | None = app.config.get("DB_POOL")
+    if pool:
+        pool.close()
+
+
+def _shutdown_live_apps() -> None:
+    for app in list(_LIVE_APPS):
+        try:
+            shutdown_services(app)
+        except Exception as exc:  # pylint: disable=broad-except
+            app.logger.warning("Shutdown at exit failed: %s", exc)  # noqa: PLE1205
+
+
+_LIVE_APPS: "weakref.WeakSet[Flask]" = weakref.WeakSet()
+atexit.register(_shutdown_live_apps)
 
 
 def run() -> None:
     """Run the development server (for local testing only)."""
     app = create_app()
-    socketio.run(app, host="0.0.0.0", port=8501, debug=True, use_reloader=False)
+    try:
+        socketio.run(app, host="0.0.0.0", port=8501, debug=True, use_reloader=False)
+    finally:
+        shutdown_services(app)
 
 
 if __name__ == "__main__":
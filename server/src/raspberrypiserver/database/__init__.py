@@ -0,0 +1,6 @@
+"""Database infrastructure shared by repositories and services."""
+
+from .breaker import CircuitBreaker, CircuitOpenError, GuardedConnect
+from .pool import ConnectionPool, PoolTimeout
+
+__all__ = ["CircuitBreaker", "CircuitOpenError", "ConnectionPool", "GuardedConnect", "PoolTimeout"]
@@ -0,0 +1,161 @@
+"""Circuit breaker around database access (fast-fail while PostgreSQL is down)."""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+import psycopg
+
+from .pool import PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+BREAKER_STATES = ("closed", "open", "half_open")
+
+# 接続できない／切れた／プールが詰まった、を障害として数える（SQL エラーは数えない）
+OUTAGE_ERRORS: Tuple[Type[BaseException], ...] = (psycopg.OperationalError, PoolTimeout, OSError)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of connecting while the breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Shared closed / open / half-open breaker for database calls.
+
+    - `closed`: 通常どおり接続する。障害が `failure_threshold` 回続くと `open` へ。
+    - `open`: 接続を試みず即座に `CircuitOpenError` を送出する（接続タイムアウトを
+      待たないので gevent の hub を止めない）。`probe_interval` 秒後に `half_open` へ。
+    - `half_open`: 1 件だけ試行（probe）を通し、成功すれば `closed`、失敗すれば再び `open`。
+      probe の結果が出るまで他の呼び出しは拒否する。
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        probe_interval: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval = max(0.0, probe_interval)
+        self._clock = clock
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._last_error: Optional[str] = None
+        self._stats = {"rejected": 0, "opened": 0, "probes": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == "open" and self._clock() >= self._opened_at + self.probe_interval:
+            return "half_open"
+        return self._state
+
+    def allow(self) -> bool:
+        """Return True when a call may touch the database now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._state = "half_open"
+            self._probing = True
+            self._stats["probes"] += 1
+            return True
+        self._stats["rejected"] += 1
+        return False
+
+    def record_success(self) -> None:
+        if self._state != "closed":
+            logger.info("Database circuit closed (probe succeeded)")
+        self._state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self, exc: Optional[BaseException] = None) -> None:
+        self._failures += 1
+        self._last_error = str(exc) if exc is not None else None
+        if self._state == "half_open" or self._failures >= self.failure_threshold:
+            if self._state != "open":
+                self._stats["opened"] += 1
+                logger.warning(
+                    "Database circuit opened after %s failure(s); probing every %ss: %s",
+                    self._failures,
+                    self.probe_interval,
+                    exc,
+                )
+            self._state = "open"
+            self._opened_at = self._clock()
+        self._probing = False
+
+    def release_probe(self) -> None:
+        self._probing = False
+
+    def wrap(self, connect: Callable[..., Any]) -> "GuardedConnect":
+        """Return a `connect(dsn)` replacement that consults the breaker."""
+        return GuardedConnect(self, connect)
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        stats: Dict[str, Any] = {
+            "state": state,
+            "failures": self._failures,
+            "failure_threshold": self.failure_threshold,
+            "probe_interval": self.probe_interval,
+            "last_error": self._last_error,
+        }
+        if state == "open":
+            stats["retry_in_seconds"] = round(max(0.0, self._opened_at + self.probe_interval - self._clock()), 3)
+        stats.update(self._stats)
+        return stats
+
+
+class GuardedConnect:
+    """Callable drop-in for `psycopg.connect` / `ConnectionPool.connect` guarded by a breaker."""
+
+    def __init__(self, breaker: CircuitBreaker, connect: Callable[..., Any]) -> None:
+        self.breaker = breaker
+        self.connect = connect
+
+    def __call__(self, dsn: Optional[str] = None) -> "_GuardedConnection":
+        return _GuardedConnection(self.breaker, self.connect, dsn)
+
+
+class _GuardedConnection:
+    """Context manager: reject while open, record outcome on exit."""
+
+    def __init__(self, breaker: CircuitBreaker, connect: Callable[..., Any], dsn: Optional[str]) -> None:
+        self._breaker = breaker
+        self._connect = connect
+        self._dsn = dsn
+        self._inner: Any = None
+
+    def __enter__(self) -> Any:
+        if not self._breaker.allow():
+            raise CircuitOpenError("database circuit is open")
+        try:
+            self._inner = self._connect(self._dsn)
+            return self._inner.__enter__()
+        except OUTAGE_ERRORS as exc:
+            self._breaker.record_failure(exc)
+            raise
+        except BaseException:
+            # 障害以外の理由で接続できなかった場合も probe の枠は返す
+            self._breaker.release_probe()
+            raise
+
+    def __exit__(self, exc_type, exc, tb) -> Any:
+        try:
+            result = self._inner.__exit__(exc_type, exc, tb)
+        except OUTAGE_ERRORS as end_exc:
+            self._breaker.record_failure(end_exc)
+            raise
+        if exc_type is not None and issubclass(exc_type, OUTAGE_ERRORS):
+            self._breaker.record_failure(exc)
+        else:
+            # SQL エラーなどは DB に届いているので成功として扱う
+            self._breaker.record_success()
+        return result
@@ -0,0 +1,213 @@
+"""Shared PostgreSQL connection pool (gevent friendly)."""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg
+from gevent.lock import BoundedSemaphore
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class ConnectionPool:
+    """
+    Small connection pool shared by repositories and services.
+
+    `connect()` は `psycopg.connect` と同じく `with` で使える。既存コードの
+    `with self._connect(dsn) as conn` をそのまま差し替えられるよう、ブロック終了時に
+    commit / rollback を行い、接続は閉じずにプールへ戻す。待機は gevent の
+    セマフォで行うため、ハブをブロックしない。
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 4,
+        max_idle: float = 300.0,
+        timeout: float = 5.0,
+        check_interval: float = 30.0,
+        connect: Callable[[str], Any] = psycopg.connect,
+    ) -> None:
+        self.dsn = dsn
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size)
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._connect = connect
+        self._slots = BoundedSemaphore(self.max_size)
+        # (connection, returned_at) の LIFO。直近に使った接続を優先して再利用する。
+        # 末尾から取り出すので先頭ほど古く、返却時に先頭から max_idle 超過分を閉じる
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._stats: Dict[str, float] = {
+            "requests": 0,
+            "requests_waited": 0,
+            "wait_time_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "timeouts": 0,
+            "connections_opened": 0,
+            "connections_discarded": 0,
+        }
+
+    def connect(self, dsn: Optional[str] = None) -> "_PooledConnection":
+        """Return a context manager that borrows a connection from the pool."""
+        if dsn and dsn != self.dsn:
+            logger.debug("ConnectionPool ignores DSN override (%s)", dsn)
+        return _PooledConnection(self)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool counters for monitoring endpoints."""
+        stats: Dict[str, Any] = {
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+        }
+        stats.update(self._stats)
+        stats["wait_time_ms"] = round(self._stats["wait_time_ms"], 3)
+        stats["wait_time_max_ms"] = round(self._stats["wait_time_max_ms"], 3)
+        return stats
+
+    def close(self) -> None:
+        """Close idle connections; connections in use are closed on return."""
+        self._closed = True
+        while self._idle:
+            conn, _ = self._idle.pop()
+            self._discard(conn, count=False)
+
+    def _acquire(self) -> Any:
+        if self._closed:
+            raise PoolTimeout("connection pool is closed")
+
+        self._stats["requests"] += 1
+        if not self._slots.acquire(blocking=False):
+            self._waiting += 1
+            self._stats["requests_waited"] += 1
+            started = time.monotonic()
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                self._waiting -= 1
+                waited_ms = (time.monotonic() - started) * 1000
+                self._stats["wait_time_ms"] += waited_ms
+                self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], waited_ms)
+            if not acquired:
+                self._stats["timeouts"] += 1
+                raise PoolTimeout(f"no connection available within {self.timeout}s")
+
+        try:
+            conn = self._checkout_idle() or self._open()
+        except Exception:
+            self._slots.release()
+            raise
+        self._in_use += 1
+        return conn
+
+    def _release(self, conn: Any, failed: bool) -> None:
+        self._in_use -= 1
+        try:
+            if self._closed or failed or self._is_broken(conn):
+                self._discard(conn)
+            else:
+                now = time.monotonic()
+                self._idle.append((conn, now))
+                self._reap_idle(now)
+        finally:
+            self._slots.release()
+
+    def _checkout_idle(self) -> Any:
+        now = time.monotonic()
+        while self._idle:
+            conn, returned_at = self._idle.pop()
+            idle_for = now - returned_at
+            if self.max_idle > 0 and idle_for > self.max_idle and self._size > self.min_size:
+                self._discard(conn)
+                continue
+            if self.check_interval >= 0 and idle_for > self.check_interval and not self._check(conn):
+                self._discard(conn)
+                continue
+            return conn
+        return None
+
+    def _reap_idle(self, now: float) -> None:
+        """Close connections idle beyond `max_idle` from the bottom of the LIFO (oldest first)."""
+        if self.max_idle <= 0:
+            return
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.pop(0)
+            self._discard(conn)
+
+    def _open(self) -> Any:
+        conn = self._connect(self.dsn)
+        self._size += 1
+        self._stats["connections_opened"] += 1
+        return conn
+
+    def _check(self, conn: Any) -> bool:
+        """Cheap health check before reusing a connection that sat idle."""
+        if self._is_broken(conn):
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as exc:  # noqa: BLE001
+            logger.info("Discarding pooled connection after failed health check: %s", exc)
+            return False
+
+    def _discard(self, conn: Any, count: bool = True) -> None:
+        self._size -= 1
+        if count:
+            self._stats["connections_discarded"] += 1
+        try:
+            conn.close()
+        except Exception:  # noqa: BLE001
+            pass
+
+    @staticmethod
+    def _is_broken(conn: Any) -> bool:
+        return bool(getattr(conn, "closed", False) or getattr(conn, "broken", False))
+
+
+class _PooledConnection:
+    """Context manager returned by `ConnectionPool.connect`."""
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        self._pool = pool
+        self._conn: Any = None
+
+    def __enter__(self) -> Any:
+        self._conn = self._pool._acquire()  # noqa: SLF001
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        conn, self._conn = self._conn, None
+        try:
+            if exc_type is None:
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception as end_exc:
+            # 状態の分からない接続は再利用しない。commit の失敗は書き込みが残っていないので送出する
+            # （rollback の失敗は元の例外をそのまま伝える）
+            logger.warning("Pooled connection failed to finish transaction; discarding it: %s", end_exc)
+            self._pool._release(conn, failed=True)  # noqa: SLF001
+            if exc_type is None:
+                raise
+            return
+        self._pool._release(conn, failed=False)  # noqa: SLF001
@@ -1,17 +1,40 @@
 """Repository interfaces and implementations."""
 
-from .scans import ScanRepository, InMemoryScanRepository, DatabaseScanRepository
+from .scans import ScanRepository, InMemoryScanRepository, DatabaseScanRepository, ScanQueueFull, ScanCommitTimeout
+from .scan_log import LogScanRepository
+from .scan_spool import ScanSpool, ScanSpoolFull
+from .sqlite import (
+    SQLiteDatabase,
+    SQLiteScanRepository,
+    SQLitePartLocationRepository,
+    SQLitePartLocationHistoryRepository,
+)
 from .part_locations import (
     PartLocationRepository,
     InMemoryPartLocationRepository,
     DatabasePartLocationRepository,
+    CachedPartLocationRepository,
+    PartLocationHistoryRepository,
+    DatabasePartLocationHistoryRepository,
 )
 
 __all__ = [
     "ScanRepository",
     "InMemoryScanRepository",
     "DatabaseScanRepository",
+    "ScanQueueFull",
+    "ScanCommitTimeout",
+    "LogScanRepository",
+    "ScanSpool",
+    "ScanSpoolFull",
     "PartLocationRepository",
     "InMemoryPartLocationRepository",
     "DatabasePartLocationRepository",
+    "CachedPartLocationRepository",
+    "PartLocationHistoryRepository",
+    "DatabasePartLocationHistoryRepository",
+    "SQLiteDatabase",
+    "SQLiteScanRepository",
+    "SQLitePartLocationRepository",
+    "SQLitePartLocationHistoryRepository",
 ]
@@ -3,12 +3,18 @@
 from __future__ import annotations
 
 import logging
-from typing import Iterable, Protocol
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Protocol, Sequence, Tuple
 
 import psycopg
+from gevent.event import Event
+from psycopg import sql
 from psycopg.rows import dict_row
 
-from .scans import InMemoryScanRepository, ScanRepository
+from .scans import ScanRepository
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +22,36 @@ logger = logging.getLogger(__name__)
 class PartLocationRepository(Protocol):
     """Protocol for listing part locations."""
 
-    def list(self, limit: int = 200) -> Iterable[dict]:  # noqa: D401
-        """Return recent part locations."""
+    def list(self, limit: int = 200, after: Optional[Sequence[Any]] = None) -> Iterable[dict]:  # noqa: D401
+        """Return recent part locations (older than the `(updated_at, order_code)` key when given)."""
+
+    def snapshot(self) -> Optional[Any]:
+        """Return the latest `change_seq` for change detection, or None if unknown."""
+
+    def changes(self, since: int = 0, limit: int = 200) -> List[dict]:
+        """Return rows upserted after the `change_seq` value `since`, oldest change first."""
+
+    def get(self, order_code: str) -> Optional[dict]:
+        """Return the current location of one order, or None."""
+
+    def by_location(self, location_code: str, limit: int = 200) -> List[dict]:
+        """Return orders currently at `location_code`, newest first."""
+
+
+class PartLocationHistoryRepository(Protocol):
+    """Protocol for reading the part location movement trail."""
+
+    def trail(self, order_code: str, limit: int = 100, before: Optional[Sequence[Any]] = None) -> List[dict]:
+        """Return moves of one order, newest first, older than the `(moved_at, id)` key."""
+
+    def window(
+        self,
+        start: datetime,
+        end: datetime,
+        limit: int = 100,
+        after: Optional[Sequence[Any]] = None,
+    ) -> List[dict]:
+        """Return moves with start <= moved_at < end, oldest first, after the `(moved_at, id)` key."""
 
 
 class DatabasePartLocationRepository:
@@ -27,36 +61,399 @@ class DatabasePartLocationRepository:
         self.dsn = dsn
         self._connect = connect
 
-    def list(self, limit: int = 200) -> Iterable[dict]:
+    def list(self, limit: int = 200, after: Optional[Sequence[Any]] = None) -> Iterable[dict]:
         if not self.dsn:
             logger.debug("PartLocationRepository skipped: DSN not configured")
             return []
 
+        # (updated_at, order_code) のキーセットで続きを返す（idx_part_locations_updated_order）
+        keyset = sql.SQL("WHERE (updated_at, order_code) < (%s::timestamptz, %s)") if after else sql.SQL("")
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(
+                    sql.SQL(
+                        """
+                        SELECT order_code, location_code, device_id, updated_at
+                        FROM part_locations
+                        {keyset}
+                        ORDER BY updated_at DESC, order_code DESC
+                        LIMIT %s
+                        """
+                    ).format(keyset=keyset),
+                    (*(after or ()), limit),
+                )
+                rows = cur.fetchall()
+                return list(rows)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to fetch part locations: %s", exc)
+            return []
+
+    def snapshot(self) -> Optional[Any]:
+        if not self.dsn:
+            return None
+
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor() as cur:
+                # updated_at は同一時刻が並びうるが change_seq は upsert ごとに必ず進む。
+                # 行を消す経路は無いので件数は見ない（COUNT(*) は毎回の全件走査になる）。
+                # MAX は uq_part_locations_change_seq の末尾を 1 件読むだけ
+                cur.execute("SELECT MAX(change_seq) FROM part_locations")
+                return cur.fetchone()[0]
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to read part locations snapshot: %s", exc)
+            return None
+
+    def changes(self, since: int = 0, limit: int = 200) -> List[dict]:
+        if not self.dsn:
+            return []
+
+        # change_seq は upsert ごとに採番される（uq_part_locations_change_seq を範囲走査）
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(
+                    """
+                    SELECT order_code, location_code, device_id, updated_at, change_seq
+                    FROM part_locations
+                    WHERE change_seq > %s
+                    ORDER BY change_seq
+                    LIMIT %s
+                    """,
+                    (since, limit),
+                )
+                return list(cur.fetchall())
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to fetch part location changes: %s", exc)
+            return []
+
+    def get(self, order_code: str) -> Optional[dict]:
+        if not self.dsn:
+            return None
+
+        # order_code は主キーなので 1 行の索引参照
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(
+                    """
+                    SELECT order_code, location_code, device_id, updated_at
+                    FROM part_locations
+                    WHERE order_code = %s
+                    """,
+                    (order_code,),
+                )
+                return cur.fetchone()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to fetch part location %s: %s", order_code, exc)
+            return None
+
+    def by_location(self, location_code: str, limit: int = 200) -> List[dict]:
+        if not self.dsn:
+            return []
+
+        # idx_part_locations_location_updated で絞り込みと並び替えを同時に行う
         try:
             with self._connect(self.dsn) as conn, conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(
                     """
                     SELECT order_code, location_code, device_id, updated_at
                     FROM part_locations
-                    ORDER BY updated_at DESC
+                    WHERE location_code = %s
+                    ORDER BY updated_at DESC, order_code DESC
                     LIMIT %s
                     """,
-                    (limit,),
+                    (location_code, limit),
                 )
-                rows = cur.fetchall()
-                return list(rows)
+                return list(cur.fetchall())
         except Exception as exc:  # noqa: BLE001
-            logger.warning("Failed to fetch part locations: %s", exc)
+            logger.warning("Failed to fetch orders at %s: %s", location_code, exc)
+            return []
+
+
+class CachedPartLocationRepository:
+    """
+    Read-through cache in front of a `PartLocationRepository`.
+
+    結果は問い合わせの形（メソッド名と引数）ごとにバージョン付きで保持する。
+    `BacklogDrainService` が upsert するたびに `bump()` でバージョンを上げ、古い結果は
+    次の参照で読み直す。別プロセスのドレインはバージョンを上げられないため、
+    `ttl` 秒で必ず期限切れにする。同じキーの同時ミスは 1 回の問い合わせにまとめる。
+    """
+
+    def __init__(
+        self,
+        inner: PartLocationRepository,
+        ttl: float = 5.0,
+        max_entries: int = 64,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.inner = inner
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._clock = clock
+        self._version = 0
+        self._entries: "OrderedDict[Hashable, Tuple[int, float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, Event] = {}
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def bump(self, *_: Any) -> int:
+        """Invalidate every cached result (called after the drain upserts rows)."""
+        self._version += 1
+        self._stats["invalidations"] += 1
+        return self._version
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["version"] = self._version
+        stats["entries"] = len(self._entries)
+        stats["ttl"] = self.ttl
+        return stats
+
+    def list(self, limit: int = 200, after: Optional[Sequence[Any]] = None) -> Iterable[dict]:
+        if not after:
+            return self._cached(("list", limit, None), lambda: list(self.inner.list(limit)))
+        return self._cached(("list", limit, tuple(after)), lambda: list(self.inner.list(limit, after=after)))
+
+    def snapshot(self) -> Optional[Any]:
+        snapshot = getattr(self.inner, "snapshot", None)
+        if snapshot is None:
+            return None
+        return self._cached(("snapshot",), snapshot)
+
+    def changes(self, since: int = 0, limit: int = 200) -> List[dict]:
+        changes = getattr(self.inner, "changes", None)
+        if changes is None:
             return []
+        return self._cached(("changes", since, limit), lambda: list(changes(since, limit)))
+
+    def get(self, order_code: str) -> Optional[dict]:
+        get = getattr(self.inner, "get", None)
+        if get is None:
+            return None
+        return self._cached(("get", order_code), lambda: get(order_code))
+
+    def by_location(self, location_code: str, limit: int = 200) -> List[dict]:
+        by_location = getattr(self.inner, "by_location", None)
+        if by_location is None:
+            return []
+        return self._cached(("by_location", location_code, limit), lambda: list(by_location(location_code, limit)))
+
+    def _cached(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self._version and entry[1] > self._clock():
+                self._stats["hits"] += 1
+                self._entries.move_to_end(key)
+                return _copy(entry[2])
+
+            waiting = self._inflight.get(key)
+            if waiting is None:
+                break
+            # 別の greenlet が同じキーを読み込み中なら、その結果を待って使う
+            waiting.wait(timeout=5.0)
+            if key in self._inflight:
+                break
+
+        self._stats["misses"] += 1
+        version = self._version
+        event = self._inflight[key] = Event()
+        try:
+            value = loader()
+            self._entries[key] = (version, self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            return _copy(value)
+        finally:
+            self._inflight.pop(key, None)
+            event.set()
+
+
+def _copy(value: Any) -> Any:
+    # 呼び出し側がリストを書き換えてもキャッシュに影響しないようにする
+    return list(value) if isinstance(value, list) else value
 
 
 class InMemoryPartLocationRepository:
-    """In-memory location repository based on scan repository buffer."""
+    """
+    In-memory part location store keyed by `order_code`.
+
+    スキャン保存のたびに O(1) で更新する（後勝ち、ドレインの upsert と同じ）。注文は
+    更新順の OrderedDict、所在→注文は挿入順付き集合で持ち、`capacity` を超えたら
+    最も長く更新されていない注文から捨てる（LRU）。`updated_at` は単調増加にそろえ、
+    一覧・キーセット・差分同期が `DatabasePartLocationRepository` と同じ結果になる。
+    """
+
+    def __init__(self, scan_repository: ScanRepository, capacity: int = 10000) -> None:
+        self.capacity = max(1, capacity)
+        # order_code -> (location_code, device_id, updated_at, change_seq)、末尾ほど新しい
+        self._by_order: "OrderedDict[str, Tuple[str, Optional[str], datetime, int]]" = OrderedDict()
+        # 所在ごとの注文（dict を挿入順付き集合として使う）
+        self._by_location: Dict[str, Dict[str, None]] = {}
+        self._change_seq = 0
+        self._last_updated: Optional[datetime] = None
+        self.evictions = 0
+        subscribe = getattr(scan_repository, "subscribe", None)
+        if subscribe is not None:
+            subscribe(self.observe)
+
+    def observe(self, payloads: Sequence[Dict[str, Any]]) -> None:
+        """Apply saved scans to the store (last write wins, like the drain upsert)."""
+        now = datetime.now(timezone.utc)
+        for payload in payloads:
+            order_code = payload.get("order_code")
+            location_code = payload.get("location_code")
+            if not order_code or not location_code:
+                continue
+            # 同じ時刻が並ぶと (updated_at, order_code) の順と更新順がずれるため 1µs ずつ進める
+            if self._last_updated is not None and now <= self._last_updated:
+                now = self._last_updated + timedelta(microseconds=1)
+            self._last_updated = now
+            self._change_seq += 1
+
+            previous = self._by_order.pop(order_code, None)
+            if previous is not None:
+                self._unindex(order_code, previous[0])
+            self._by_order[order_code] = (location_code, payload.get("device_id"), now, self._change_seq)
+            self._by_location.setdefault(location_code, {})[order_code] = None
+
+            while len(self._by_order) > self.capacity:
+                evicted, row = self._by_order.popitem(last=False)
+                self._unindex(evicted, row[0])
+                self.evictions += 1
 
-    def __init__(self, scan_repository: ScanRepository) -> None:
-        self._scan_repository = scan_repository
+    def _unindex(self, order_code: str, location_code: str) -> None:
+        orders = self._by_location.get(location_code)
+        if orders is not None:
+            orders.pop(order_code, None)
+            if not orders:
+                del self._by_location[location_code]
 
-    def list(self, limit: int = 200) -> Iterable[dict]:
-        if isinstance(self._scan_repository, InMemoryScanRepository):
-            return list(self._scan_repository.recent(limit))
-        return []
+    def get(self, order_code: str) -> Optional[dict]:
+        row = self._by_order.get(order_code)
+        return _memory_row(order_code, row) if row is not None else None
+
+    def by_location(self, location_code: str, limit: int = 200) -> List[dict]:
+        orders = self._by_location.get(location_code)
+        if not orders or limit <= 0:
+            return []
+        # 後から入った注文ほど新しいので末尾から limit 件だけ読む
+        return [_memory_row(code, self._by_order[code]) for code in islice(reversed(orders), limit)]
+
+    def list(self, limit: int = 200, after: Optional[Sequence[Any]] = None) -> Iterable[dict]:
+        if limit <= 0:
+            return []
+        rows = reversed(self._by_order.items())
+        if after:
+            try:
+                key = (_as_datetime(after[0]), str(after[1]))
+            except (TypeError, ValueError) as exc:
+                logger.warning("Invalid part locations cursor: %s", exc)
+                return []
+            rows = (item for item in rows if (item[1][2], item[0]) < key)
+        return [_memory_row(code, row) for code, row in islice(rows, limit)]
+
+    def snapshot(self) -> Optional[Any]:
+        return self._change_seq
+
+    def changes(self, since: int = 0, limit: int = 200) -> List[dict]:
+        # 更新順 == change_seq 順なので、新しい方から since まで遡って反転する
+        newer = []
+        for code, row in reversed(self._by_order.items()):
+            if row[3] <= since:
+                break
+            newer.append((code, row))
+        return [_memory_row(code, row, with_seq=True) for code, row in islice(reversed(newer), limit)]
+
+
+def _memory_row(
+    order_code: str, row: Tuple[str, Optional[str], datetime, int], with_seq: bool = False
+) -> Dict[str, Any]:
+    location_code, device_id, updated_at, change_seq = row
+    result = {
+        "order_code": order_code,
+        "location_code": location_code,
+        "device_id": device_id,
+        "updated_at": updated_at,
+    }
+    if with_seq:
+        result["change_seq"] = change_seq
+    return result
+
+
+def _as_datetime(value: Any) -> datetime:
+    # cursor から戻した値は ISO 8601 文字列
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+class DatabasePartLocationHistoryRepository:
+    """
+    PostgreSQL-backed reader for `part_location_history`.
+
+    ページングは `(moved_at, id)` のキーセット方式（OFFSET を使わない）。1 注文の履歴は
+    `(order_code, moved_at, id)` の btree、期間指定は `moved_at` の BRIN で引く。
+    """
+
+    def __init__(self, dsn: str, connect=psycopg.connect, table: str = "part_location_history") -> None:
+        self.dsn = dsn
+        self.table = table
+        self._connect = connect
+
+    def trail(self, order_code: str, limit: int = 100, before: Optional[Sequence[Any]] = None) -> List[dict]:
+        keyset = sql.SQL("AND (moved_at, id) < (%s::timestamptz, %s)") if before else sql.SQL("")
+        query = sql.SQL(
+            """
+            SELECT id, order_code, location_code, device_id, moved_at
+            FROM {table}
+            WHERE order_code = %s {keyset}
+            ORDER BY moved_at DESC, id DESC
+            LIMIT %s
+            """
+        ).format(table=sql.Identifier(self.table), keyset=keyset)
+        params = (order_code, *(before or ()), limit)
+        return self._fetch(query, params)
+
+    def window(
+        self,
+        start: datetime,
+        end: datetime,
+        limit: int = 100,
+        after: Optional[Sequence[Any]] = None,
+    ) -> List[dict]:
+        # 続きのページは下限も cursor 時刻まで上げ、BRIN で読む範囲を狭める
+        keyset = (
+            sql.SQL("AND moved_at >= %s::timestamptz AND (moved_at, id) > (%s::timestamptz, %s)")
+            if after
+            else sql.SQL("")
+        )
+        query = sql.SQL(
+            """
+            SELECT id, order_code, location_code, device_id, moved_at
+            FROM {table}
+            WHERE moved_at >= %s AND moved_at < %s {keyset}
+            ORDER BY moved_at, id
+            LIMIT %s
+            """
+        ).format(table=sql.Identifier(self.table), keyset=keyset)
+        params = (start, end, *((after[0], *after) if after else ()), limit)
+        return self._fetch(query, params)
+
+    def _fetch(self, query: sql.Composed, params: Sequence[Any]) -> List[dict]:
+        if not self.dsn:
+            logger.debug("PartLocationHistoryRepository skipped: DSN not configured")
+            return []
+
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(query, tuple(params))
+                return list(cur.fetchall())
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to fetch part location history: %s", exc)
+            return []
@@ -0,0 +1,370 @@
+"""
+Append-only segment log backend for scan storage.
+
+PostgreSQL が無い／止まっている Pi でも再起動で消えないようにスキャンを
+ローカルディスクへ追記する。レコードは `<長さ:uint32><crc32:uint32><JSON>` の
+長さ付き形式で、セグメントファイル（`00000001.seg` …）へ順に書く。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import gevent
+from gevent.event import Event
+from gevent.lock import Semaphore
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".seg"
+
+
+def encode_record(payload: Any) -> bytes:
+    """Encode one payload as a `<length><crc32><JSON>` record."""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+class ScanLogFull(RuntimeError):
+    """Raised when `expire=False` and an append would need more than `max_segments` segments."""
+
+
+class LogScanRepository:
+    """
+    Durable scan repository writing length-prefixed records to rotating segment files.
+
+    - `save()` は OS のページキャッシュへ書いた時点で戻り、`fsync` はバックグラウンド
+      greenlet が `fsync_batch` 件ごと、または最初の未同期書き込みから
+      `fsync_interval` 秒でまとめて行う（gevent のスレッドプールで実行し hub を止めない）。
+      電源断で失い得るのは最大でこの間隔分。`fsync_interval=0` なら毎回同期する。
+    - セグメントが `segment_bytes` を超えると次のファイルへ切り替え、`max_segments`
+      を超えた古いセグメントは削除する。`expire=False` なら削除せず、上限を超える
+      追記を 1 件も書かずに `ScanLogFull` で拒否する（未送信のスプールなど）。
+    - 起動時は最後のセグメントだけを走査してレコード位置を復元し、途中で切れた
+      レコード（長さ不足・CRC 不一致）以降を切り詰める。
+    - `recent()` は mmap したセグメントから末尾 `limit` 件だけをデコードする。
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_segments: int = 16,
+        fsync_interval: float = 0.05,
+        fsync_batch: int = 256,
+        expire: bool = True,
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = max(_HEADER.size + 1, segment_bytes)
+        self.max_segments = max(1, max_segments)
+        self.expire = expire
+        self.fsync_interval = max(0.0, fsync_interval)
+        self.fsync_batch = max(1, fsync_batch)
+        self._listeners: List[Callable[[Sequence[Dict]], None]] = []
+        # 封印済みセグメントのレコード位置（recent() で必要になった時だけ作る）
+        self._sealed_offsets: Dict[int, array] = {}
+        self._sync_lock = Semaphore()
+        self._unsynced = 0
+        self._has_unsynced = Event()
+        self._batch_full = Event()
+        self._syncer: gevent.Greenlet | None = None
+        self._closed = False
+        self._stats = {"appended": 0, "fsyncs": 0, "rotations": 0, "truncated_bytes": 0, "expired_records": 0}
+
+        segments = self._segment_ids()
+        self._segment_id = segments[-1] if segments else 1
+        self._offsets = self._recover(self._path(self._segment_id))
+        self._file = open(self._path(self._segment_id), "ab")  # noqa: SIM115
+        self._size = self._file.tell()
+
+    def subscribe(self, listener: Callable[[Sequence[Dict]], None]) -> None:
+        """
+        Call `listener(payloads)` after every save.
+
+        登録時に復元した最後のセグメントの内容を一度渡すので、所在ストアなどの
+        メモリ上の索引も再起動後に復元される。
+        """
+        self._listeners.append(listener)
+        if len(self._offsets):
+            listener(self._read(self._segment_id, self._offsets))
+
+    def save(self, payload: Dict) -> bool:
+        return bool(self.save_many([payload]))
+
+    def save_many(self, payloads: Sequence[Dict]) -> List[Dict]:
+        """Append payloads and schedule a group fsync; returns every payload (no dedup here)."""
+        if not payloads:
+            return []
+        records = [encode_record(payload) for payload in payloads]
+        if not self.expire:
+            self._check_capacity(records)
+        for record in records:
+            if self._size + len(record) > self.segment_bytes and self._size > 0:
+                self._rotate()
+            self._file.write(record)
+            self._offsets.append(self._size)
+            self._size += len(record)
+        self._file.flush()
+        self._stats["appended"] += len(payloads)
+        self._unsynced += len(payloads)
+        if self.fsync_interval == 0 or self._closed:
+            self.sync()
+        else:
+            self._ensure_syncer()
+            self._has_unsynced.set()
+            if self._unsynced >= self.fsync_batch:
+                self._batch_full.set()
+        for listener in self._listeners:
+            listener(payloads)
+        return list(payloads)
+
+    def recent(self, limit: int = 10) -> Iterable[Dict]:
+        if limit <= 0:
+            return []
+        chunks: List[List[Dict]] = []
+        remaining = limit
+        segment_id = self._segment_id
+        offsets = self._offsets
+        while remaining > 0:
+            if len(offsets):
+                tail = offsets[-remaining:]
+                chunks.append(self._read(segment_id, tail))
+                remaining -= len(tail)
+                if remaining <= 0:
+                    break
+            previous = self._previous_segment(segment_id)
+            if previous is None:
+                break
+            segment_id = previous
+            offsets = self._sealed(segment_id)
+        return [payload for chunk in reversed(chunks) for payload in chunk]
+
+    def sync(self) -> None:
+        """Flush and fsync the active segment now."""
+        with self._sync_lock:
+            if not self._unsynced:
+                self._has_unsynced.clear()
+                self._batch_full.clear()
+                return
+            pending = self._unsynced
+            self._file.flush()
+            fd = self._file.fileno()
+            # fsync はブロッキングなのでスレッドプールで実行し、その間も受信を続ける
+            gevent.get_hub().threadpool.apply(os.fsync, (fd,))
+            self._unsynced = max(0, self._unsynced - pending)
+            self._stats["fsyncs"] += 1
+            if not self._unsynced:
+                self._has_unsynced.clear()
+                self._batch_full.clear()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the background fsync and sync whatever is still pending."""
+        self._closed = True
+        syncer, self._syncer = self._syncer, None
+        if syncer is not None:
+            # kill すると fsync の途中で止まりうるので、起こしてループを抜けるのを待つ
+            self._has_unsynced.set()
+            self._batch_full.set()
+            syncer.join(timeout=timeout)
+            if not syncer.dead:
+                logger.warning("Scan log fsync greenlet did not stop within %ss", timeout)
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return segment and fsync counters."""
+        stats: Dict[str, Any] = {
+            "directory": str(self.directory),
+            "segment": self._segment_id,
+            "segments": len(self._segment_ids()),
+            "segment_bytes": self._size,
+            "segment_records": len(self._offsets),
+            "unsynced": self._unsynced,
+        }
+        stats.update(self._stats)
+        return stats
+
+    @property
+    def expired_records(self) -> int:
+        """Records lost to `max_segments` retention since start-up."""
+        return int(self._stats["expired_records"])
+
+    def seal(self) -> List[int]:
+        """
+        Close the active segment if it holds records and return every sealed segment id.
+
+        ローカルスプールの再送用。返したセグメントには以後追記されないので、
+        読み出し・削除を他の書き込みと並行して行える。
+        """
+        if len(self._offsets):
+            self._rotate()
+        return self.sealed_segments()
+
+    def sealed_segments(self) -> List[int]:
+        """Return ids of segments that no longer receive appends (oldest first)."""
+        return [segment_id for segment_id in self._segment_ids() if segment_id < self._segment_id]
+
+    def read_segment(self, segment_id: int) -> List[Dict]:
+        """Decode every record of a sealed segment."""
+        return self._read(segment_id, self._sealed(segment_id))
+
+    def remove_segment(self, segment_id: int) -> int:
+        """Delete a sealed segment; returns the number of records it held."""
+        if segment_id >= self._segment_id:
+            raise ValueError(f"segment {segment_id} is still active")
+        records = len(self._sealed(segment_id))
+        self._path(segment_id).unlink(missing_ok=True)
+        self._sealed_offsets.pop(segment_id, None)
+        return records
+
+    def move_segment(self, segment_id: int, destination: str | os.PathLike[str]) -> int:
+        """Move a sealed segment out of the log (kept for inspection); returns its record count."""
+        if segment_id >= self._segment_id:
+            raise ValueError(f"segment {segment_id} is still active")
+        records = len(self._sealed(segment_id))
+        target = Path(destination)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self._path(segment_id).replace(target)
+        self._sealed_offsets.pop(segment_id, None)
+        return records
+
+    def record_count(self) -> int:
+        """Count records across all segments on disk (scans sealed segments once)."""
+        return len(self._offsets) + sum(len(self._sealed(segment_id)) for segment_id in self.sealed_segments())
+
+    def _ensure_syncer(self) -> None:
+        if self._syncer is None or self._syncer.dead:
+            self._syncer = gevent.spawn(self._sync_loop)
+
+    def _sync_loop(self) -> None:
+        while not self._closed:
+            self._has_unsynced.wait()
+            if self._unsynced < self.fsync_batch:
+                self._batch_full.wait(timeout=self.fsync_interval)
+            try:
+                self.sync()
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Scan log fsync failed: %s", exc)
+                gevent.sleep(self.fsync_interval)
+
+    def _rotate(self) -> None:
+        sealing = self._segment_id
+        with self._sync_lock:
+            if self._segment_id != sealing:
+                return  # 待っている間に別の greenlet が切り替えた
+            # 切り替え中は hub を譲らず、旧セグメントへの書き込みと交錯させない
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._unsynced = 0
+            self._stats["fsyncs"] += 1
+            self._sealed_offsets[self._segment_id] = self._offsets
+            self._segment_id += 1
+            self._offsets = array("Q")
+            self._file = open(self._path(self._segment_id), "ab")  # noqa: SIM115
+            self._size = 0
+            self._stats["rotations"] += 1
+        if not self.expire:
+            return
+        for stale in self._segment_ids()[: -self.max_segments]:
+            records = len(self._sealed(stale))
+            try:
+                self._path(stale).unlink()
+            except OSError as exc:
+                logger.warning("Failed to remove scan log segment %s: %s", stale, exc)
+                continue
+            self._sealed_offsets.pop(stale, None)
+            self._stats["expired_records"] += records
+
+    def _check_capacity(self, records: Sequence[bytes]) -> None:
+        # save_many と同じ切り替え規則でセグメント数を見積もり、上限を超えるなら何も書かない
+        segments = len(self._segment_ids())
+        size = self._size
+        for record in records:
+            if size + len(record) > self.segment_bytes and size > 0:
+                segments += 1
+                size = 0
+            size += len(record)
+        if segments > self.max_segments:
+            raise ScanLogFull(
+                f"{self.directory} would need {segments} segment(s) (max_segments={self.max_segments})"
+            )
+
+    def _recover(self, path: Path) -> array:
+        """Index the records of `path`, truncating a torn tail left by a crash."""
+        offsets, valid_end = _scan_segment(path)
+        if path.exists() and path.stat().st_size > valid_end:
+            truncated = path.stat().st_size - valid_end
+            logger.warning("Scan log %s: truncating %s byte(s) of incomplete records", path.name, truncated)
+            with open(path, "r+b") as handle:
+                handle.truncate(valid_end)
+            self._stats["truncated_bytes"] += truncated
+        return offsets
+
+    def _sealed(self, segment_id: int) -> array:
+        offsets = self._sealed_offsets.get(segment_id)
+        if offsets is None:
+            offsets, _ = _scan_segment(self._path(segment_id))
+            self._sealed_offsets[segment_id] = offsets
+        return offsets
+
+    def _read(self, segment_id: int, offsets: Sequence[int]) -> List[Dict]:
+        if not len(offsets):
+            return []
+        path = self._path(segment_id)
+        try:
+            with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                payloads = []
+                for offset in offsets:
+                    length, _crc = _HEADER.unpack_from(view, offset)
+                    start = offset + _HEADER.size
+                    payloads.append(json.loads(view[start : start + length]))
+                return payloads
+        except (OSError, ValueError) as exc:
+            logger.warning("Failed to read scan log %s: %s", path.name, exc)
+            return []
+
+    def _previous_segment(self, segment_id: int) -> Optional[int]:
+        older = [candidate for candidate in self._segment_ids() if candidate < segment_id]
+        return older[-1] if older else None
+
+    def _segment_ids(self) -> List[int]:
+        ids = []
+        for path in self.directory.glob(f"*{_SEGMENT_SUFFIX}"):
+            try:
+                ids.append(int(path.stem))
+            except ValueError:
+                continue
+        return sorted(ids)
+
+    def _path(self, segment_id: int) -> Path:
+        return self.directory / f"{segment_id:08d}{_SEGMENT_SUFFIX}"
+
+
+def _scan_segment(path: Path) -> tuple[array, int]:
+    """Return record offsets and the end of the last intact record."""
+    offsets = array("Q")
+    if not path.exists() or path.stat().st_size == 0:
+        return offsets, 0
+    with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        size = len(view)
+        position = 0
+        while position + _HEADER.size <= size:
+            length, crc = _HEADER.unpack_from(view, position)
+            end = position + _HEADER.size + length
+            if end > size or zlib.crc32(view[position + _HEADER.size : end]) != crc:
+                break
+            offsets.append(position)
+            position = end
+    return offsets, position
@@ -0,0 +1,167 @@
+"""
+Local disk spool for scans that could not reach PostgreSQL.
+
+DB 停止中やサーキットブレーカーが開いている間の書き込みを、セグメントログと同じ
+`<長さ><crc32><JSON>` 形式でローカルディスクへ退避する。再送は
+`raspberrypiserver.services.SpoolReplayer` が封印済みセグメント単位で行う。
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+from .scan_log import LogScanRepository, ScanLogFull, encode_record
+
+logger = logging.getLogger(__name__)
+
+_QUARANTINE_DIR = "quarantine"
+
+
+class ScanSpoolFull(RuntimeError):
+    """Raised when the spool already holds `max_segments` segments awaiting replay."""
+
+
+class ScanSpool:
+    """
+    Append-only spool of `{"received_at", "payload"}` records.
+
+    - 受信時刻を一緒に保存し、再送時も backlog のドレイン順（`received_at, id`）を保つ。
+    - fsync はセグメントログと同じグループ fsync（`fsync_interval` / `fsync_batch`）。
+    - 未送信のセグメントは消さない。`max_segments` 分たまったら以降の追記を
+      `ScanSpoolFull` で拒否する（件数は `rejected`。呼び出し側が 503 などで失敗を返す）。
+    - 再送できないレコードは `quarantine_records()`（セグメントごとなら `quarantine()`）で
+      `quarantine/` へ移し、後続の再送と直接書き込みへの復帰を止めないようにする。
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        segment_bytes: int = 8 * 1024 * 1024,
+        max_segments: int = 64,
+        fsync_interval: float = 0.05,
+        fsync_batch: int = 256,
+    ) -> None:
+        self._log = LogScanRepository(
+            directory,
+            segment_bytes=segment_bytes,
+            max_segments=max_segments,
+            fsync_interval=fsync_interval,
+            fsync_batch=fsync_batch,
+            expire=False,
+        )
+        self._recovered = self._log.record_count()
+        self._spooled = 0
+        self._removed = 0
+        self._rejected = 0
+        self._quarantined = 0
+        self._full = False
+        if self._recovered:
+            logger.warning("Scan spool %s holds %s record(s) awaiting replay", self._log.directory, self._recovered)
+
+    @property
+    def directory(self) -> str:
+        return str(self._log.directory)
+
+    @property
+    def quarantine_dir(self) -> Path:
+        return self._log.directory / _QUARANTINE_DIR
+
+    @property
+    def depth(self) -> int:
+        """Records still waiting for replay."""
+        return max(0, self._recovered + self._spooled - self._removed)
+
+    def append(self, payloads: Sequence[Dict], received_at: datetime | None = None) -> None:
+        """Spool payloads stamped with their receive time (raises `ScanSpoolFull` when full)."""
+        if not payloads:
+            return
+        stamp = (received_at or datetime.now(timezone.utc)).isoformat()
+        try:
+            self._log.save_many([{"received_at": stamp, "payload": payload} for payload in payloads])
+        except ScanLogFull as exc:
+            self._rejected += len(payloads)
+            self._full = True
+            raise ScanSpoolFull(f"scan spool is full: {exc}") from exc
+        self._spooled += len(payloads)
+        self._full = False
+
+    def pending_segments(self) -> List[int]:
+        """
+        Return segment ids in replay order.
+
+        封印済みセグメントが残っている間は追記中のセグメントを封印しない
+        （DB が落ちたままの再試行で小さなセグメントが増え続けないようにする）。
+        """
+        return self._log.sealed_segments() or self._log.seal()
+
+    def read(self, segment_id: int) -> List[Dict[str, Any]]:
+        return self._log.read_segment(segment_id)
+
+    def discard(self, segment_id: int) -> int:
+        """Drop a replayed segment; returns the number of records removed."""
+        removed = self._log.remove_segment(segment_id)
+        self._removed += removed
+        self._full = False
+        return removed
+
+    def quarantine(self, segment_id: int) -> int:
+        """Move a segment that cannot be replayed to `quarantine/`; returns its record count."""
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        moved = self._log.move_segment(segment_id, self.quarantine_dir / f"{stamp}-{segment_id:08d}.seg")
+        self._removed += moved
+        self._quarantined += moved
+        self._full = False
+        return moved
+
+    def quarantine_records(self, segment_id: int, records: Sequence[Dict[str, Any]]) -> int:
+        """
+        Keep only `records` of a segment in `quarantine/` and drop the segment; returns len(records).
+
+        残りのレコードは呼び出し側が再送済みの前提。隔離ファイルはセグメントと同じ形式で
+        書き、fsync してから元のセグメントを消す。
+        """
+        if not records:
+            return self.discard(segment_id)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        target = self.quarantine_dir / f"{stamp}-{segment_id:08d}.seg"
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "wb") as handle:
+            handle.write(b"".join(encode_record(record) for record in records))
+            handle.flush()
+            os.fsync(handle.fileno())
+        self.discard(segment_id)
+        self._quarantined += len(records)
+        return len(records)
+
+    def quarantined_segments(self) -> int:
+        """Segments sitting in `quarantine/` (including ones moved before a restart)."""
+        if not self.quarantine_dir.is_dir():
+            return 0
+        return sum(1 for _ in self.quarantine_dir.glob("*.seg"))
+
+    def sync(self) -> None:
+        self._log.sync()
+
+    def close(self) -> None:
+        self._log.close()
+
+    def stats(self) -> Dict[str, Any]:
+        log_stats = self._log.stats()
+        return {
+            "directory": self.directory,
+            "depth": self.depth,
+            "segments": log_stats["segments"],
+            "max_segments": self._log.max_segments,
+            "full": self._full,
+            "spooled": self._spooled,
+            "recovered": self._recovered,
+            "rejected": self._rejected,
+            "quarantined": self._quarantined,
+            "quarantined_segments": self.quarantined_segments(),
+            "unsynced": log_stats["unsynced"],
+            "fsyncs": log_stats["fsyncs"],
+        }
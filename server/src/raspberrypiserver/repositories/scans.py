@@ -1,56 +1,210 @@
 """
-Repository abstraction for scan ingestion.
+Scan repositories: the `ScanRepository` protocol and its in-memory / PostgreSQL backends.
 
-This module defines a minimal interface to allow swapping implementations
-when database integration is ready. For now it keeps recent payloads in memory
-and exposes hooks for future persistence.
+`DatabaseScanRepository` は `scan_ingest_backlog` へ複数行 INSERT で書き込み、
+`durability`（`sync` / `group` / `async`）で同期書き込み・グループコミット・
+write-behind キューを切り替える。DB 障害時は `ScanSpool` へ退避し、
+`SpoolReplayer` が一時テーブルへの `COPY`（`copy_records`）で backlog へ戻す。
+直近のスキャンは `ScanRingBuffer` に保存済みの分だけを保持する。
 """
 
 from __future__ import annotations
 
+import json
 import logging
-from collections import deque
-from typing import Callable, Deque, Dict, Iterable, Protocol
+import sys
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Protocol, Sequence
 
+import gevent
 import psycopg
+from gevent.event import AsyncResult, Event
 from psycopg import sql
 from psycopg.types.json import Jsonb
 
+from raspberrypiserver.database.breaker import OUTAGE_ERRORS, CircuitOpenError
+
+from .scan_spool import ScanSpool, ScanSpoolFull
+
 
 class ScanRepository(Protocol):
     """Protocol defining scan repository behavior."""
 
-    def save(self, payload: Dict) -> None:  # noqa: D401
-        """Persist a scan payload."""
+    def save(self, payload: Dict) -> bool:  # noqa: D401
+        """Persist a scan payload; False when storage dropped it as a duplicate."""
+
+    def save_many(self, payloads: Sequence[Dict]) -> List[Dict]:
+        """
+        Persist several scan payloads in one write.
+
+        保存した（重複として捨てなかった）ペイロードを入力順で返す。件数はその長さ。
+        """
 
     def recent(self, limit: int = 10) -> Iterable[Dict]:
         """Return most recent payloads (debug/testing aid)."""
 
 
+class _ScanRecord:
+    """Compact stored scan (no per-record dict for the common fields)."""
+
+    __slots__ = ("order_code", "location_code", "device_id", "metadata", "rest")
+
+
+class ScanRingBuffer:
+    """
+    Fixed-capacity ring buffer of recent scans.
+
+    スキャンは `__slots__` のレコードに詰め、繰り返し現れる `location_code` /
+    `device_id` は `sys.intern` で 1 つの文字列を共有する。`recent(limit)` は末尾から
+    `limit` 件だけ読み、バッファ全体はコピーしない。容量に達するまでは必要な分だけ
+    伸ばし、以降は最も古い位置を上書きする。
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(0, capacity)
+        self._slots: List[_ScanRecord] = []
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def append(self, payload: Dict) -> None:
+        if not self.capacity:
+            return
+        record = _pack(payload)
+        if len(self._slots) < self.capacity:
+            self._slots.append(record)
+            return
+        self._slots[self._next] = record
+        self._next = (self._next + 1) % self.capacity
+
+    def extend(self, payloads: Iterable[Dict]) -> None:
+        for payload in payloads:
+            self.append(payload)
+
+    def recent(self, limit: int) -> List[Dict]:
+        """Return the newest `limit` payloads, oldest first."""
+        size = len(self._slots)
+        count = min(max(limit, 0), size)
+        if not count:
+            return []
+        # 満杯になる前は _next == 0 なので、末尾は常に _next - 1
+        start = self._next - count
+        if start >= 0:
+            records = self._slots[start : self._next]
+        else:
+            records = self._slots[size + start :] + self._slots[: self._next]
+        return [_unpack(record) for record in records]
+
+
+def _pack(payload: Dict) -> _ScanRecord:
+    record = _ScanRecord()
+    record.order_code = record.location_code = record.device_id = record.metadata = record.rest = None
+    for key, value in payload.items():
+        # 想定外の型（None を含む）は rest にそのまま残し、往復で形が変わらないようにする
+        if key == "order_code" and isinstance(value, str):
+            record.order_code = value
+        elif key == "location_code" and isinstance(value, str):
+            record.location_code = sys.intern(value)
+        elif key == "device_id" and isinstance(value, str):
+            record.device_id = sys.intern(value)
+        elif key == "metadata" and isinstance(value, dict):
+            record.metadata = value
+        else:
+            if record.rest is None:
+                record.rest = {}
+            record.rest[key] = value
+    return record
+
+
+def _unpack(record: _ScanRecord) -> Dict:
+    payload: Dict[str, Any] = {}
+    if record.order_code is not None:
+        payload["order_code"] = record.order_code
+    if record.location_code is not None:
+        payload["location_code"] = record.location_code
+    if record.device_id is not None:
+        payload["device_id"] = record.device_id
+    if record.metadata is not None:
+        payload["metadata"] = record.metadata
+    if record.rest:
+        payload.update(record.rest)
+    return payload
+
+
 class InMemoryScanRepository:
     """Simple in-memory storage for development/testing."""
 
     def __init__(self, capacity: int = 100) -> None:
-        self._items: Deque[Dict] = deque(maxlen=capacity)
+        self._items = ScanRingBuffer(capacity)
+        self._listeners: List[Callable[[Sequence[Dict]], None]] = []
 
-    def save(self, payload: Dict) -> None:
+    def subscribe(self, listener: Callable[[Sequence[Dict]], None]) -> None:
+        """Call `listener(payloads)` after every save (used to keep in-memory indexes current)."""
+        self._listeners.append(listener)
+
+    def save(self, payload: Dict) -> bool:
         self._items.append(payload)
+        self._notify([payload])
+        return True
+
+    def save_many(self, payloads: Sequence[Dict]) -> List[Dict]:
+        self._items.extend(payloads)
+        self._notify(payloads)
+        return list(payloads)
+
+    def _notify(self, payloads: Sequence[Dict]) -> None:
+        for listener in self._listeners:
+            listener(payloads)
 
     def recent(self, limit: int = 10) -> Iterable[Dict]:
-        if limit <= 0:
-            return []
-        return list(self._items)[-limit:]
+        return self._items.recent(limit)
 
 
 logger = logging.getLogger(__name__)
 
 
+DURABILITY_MODES = ("sync", "group", "async")
+OVERFLOW_POLICIES = ("flush", "drop")
+BACKLOG_LAYOUTS = ("plain", "partitioned")
+
+# 時間パーティション構成では scan_id の一意インデックスを張れない（パーティションキーを
+# 含む必要がある）ため、再送の排除は ScanDeduplicator とドレインの後勝ちに任せる
+_CONFLICT_CLAUSES = {
+    "plain": sql.SQL(
+        "ON CONFLICT ((payload->'metadata'->>'scan_id')) "
+        "WHERE (payload->'metadata'->>'scan_id') IS NOT NULL DO NOTHING"
+    ),
+    "partitioned": sql.SQL(""),
+}
+
+
+class ScanQueueFull(RuntimeError):
+    """Raised when `overflow="drop"` discards payloads because the write-behind queue is full."""
+
+
+class ScanCommitTimeout(RuntimeError):
+    """Raised in `durability="group"` when the group commit does not finish within `group_timeout`."""
+
+
 class DatabaseScanRepository:
     """
-    Placeholder repository that represents the future database-backed implementation.
+    PostgreSQL-backed scan repository writing into `scan_ingest_backlog`.
+
+    `durability` で書き込みタイミングを切り替える。
+    - `sync`: `save()` 内で 1 件ずつ INSERT / commit する（従来動作）。
+    - `group`: キューへ積み、バックグラウンド greenlet のグループコミット完了を待って戻る。
+    - `async`: キューへ積んだ時点で戻る（write-behind）。プロセス異常終了時は未書き込み分を失う。
+
+    キューは `flush_size` 件に達するか最初の 1 件から `flush_interval` 秒経過で
+    まとめて 1 トランザクションで書き込む。`queue_size` を超えた場合の扱いは
+    `overflow` で指定する（`flush`: 呼び出し元で同期フラッシュして背圧をかける、
+    `drop`: 新しいペイロードを捨ててカウントする）。
 
-    For現在の段階では実際の DB 書き込みを行わず、内部バッファに保持しつつ
-    「TODO: persist」ログを残す実装とする。
+    `spool` を渡すと、DB 障害（接続失敗・ブレーカー open）で書けなかったスキャンを
+    ローカルディスクへ退避する。スプールに未再送の行が残っている間は、到着順を
+    保つため新しいスキャンもスプールへ追記する。再送時の重複判定には `history_table`
+    （ドレイン済みスキャンの履歴。空文字なら見ない）も使う。
     """
 
     def __init__(
@@ -58,21 +212,200 @@ class DatabaseScanRepository:
         dsn: str,
         buffer_size: int = 500,
         connect_factory: Callable[[str], psycopg.Connection] | None = None,
+        durability: str = "sync",
+        flush_size: int = 200,
+        flush_interval: float = 0.02,
+        queue_size: int = 10000,
+        overflow: str = "flush",
+        group_timeout: float = 5.0,
+        layout: str = "plain",
+        spool: ScanSpool | None = None,
+        history_table: str = "part_location_history",
     ) -> None:
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"unsupported durability mode: {durability}")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unsupported overflow policy: {overflow}")
+        if layout not in BACKLOG_LAYOUTS:
+            raise ValueError(f"unsupported backlog layout: {layout}")
         self._dsn = dsn
-        self._buffer: Deque[Dict] = deque(maxlen=buffer_size)
+        self._buffer = ScanRingBuffer(buffer_size)
         self._connect_factory = connect_factory or psycopg.connect
+        self.durability = durability
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.queue_size = max(self.flush_size, queue_size)
+        self.overflow = overflow
+        self.group_timeout = group_timeout
+        self.layout = layout
+        self.spool = spool
+        self.history_table = history_table
+        self._pending: List[Dict] = []
+        self._pending_done: AsyncResult = AsyncResult()
+        self._has_pending = Event()
+        self._batch_full = Event()
+        self._flusher: gevent.Greenlet | None = None
+        self._closed = False
+        self._stats = {
+            "flushed": 0,
+            "batches": 0,
+            "dropped": 0,
+            "overflow_flushes": 0,
+            "spooled": 0,
+            "conflicts": 0,
+        }
 
     @property
     def dsn(self) -> str:
         return self._dsn
 
-    def save(self, payload: Dict) -> None:
-        self._buffer.append(payload)
+    def save(self, payload: Dict) -> bool:
+        return bool(self.save_many([payload]))
 
+    def save_many(self, payloads: Sequence[Dict]) -> List[Dict]:
+        """
+        Persist payloads with a single multi-row INSERT (one transaction).
+
+        保存したペイロードを返す。`metadata.scan_id` の一意インデックスで捨てられた行
+        （`ON CONFLICT DO NOTHING`）は含めない。`async` はキューへ積んだ時点で全件を返す。
+        直近バッファには書き込み（コミットまたはスプール）後にだけ載せる。
+        """
+        if not payloads:
+            return []
+        if self.durability == "sync" or self._closed:
+            # 失敗は呼び出し元へ送出する（API が重複インデックスを取り消して 503 を返す）
+            stored = self._insert(payloads, raise_errors=True)
+            self._buffer.extend(stored)
+            return stored
+        return self._enqueue(payloads)
+
+    def flush(self) -> int:
+        """
+        Write every queued payload now; returns the number of rows handed to the DB.
+
+        書き込みに失敗した場合は `group` で待っている呼び出し元へ同じ例外を渡し、
+        ここでも送出する。
+        """
+        batch, done = self._take_pending()
+        if not batch:
+            return 0
+        try:
+            stored = self._insert(batch, raise_errors=True)
+        except Exception as exc:
+            done.set_exception(exc)
+            raise
+        self._buffer.extend(stored)
+        self._stats["flushed"] += len(batch)
+        self._stats["batches"] += 1
+        done.set(stored)
+        return len(batch)
+
+    def close(self, timeout: float | None = None) -> None:
+        """
+        Stop the background flusher and write whatever is still queued.
+
+        flusher を kill すると `_take_pending` で取り出し済みのバッチが失われ、その待機者も
+        戻れなくなるため、起こして現在のフラッシュが終わるのを待ってから残りを書き込む。
+        """
+        self._closed = True
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            self._has_pending.set()
+            self._batch_full.set()
+            flusher.join(timeout=self.group_timeout if timeout is None else timeout)
+            if not flusher.dead:
+                logger.warning("Scan write-behind flusher did not stop; flushing the rest here")
+        try:
+            self.flush()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Scan write-behind flush on close failed: %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return write-behind queue counters."""
+        stats: Dict[str, Any] = {
+            "durability": self.durability,
+            "pending": len(self._pending),
+            "queue_size": self.queue_size,
+            "overflow": self.overflow,
+        }
+        stats.update(self._stats)
+        if self.spool is not None:
+            stats["spool_depth"] = self.spool.depth
+        return stats
+
+    def _enqueue(self, payloads: Sequence[Dict]) -> List[Dict]:
+        if len(self._pending) + len(payloads) > self.queue_size:
+            if self.overflow == "drop":
+                self._stats["dropped"] += len(payloads)
+                logger.warning(
+                    "Scan write-behind queue full (size=%s); dropped %s payload(s)",
+                    self.queue_size,
+                    len(payloads),
+                )
+                raise ScanQueueFull(f"scan write-behind queue full (size={self.queue_size})")
+            self._stats["overflow_flushes"] += 1
+            logger.info("Scan write-behind queue full (size=%s); flushing inline", self.queue_size)
+            try:
+                self.flush()
+            except Exception as exc:  # noqa: BLE001
+                # 失敗はキューに積んでいた側（group の待機者）へ渡済み
+                logger.warning("Scan write-behind inline flush failed: %s", exc)
+
+        done = self._pending_done
+        self._pending.extend(payloads)
+        self._ensure_flusher()
+        self._has_pending.set()
+        if len(self._pending) >= self.flush_size:
+            self._batch_full.set()
+
+        if self.durability != "group":
+            return list(payloads)
+        try:
+            # グループコミットが失敗した場合はその例外がここで送出される
+            stored = done.get(timeout=self.group_timeout)
+        except gevent.Timeout as exc:
+            # コミットを確認できないまま受理扱いにしない（API は 503 を返しハンディが再送する）
+            logger.warning("Scan group commit did not finish within %ss", self.group_timeout)
+            raise ScanCommitTimeout(f"scan group commit did not finish within {self.group_timeout}s") from exc
+        # 同じバッチに他の呼び出し元の行も入っているので、自分が渡したペイロードだけを返す
+        stored_ids = {id(payload) for payload in stored}
+        return [payload for payload in payloads if id(payload) in stored_ids]
+
+    def _take_pending(self) -> tuple[List[Dict], AsyncResult]:
+        batch, self._pending = self._pending, []
+        done, self._pending_done = self._pending_done, AsyncResult()
+        self._has_pending.clear()
+        self._batch_full.clear()
+        return batch, done
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or self._flusher.dead:
+            self._flusher = gevent.spawn(self._flush_loop)
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._has_pending.wait()
+            if len(self._pending) < self.flush_size:
+                self._batch_full.wait(timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Scan write-behind flush failed: %s", exc)
+
+    def _insert(self, payloads: Sequence[Dict], raise_errors: bool = False) -> List[Dict]:
+        """
+        INSERT payloads and return the ones stored (spooled payloads count as stored).
+
+        失敗は記録し、`raise_errors` なら送出する（送出しない場合は空リストを返す）。
+        """
         if not self._dsn:
-            logger.warning("SCAN_REPOSITORY_BACKEND='db' だが DSN が空です。payload=%s", payload)
-            return
+            logger.warning("SCAN_REPOSITORY_BACKEND='db' だが DSN が空です。payload=%s", list(payloads))
+            return list(payloads)
+
+        received_at = datetime.now(timezone.utc)
+        if self.spool is not None and self.spool.depth:
+            # 再送待ちより先に新しいスキャンが backlog へ入ると後勝ちの順序が崩れる
+            return self._spool(payloads, received_at, raise_errors)
 
         try:
             with self._connect_factory(self._dsn) as conn, conn.cursor() as cur:
@@ -80,16 +413,163 @@ class DatabaseScanRepository:
                     sql.SQL(
                         """
                         INSERT INTO scan_ingest_backlog (payload, received_at)
-                        VALUES (%s, NOW())
+                        VALUES {rows}
+                        {on_conflict}
+                        RETURNING (payload->'metadata'->>'scan_id')
                         """
+                    ).format(
+                        rows=sql.SQL(", ").join(sql.SQL("(%s, NOW())") for _ in payloads),
+                        on_conflict=_CONFLICT_CLAUSES[self.layout],
                     ),
-                    (Jsonb(payload),),
+                    tuple(Jsonb(payload) for payload in payloads),
                 )
+                inserted = [row[0] for row in cur.fetchall()]
                 conn.commit()
+        except (CircuitOpenError, *OUTAGE_ERRORS) as exc:
+            if self.spool is None:
+                logger.warning("Scan payload persistence failed (rows=%s): %s", len(payloads), exc)
+                if raise_errors:
+                    raise
+                return []
+            logger.warning("Database unavailable; spooling %s scan(s) to disk: %s", len(payloads), exc)
+            return self._spool(payloads, received_at, raise_errors)
         except Exception as exc:  # noqa: BLE001
-            logger.warning("Scan payload persistence failed: %s", exc)
+            logger.warning("Scan payload persistence failed (rows=%s): %s", len(payloads), exc)
+            if raise_errors:
+                raise
+            return []
+        stored = _stored_payloads(payloads, inserted)
+        if len(stored) < len(payloads):
+            self._stats["conflicts"] += len(payloads) - len(stored)
+            logger.info("Scan insert skipped %s duplicate scan_id(s)", len(payloads) - len(stored))
+        return stored
 
-    def recent(self, limit: int = 10) -> Iterable[Dict]:
-        if limit <= 0:
+    def _spool(self, payloads: Sequence[Dict], received_at: datetime, raise_errors: bool = False) -> List[Dict]:
+        try:
+            self.spool.append(payloads, received_at=received_at)
+            self._stats["spooled"] += len(payloads)
+        except ScanSpoolFull as exc:
+            # 古いスプールを消して受け入れることはしない（再送前のスキャンを失うため）
+            logger.error("Scan spool full; rejecting %s scan(s): %s", len(payloads), exc)
+            if raise_errors:
+                raise
+            return []
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Scan spool append failed (rows=%s): %s", len(payloads), exc)
+            if raise_errors:
+                raise
             return []
-        return list(self._buffer)[-limit:]
+        return list(payloads)
+
+    def copy_records(self, records: Sequence[Dict[str, Any]]) -> int:
+        """
+        Bulk-load spooled `{"received_at", "payload"}` records into the backlog with COPY.
+
+        一時テーブルへ COPY してから 1 文で backlog へ移す。重複は挿入しない。
+        - 同じ COPY 内で `metadata.scan_id` が重なる行は最も古い 1 行だけにする
+          （時間パーティション構成は一意インデックスを持たないため）。
+        - 既に backlog にある行（未ドレイン・処理済み印付き）。`metadata.scan_id` か、
+          受注・棚・受信時刻の一致で判定する（スプールは受信時刻を保つので、コミット後
+          セグメント削除前に落ちた再送も同じ行になる）。
+        - 既にドレインされて `history_table` に載っている行（受注・棚・`moved_at` の一致）。
+        挿入した行数を返す。失敗時は例外を送出し、呼び出し元がスプールを残して後で再試行する。
+        """
+        if not records:
+            return 0
+        if self.history_table:
+            drained = sql.SQL(
+                """
+                  AND NOT EXISTS (
+                        SELECT 1 FROM {history} h
+                        WHERE h.order_code = NULLIF(btrim(s.payload->>'order_code'), '')
+                          AND h.location_code = NULLIF(btrim(s.payload->>'location_code'), '')
+                          AND h.moved_at = s.received_at
+                  )
+                """
+            ).format(history=sql.Identifier(self.history_table))
+        else:
+            drained = sql.SQL("")
+        with self._connect_factory(self._dsn) as conn, conn.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE scan_spool_replay "
+                "(seq BIGSERIAL, payload JSONB NOT NULL, received_at TIMESTAMPTZ NOT NULL) ON COMMIT DROP"
+            )
+            with cur.copy("COPY scan_spool_replay (payload, received_at) FROM STDIN") as copy:
+                for record in records:
+                    copy.write_row(
+                        (
+                            json.dumps(record["payload"], ensure_ascii=False, default=str),
+                            record["received_at"],
+                        )
+                    )
+            cur.execute(
+                sql.SQL(
+                    """
+                    INSERT INTO scan_ingest_backlog (payload, received_at)
+                    SELECT s.payload, s.received_at
+                    FROM (
+                        -- scan_id ごとに最古の 1 行（scan_id が無い行は seq で全行残す）
+                        SELECT DISTINCT ON (
+                            payload->'metadata'->>'scan_id',
+                            CASE WHEN payload->'metadata'->>'scan_id' IS NULL THEN seq END
+                        )
+                            seq, payload, received_at
+                        FROM scan_spool_replay
+                        ORDER BY
+                            payload->'metadata'->>'scan_id',
+                            CASE WHEN payload->'metadata'->>'scan_id' IS NULL THEN seq END,
+                            received_at,
+                            seq
+                    ) s
+                    WHERE (
+                        (s.payload->'metadata'->>'scan_id') IS NULL
+                        OR NOT EXISTS (
+                            SELECT 1 FROM scan_ingest_backlog b
+                            WHERE (b.payload->'metadata'->>'scan_id') = (s.payload->'metadata'->>'scan_id')
+                        )
+                    )
+                      AND NOT EXISTS (
+                            SELECT 1 FROM scan_ingest_backlog b
+                            WHERE b.received_at = s.received_at
+                              AND b.order_code = NULLIF(btrim(s.payload->>'order_code'), '')
+                              AND b.location_code = NULLIF(btrim(s.payload->>'location_code'), '')
+                      )
+                    {drained}
+                    ORDER BY s.received_at, s.seq
+                    {on_conflict}
+                    """
+                ).format(drained=drained, on_conflict=_CONFLICT_CLAUSES[self.layout])
+            )
+            inserted = max(0, cur.rowcount)
+            conn.commit()
+        return inserted
+
+    def recent(self, limit: int = 10) -> Iterable[Dict]:
+        return self._buffer.recent(limit)
+
+
+def _stored_payloads(payloads: Sequence[Dict], inserted_scan_ids: Sequence[Any]) -> List[Dict]:
+    """
+    Match `RETURNING` scan_ids back to the payloads that were actually inserted.
+
+    `ON CONFLICT DO NOTHING` で捨てられるのは `metadata.scan_id` を持つ行だけなので、
+    scan_id の無い行は常に保存済みとみなし、scan_id のある行は返ってきた数だけ前から数える。
+    """
+    if len(inserted_scan_ids) == len(payloads):
+        return list(payloads)
+    remaining: Dict[Any, int] = {}
+    for scan_id in inserted_scan_ids:
+        key = scan_id if scan_id is None or isinstance(scan_id, str) else json.dumps(scan_id)
+        remaining[key] = remaining.get(key, 0) + 1
+    stored = []
+    for payload in payloads:
+        metadata = payload.get("metadata")
+        scan_id = metadata.get("scan_id") if isinstance(metadata, dict) else None
+        if scan_id is None:
+            stored.append(payload)
+            continue
+        key = scan_id if isinstance(scan_id, str) else json.dumps(scan_id)
+        if remaining.get(key, 0) > 0:
+            remaining[key] -= 1
+            stored.append(payload)
+    return stored
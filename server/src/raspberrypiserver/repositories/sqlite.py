@@ -0,0 +1,466 @@
+"""
+Embedded SQLite (WAL) backend for scans and part locations.
+
+小規模拠点やローカル計測向けに PostgreSQL の代わりに使う。テーブル・索引は
+`config/schema.sql` と同じ名前・列構成にそろえ、ドレインの意味（後勝ち・隔離・
+履歴・change_seq）も同じにする。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import gevent
+from gevent.lock import RLock
+
+from .scans import ScanRingBuffer, _stored_payloads
+
+logger = logging.getLogger(__name__)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scan_ingest_backlog (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    received_at TEXT NOT NULL,
+    order_code TEXT GENERATED ALWAYS AS (NULLIF(trim(json_extract(payload, '$.order_code')), '')) STORED,
+    location_code TEXT GENERATED ALWAYS AS (NULLIF(trim(json_extract(payload, '$.location_code')), '')) STORED,
+    device_id TEXT GENERATED ALWAYS AS (NULLIF(trim(json_extract(payload, '$.device_id')), '')) STORED
+);
+
+CREATE INDEX IF NOT EXISTS idx_scan_ingest_backlog_received_at
+    ON scan_ingest_backlog (received_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_scan_ingest_backlog_drain_order
+    ON scan_ingest_backlog (received_at, id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_scan_ingest_backlog_scan_id
+    ON scan_ingest_backlog (json_extract(payload, '$.metadata.scan_id'))
+    WHERE json_extract(payload, '$.metadata.scan_id') IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS scan_ingest_dead_letter (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    received_at TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    quarantined_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_scan_ingest_dead_letter_quarantined_at
+    ON scan_ingest_dead_letter (quarantined_at DESC);
+
+CREATE TABLE IF NOT EXISTS part_locations (
+    order_code TEXT PRIMARY KEY,
+    location_code TEXT NOT NULL,
+    device_id TEXT,
+    updated_at TEXT NOT NULL,
+    change_seq INTEGER NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_part_locations_change_seq
+    ON part_locations (change_seq);
+
+CREATE INDEX IF NOT EXISTS idx_part_locations_updated_order
+    ON part_locations (updated_at DESC, order_code DESC);
+
+CREATE INDEX IF NOT EXISTS idx_part_locations_location_updated
+    ON part_locations (location_code, updated_at DESC, order_code DESC);
+
+CREATE TABLE IF NOT EXISTS part_location_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    backlog_id INTEGER,
+    order_code TEXT NOT NULL,
+    location_code TEXT NOT NULL,
+    device_id TEXT,
+    moved_at TEXT NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+
+-- SQLite に BRIN は無いので通常の索引（旧名 brin_* は作り直す）
+DROP INDEX IF EXISTS brin_part_location_history_moved_at;
+CREATE INDEX IF NOT EXISTS idx_part_location_history_moved_at
+    ON part_location_history (moved_at);
+
+CREATE INDEX IF NOT EXISTS idx_part_location_history_order_moved
+    ON part_location_history (order_code, moved_at DESC, id DESC);
+"""
+
+
+def format_time(value: datetime) -> str:
+    """Store timestamps as fixed-width UTC text so string order == time order."""
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f+00:00")
+
+
+def parse_time(value: Any) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def utcnow_text() -> str:
+    return format_time(datetime.now(timezone.utc))
+
+
+def _cursor_time(key: Sequence[Any]) -> Optional[str]:
+    # cursor の時刻（ISO 8601）を保存形式へそろえる。壊れていれば None
+    try:
+        return format_time(parse_time(key[0]))
+    except (TypeError, ValueError) as exc:
+        logger.warning("Invalid keyset cursor: %s", exc)
+        return None
+
+
+class SQLiteDatabase:
+    """
+    Shared SQLite connection in WAL mode.
+
+    接続は 1 本を共有し、`sqlite3` の呼び出し（実行・取得・コミット）は gevent の
+    スレッドプールで行う（busy_timeout の待ちや fsync で hub を止めない）。
+    `connect()` は psycopg と同じ `with conn, conn.cursor() as cur:` の形で使える
+    セッションを返し、セッションの間は接続を 1 greenlet が占有する（正常終了で
+    コミット、例外でロールバック）。SQL 文字列は固定にしてあり、`sqlite3` の文
+    キャッシュでプリペアド文として再利用される。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        busy_timeout: float = 5.0,
+        synchronous: str = "NORMAL",
+        threadpool: bool = True,
+    ) -> None:
+        self.path = str(path)
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.threadpool = threadpool
+        self._lock = RLock()
+        self._closed = False
+        self._conn = sqlite3.connect(
+            self.path,
+            timeout=busy_timeout,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    def connect(self, _dsn: Optional[str] = None) -> "_SQLiteSession":
+        return _SQLiteSession(self)
+
+    def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Call a blocking `sqlite3` function in the gevent threadpool."""
+        if not self.threadpool:
+            return func(*args)
+        return gevent.get_hub().threadpool.apply(func, args)
+
+    def close(self) -> None:
+        """Close the connection once the current session (if any) has finished."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.run(self._conn.close)
+
+
+class _SQLiteSession:
+    def __init__(self, database: SQLiteDatabase) -> None:
+        self._database = database
+        self._conn = database._conn  # noqa: SLF001
+
+    def __enter__(self) -> "_SQLiteSession":
+        self._database._lock.acquire()  # noqa: SLF001
+        return self
+
+    def __exit__(self, exc_type, *_: Any) -> bool:
+        try:
+            # 読み取りだけのセッションはトランザクションが無いのでスレッドプールを往復しない
+            if not self._conn.in_transaction:
+                pass
+            elif exc_type is None:
+                self._database.run(self._conn.commit)
+            else:
+                self._database.run(self._conn.rollback)
+        finally:
+            self._database._lock.release()  # noqa: SLF001
+        return False
+
+    def cursor(self, row_factory: Any = None) -> "_SQLiteCursor":
+        return _SQLiteCursor(self._conn.cursor(), as_dict=row_factory is not None, run=self._database.run)
+
+    def commit(self) -> None:
+        self._database.run(self._conn.commit)
+
+
+class _SQLiteCursor:
+    def __init__(
+        self,
+        cursor: sqlite3.Cursor,
+        as_dict: bool = False,
+        run: Callable[..., Any] = lambda func, *args: func(*args),
+    ) -> None:
+        self._cursor = cursor
+        self._as_dict = as_dict
+        self._run = run
+        self._rows: Optional[List[Tuple[Any, ...]]] = None
+
+    def __enter__(self) -> "_SQLiteCursor":
+        return self
+
+    def __exit__(self, *_: Any) -> bool:
+        self._cursor.close()
+        return False
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def execute(self, query: str, params: Sequence[Any] = ()) -> "_SQLiteCursor":
+        # 結果行も同じスレッドプール呼び出しで読み切り、往復を 1 回にする
+        self._rows = self._run(self._execute, query, tuple(params))
+        return self
+
+    def _execute(self, query: str, params: Tuple[Any, ...]) -> Optional[List[Tuple[Any, ...]]]:
+        self._cursor.execute(query, params)
+        return self._cursor.fetchall() if self._cursor.description else None
+
+    def executemany(self, query: str, rows: Iterable[Sequence[Any]]) -> "_SQLiteCursor":
+        self._run(self._cursor.executemany, query, list(rows))
+        return self
+
+    def fetchone(self) -> Any:
+        if not self._rows:
+            return None
+        return self._convert(self._rows.pop(0))
+
+    def fetchall(self) -> List[Any]:
+        rows, self._rows = self._rows or [], []
+        return [self._convert(row) for row in rows]
+
+    def _convert(self, row: Tuple[Any, ...]) -> Any:
+        if not self._as_dict:
+            return row
+        names = [column[0] for column in self._cursor.description]
+        return dict(zip(names, row))
+
+
+_INSERT_SCAN = """
+INSERT INTO scan_ingest_backlog (payload, received_at)
+VALUES {rows}
+ON CONFLICT DO NOTHING
+RETURNING json_extract(payload, '$.metadata.scan_id')
+"""
+
+# 1 文あたりの行数（SQLite のプレースホルダ上限に余裕を持たせる）
+_INSERT_CHUNK = 200
+
+
+@lru_cache(maxsize=None)
+def _insert_scan_statement(rows: int) -> str:
+    # 行数ごとに同じ文字列を返し、sqlite3 の文キャッシュに載せる
+    return _INSERT_SCAN.format(rows=", ".join(["(?, ?)"] * rows))
+
+
+class SQLiteScanRepository:
+    """SQLite-backed scan repository writing into `scan_ingest_backlog` (batched transactions)."""
+
+    def __init__(self, database: SQLiteDatabase, buffer_size: int = 500) -> None:
+        self.database = database
+        self._buffer = ScanRingBuffer(buffer_size)
+
+    @property
+    def dsn(self) -> str:
+        return self.database.path
+
+    def save(self, payload: Dict) -> bool:
+        return bool(self.save_many([payload]))
+
+    def save_many(self, payloads: Sequence[Dict]) -> List[Dict]:
+        """
+        Persist payloads in one transaction; returns the ones stored.
+
+        `metadata.scan_id` が既にある行（`ON CONFLICT DO NOTHING`）は返さない。失敗は
+        記録して送出する（API は 503 を返す）。直近バッファにはコミット後にだけ載せる。
+        """
+        if not payloads:
+            return []
+        received_at = utcnow_text()
+        stored: List[Dict] = []
+        try:
+            with self.database.connect() as conn, conn.cursor() as cur:
+                for start in range(0, len(payloads), _INSERT_CHUNK):
+                    chunk = payloads[start : start + _INSERT_CHUNK]
+                    params: List[Any] = []
+                    for payload in chunk:
+                        params += [json.dumps(payload, ensure_ascii=False, default=str), received_at]
+                    cur.execute(_insert_scan_statement(len(chunk)), params)
+                    stored += _stored_payloads(chunk, [row[0] for row in cur.fetchall()])
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Scan payload persistence failed (rows=%s): %s", len(payloads), exc)
+            raise
+        self._buffer.extend(stored)
+        return stored
+
+    def recent(self, limit: int = 10) -> Iterable[Dict]:
+        return self._buffer.recent(limit)
+
+
+_LOCATION_COLUMNS = "order_code, location_code, device_id, updated_at"
+
+
+class SQLitePartLocationRepository:
+    """SQLite-backed part location repository (same queries as `DatabasePartLocationRepository`)."""
+
+    def __init__(self, database: SQLiteDatabase) -> None:
+        self.database = database
+
+    def list(self, limit: int = 200, after: Optional[Sequence[Any]] = None) -> Iterable[dict]:
+        if after:
+            cursor_time = _cursor_time(after)
+            if cursor_time is None:
+                return []
+            return self._fetch(
+                f"""
+                SELECT {_LOCATION_COLUMNS}
+                FROM part_locations
+                WHERE (updated_at, order_code) < (?, ?)
+                ORDER BY updated_at DESC, order_code DESC
+                LIMIT ?
+                """,
+                (cursor_time, str(after[1]), limit),
+            )
+        return self._fetch(
+            f"""
+            SELECT {_LOCATION_COLUMNS}
+            FROM part_locations
+            ORDER BY updated_at DESC, order_code DESC
+            LIMIT ?
+            """,
+            (limit,),
+        )
+
+    def snapshot(self) -> Optional[Any]:
+        try:
+            with self.database.connect() as conn, conn.cursor() as cur:
+                cur.execute("SELECT MAX(change_seq) FROM part_locations")
+                return cur.fetchone()[0]
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to read part locations snapshot: %s", exc)
+            return None
+
+    def changes(self, since: int = 0, limit: int = 200) -> List[dict]:
+        return self._fetch(
+            f"""
+            SELECT {_LOCATION_COLUMNS}, change_seq
+            FROM part_locations
+            WHERE change_seq > ?
+            ORDER BY change_seq
+            LIMIT ?
+            """,
+            (since, limit),
+        )
+
+    def get(self, order_code: str) -> Optional[dict]:
+        rows = self._fetch(f"SELECT {_LOCATION_COLUMNS} FROM part_locations WHERE order_code = ?", (order_code,))
+        return rows[0] if rows else None
+
+    def by_location(self, location_code: str, limit: int = 200) -> List[dict]:
+        return self._fetch(
+            f"""
+            SELECT {_LOCATION_COLUMNS}
+            FROM part_locations
+            WHERE location_code = ?
+            ORDER BY updated_at DESC, order_code DESC
+            LIMIT ?
+            """,
+            (location_code, limit),
+        )
+
+    def _fetch(self, query: str, params: Sequence[Any]) -> List[dict]:
+        try:
+            with self.database.connect() as conn, conn.cursor(row_factory=dict) as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to fetch part locations: %s", exc)
+            return []
+        for row in rows:
+            row["updated_at"] = parse_time(row["updated_at"])
+        return rows
+
+
+_HISTORY_COLUMNS = "id, order_code, location_code, device_id, moved_at"
+
+
+class SQLitePartLocationHistoryRepository:
+    """SQLite reader for `part_location_history` (same keyset paging as the PostgreSQL reader)."""
+
+    def __init__(self, database: SQLiteDatabase) -> None:
+        self.database = database
+
+    def trail(self, order_code: str, limit: int = 100, before: Optional[Sequence[Any]] = None) -> List[dict]:
+        if before:
+            cursor_time = _cursor_time(before)
+            if cursor_time is None:
+                return []
+            return self._fetch(
+                f"""
+                SELECT {_HISTORY_COLUMNS}
+                FROM part_location_history
+                WHERE order_code = ? AND (moved_at, id) < (?, ?)
+                ORDER BY moved_at DESC, id DESC
+                LIMIT ?
+                """,
+                (order_code, cursor_time, before[1], limit),
+            )
+        return self._fetch(
+            f"""
+            SELECT {_HISTORY_COLUMNS}
+            FROM part_location_history
+            WHERE order_code = ?
+            ORDER BY moved_at DESC, id DESC
+            LIMIT ?
+            """,
+            (order_code, limit),
+        )
+
+    def window(
+        self,
+        start: datetime,
+        end: datetime,
+        limit: int = 100,
+        after: Optional[Sequence[Any]] = None,
+    ) -> List[dict]:
+        lower, last_id = (format_time(start), None)
+        if after:
+            cursor_time = _cursor_time(after)
+            if cursor_time is None:
+                return []
+            lower, last_id = max(lower, cursor_time), after[1]
+        return self._fetch(
+            f"""
+            SELECT {_HISTORY_COLUMNS}
+            FROM part_location_history
+            WHERE moved_at >= ? AND moved_at < ? AND (? IS NULL OR (moved_at, id) > (?, ?))
+            ORDER BY moved_at, id
+            LIMIT ?
+            """,
+            (lower, format_time(end), last_id, lower, last_id, limit),
+        )
+
+    def _fetch(self, query: str, params: Sequence[Any]) -> List[dict]:
+        try:
+            with self.database.connect() as conn, conn.cursor(row_factory=dict) as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Failed to fetch part location history: %s", exc)
+            return []
+        for row in rows:
+            row["moved_at"] = parse_time(row["moved_at"])
+        return rows
@@ -1,6 +1,25 @@
 """Service layer utilities."""
 
 from .broadcast import BroadcastService, SocketIOBroadcastService
-from .backlog import BacklogDrainService
+from .backlog import BacklogDrainService, DeadLetterStillInvalid
+from .backlog_listener import BacklogNotifyListener
+from .dedup import ScanDeduplicator
+from .partition_maintainer import BacklogPartitionMaintainer
+from .drain_trigger import DrainTrigger
+from .drain_worker import DrainWorker
+from .spool_replay import SpoolReplayer
+from .sqlite_backlog import SQLiteBacklogDrainService
 
-__all__ = ["BroadcastService", "SocketIOBroadcastService", "BacklogDrainService"]
+__all__ = [
+    "BroadcastService",
+    "SocketIOBroadcastService",
+    "BacklogDrainService",
+    "DeadLetterStillInvalid",
+    "BacklogNotifyListener",
+    "BacklogPartitionMaintainer",
+    "ScanDeduplicator",
+    "DrainTrigger",
+    "DrainWorker",
+    "SpoolReplayer",
+    "SQLiteBacklogDrainService",
+]
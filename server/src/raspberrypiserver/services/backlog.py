@@ -2,14 +2,282 @@
 
 from __future__ import annotations
 
+import json
 import logging
-from typing import Iterable, List, Optional, Tuple
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import psycopg
+from gevent.event import Event
 from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from raspberrypiserver.repositories.scans import BACKLOG_LAYOUTS
 
 logger = logging.getLogger(__name__)
 
+COUNT_MODES = ("counter", "estimate", "exact")
+PARTITION_GRANULARITIES = ("day", "hour")
+
+CandidateRow = Tuple[int, str, str, Optional[str]]
+InvalidRow = Tuple[int, str]
+
+
+@lru_cache(maxsize=None)
+def _select_statement(backlog_table: str, partitioned: bool = False, pending_only: bool = False) -> sql.Composed:
+    # order_code / location_code / device_id は backlog の生成列（schema.sql）から読む。
+    # 並列ドレイン時は order_code のハッシュで backlog を分割し、同じ order_code を
+    # 常に同じワーカーが受信順に処理する（order_code 欠落行は '' として 1 つのワーカーへ）
+    conditions = []
+    if pending_only:
+        conditions.append(sql.SQL("processed_at IS NULL"))
+    if partitioned:
+        conditions.append(sql.SQL("(hashtext(COALESCE(order_code, '')) & 2147483647) %% %s = %s"))
+    where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    return sql.SQL(
+        """
+        SELECT id, order_code, location_code, device_id
+        FROM {backlog}
+        {where}
+        ORDER BY received_at, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+        """
+    ).format(backlog=sql.Identifier(backlog_table), where=where)
+
+
+@lru_cache(maxsize=None)
+def _upsert_statement(target_table: str) -> sql.Composed:
+    # 1 バッチを配列で渡して unnest し、1 文で upsert する（drain_scan_backlog() と同じ set-based 処理）。
+    # change_seq は差分同期（/part-locations/changes）のカーソル。採番からコミットまでを
+    # advisory lock で直列化し、番号順とコミット順を一致させる（並列ドレインでも取りこぼさない）。
+    # ロックはコミットまで外れないので、drain_once() はこの文をコミット直前に実行する
+    return sql.SQL(
+        """
+        WITH serialize AS (
+            SELECT pg_advisory_xact_lock(hashtext({lock_key}))
+        )
+        INSERT INTO {target} (order_code, location_code, device_id, updated_at)
+        SELECT batch.order_code, batch.location_code, batch.device_id, NOW()
+        FROM serialize,
+             unnest(%s::text[], %s::text[], %s::text[]) AS batch(order_code, location_code, device_id)
+        ON CONFLICT (order_code)
+        DO UPDATE SET
+            location_code = EXCLUDED.location_code,
+            device_id = EXCLUDED.device_id,
+            updated_at = NOW(),
+            change_seq = DEFAULT
+        """
+    ).format(target=sql.Identifier(target_table), lock_key=sql.Literal(f"{target_table}.change_seq"))
+
+
+def collapse_latest(candidates: Iterable[CandidateRow]) -> Tuple[List[CandidateRow], int]:
+    """
+    Reduce a drain batch to the newest row per order_code (last write wins).
+
+    `candidates` は `received_at, id` 昇順で渡される前提で、後ろの行ほど新しい。
+    戻り値は (order_code ごとの最新行を元の順序で並べたリスト, 上書きされて捨てた行数)。
+    """
+    latest: Dict[str, CandidateRow] = {}
+    total = 0
+    for row in candidates:
+        total += 1
+        latest.pop(row[1], None)
+        latest[row[1]] = row
+    rows = list(latest.values())
+    return rows, total - len(rows)
+
+
+@lru_cache(maxsize=None)
+def _consume_statement(backlog_table: str, layout: str = "plain", history_table: str = "") -> sql.Composed:
+    # 処理済みの行を backlog から外す。時間パーティション構成では行を消さずに印を付け、
+    # 空になったパーティションごと DROP する。履歴テーブルがあれば同じ文で追記する
+    if layout == "partitioned":
+        consume = sql.SQL("UPDATE {backlog} SET processed_at = NOW() WHERE id = ANY(%s)")
+    else:
+        consume = sql.SQL("DELETE FROM {backlog} WHERE id = ANY(%s)")
+    if not history_table:
+        return consume.format(backlog=sql.Identifier(backlog_table))
+    return sql.SQL(
+        """
+        WITH consumed AS (
+            {consume}
+            RETURNING id, order_code, location_code, device_id, received_at
+        )
+        INSERT INTO {history} (backlog_id, order_code, location_code, device_id, moved_at)
+        SELECT id, order_code, location_code, device_id, received_at
+        FROM consumed
+        """
+    ).format(
+        consume=consume.format(backlog=sql.Identifier(backlog_table)),
+        history=sql.Identifier(history_table),
+    )
+
+
+@lru_cache(maxsize=None)
+def _compact_statement(stats_table: str) -> sql.Composed:
+    # コミット済みの差分行だけを基準行へ畳み込む（schema.sql の compact_scan_backlog_stats() と同じ）
+    return sql.SQL(
+        """
+        WITH gone AS (
+            DELETE FROM {delta}
+            RETURNING table_name, delta
+        ),
+        sums AS (
+            SELECT table_name, SUM(delta) AS delta, COUNT(*) AS rows_folded
+            FROM gone
+            GROUP BY table_name
+        ),
+        base AS (
+            INSERT INTO {stats} (table_name, pending)
+            SELECT table_name, delta FROM sums
+            ON CONFLICT (table_name) DO UPDATE
+            SET pending = {stats}.pending + EXCLUDED.pending,
+                updated_at = NOW()
+            RETURNING 1
+        )
+        SELECT COALESCE(SUM(rows_folded), 0) FROM sums
+        """
+    ).format(stats=sql.Identifier(stats_table), delta=sql.Identifier(f"{stats_table}_delta"))
+
+
+@lru_cache(maxsize=None)
+def _counter_statement(stats_table: str) -> sql.Composed:
+    # 件数 = 基準行 + まだ畳み込んでいない差分行の合計
+    return sql.SQL(
+        """
+        SELECT s.pending + COALESCE(
+            (SELECT SUM(d.delta) FROM {delta} d WHERE d.table_name = s.table_name), 0
+        )
+        FROM {stats} s
+        WHERE s.table_name = %s
+        """
+    ).format(stats=sql.Identifier(stats_table), delta=sql.Identifier(f"{stats_table}_delta"))
+
+
+@lru_cache(maxsize=None)
+def _pending_filter(layout: str) -> sql.SQL:
+    return sql.SQL(" WHERE processed_at IS NULL") if layout == "partitioned" else sql.SQL("")
+
+
+@lru_cache(maxsize=None)
+def _quarantine_statement(backlog_table: str, dead_letter_table: str) -> sql.Composed:
+    # 不正行を backlog から削除し、同じトランザクションで理由付きで dead-letter へ移す
+    return sql.SQL(
+        """
+        WITH moved AS (
+            DELETE FROM {backlog}
+            WHERE id = ANY(%s)
+            RETURNING id, payload, received_at
+        )
+        INSERT INTO {dead_letter} (id, payload, received_at, reason)
+        SELECT moved.id, moved.payload, moved.received_at, reasons.reason
+        FROM moved
+        JOIN unnest(%s::bigint[], %s::text[]) AS reasons(id, reason) ON reasons.id = moved.id
+        ON CONFLICT (id) DO NOTHING
+        """
+    ).format(backlog=sql.Identifier(backlog_table), dead_letter=sql.Identifier(dead_letter_table))
+
+
+@lru_cache(maxsize=None)
+def _requeue_candidates_statement(dead_letter_table: str) -> sql.Composed:
+    # 戻す前に patch 適用後の payload を検証する（行は requeue 文まで FOR UPDATE で押さえる）
+    return sql.SQL(
+        """
+        SELECT id, payload || %s::jsonb
+        FROM {dead_letter}
+        WHERE id = ANY(%s)
+        ORDER BY id
+        FOR UPDATE
+        """
+    ).format(dead_letter=sql.Identifier(dead_letter_table))
+
+
+@lru_cache(maxsize=None)
+def _requeue_statement(backlog_table: str, dead_letter_table: str) -> sql.Composed:
+    # backlog へ入った行（ON CONFLICT で捨てられなかった行）だけを dead-letter から消す
+    return sql.SQL(
+        """
+        WITH src AS (
+            SELECT id, payload || %s::jsonb AS payload, received_at
+            FROM {dead_letter}
+            WHERE id = ANY(%s)
+        ),
+        inserted AS (
+            INSERT INTO {backlog} (payload, received_at)
+            SELECT payload, received_at FROM src ORDER BY received_at, id
+            ON CONFLICT DO NOTHING
+            RETURNING payload, received_at
+        )
+        DELETE FROM {dead_letter} d
+        USING src
+        WHERE d.id = src.id
+          AND EXISTS (
+              SELECT 1 FROM inserted i
+              WHERE i.payload = src.payload AND i.received_at = src.received_at
+          )
+        RETURNING d.id
+        """
+    ).format(backlog=sql.Identifier(backlog_table), dead_letter=sql.Identifier(dead_letter_table))
+
+
+class DeadLetterStillInvalid(ValueError):
+    """Raised when requeued dead-letter rows would still fail validation after `patch`."""
+
+    def __init__(self, reasons: Dict[int, str]) -> None:
+        super().__init__(f"dead-letter rows still invalid: {reasons}")
+        self.reasons = reasons
+
+
+def _payload_code(payload: Dict[str, Any], key: str) -> Optional[str]:
+    # backlog の生成列（NULLIF(btrim(payload->>key), '')）と同じ判定
+    value = payload.get(key)
+    if value is None or isinstance(value, (dict, list)):
+        return None if value is None else json.dumps(value)
+    return str(value).strip() or None
+
+
+def requeue_invalid_reasons(rows: Iterable[Tuple[int, Dict[str, Any]]]) -> Dict[int, str]:
+    """Return `{id: reason}` for patched dead-letter payloads that would be quarantined again."""
+    reasons: Dict[int, str] = {}
+    for row_id, payload in rows:
+        reason = invalid_reason(_payload_code(payload, "order_code"), _payload_code(payload, "location_code"))
+        if reason:
+            reasons[row_id] = reason
+    return reasons
+
+
+def invalid_reason(order_code: Optional[str], location_code: Optional[str]) -> Optional[str]:
+    """Return the quarantine reason for a backlog row, or None when it can be drained."""
+    if not order_code:
+        return "missing-order_code"
+    if not location_code:
+        return "missing-location_code"
+    return None
+
+
+def split_candidates(rows: Iterable[Tuple[Any, ...]]) -> Tuple[List[CandidateRow], List[InvalidRow]]:
+    """Split `(id, order_code, location_code, device_id)` rows into drainable rows and quarantine targets."""
+    candidates: List[CandidateRow] = []
+    invalid: List[InvalidRow] = []
+    for row in rows:
+        row_id, order_code, location_code, device_id = row
+        reason = invalid_reason(order_code, location_code)
+        if reason:
+            logger.warning(
+                "Quarantining backlog row id=%s (%s): order=%s location=%s",
+                row_id,
+                reason,
+                order_code,
+                location_code,
+            )
+            invalid.append((row_id, reason))
+            continue
+        candidates.append((row_id, order_code, location_code, device_id))
+    return candidates, invalid
+
 
 class BacklogDrainService:
     """Service to drain scan backlog into canonical tables."""
@@ -21,12 +289,66 @@ class BacklogDrainService:
         backlog_table: str = "scan_ingest_backlog",
         target_table: str = "part_locations",
         connect=psycopg.connect,
+        dead_letter_table: str = "scan_ingest_dead_letter",
+        partitions: int = 1,
+        partition: int = 0,
+        count_mode: str = "counter",
+        stats_ttl: float = 2.0,
+        layout: str = "plain",
+        partition_granularity: str = "day",
+        partition_premake: int = 2,
+        partition_maintenance_interval: float = 300.0,
+        history_table: Optional[str] = "part_location_history",
+        on_upsert: Optional[Callable[[int], Any]] = None,
+        stats_table: Optional[str] = None,
+        stats_compact_interval: float = 30.0,
     ) -> None:
+        if count_mode not in COUNT_MODES:
+            raise ValueError(f"unsupported backlog count mode: {count_mode}")
+        if layout not in BACKLOG_LAYOUTS:
+            raise ValueError(f"unsupported backlog layout: {layout}")
+        if partition_granularity not in PARTITION_GRANULARITIES:
+            raise ValueError(f"unsupported partition granularity: {partition_granularity}")
+        if partitions < 1 or not 0 <= partition < partitions:
+            raise ValueError(f"invalid drain partition {partition}/{partitions}")
         self.dsn = dsn
         self.limit = limit
         self.backlog_table = backlog_table
         self.target_table = target_table
+        self.dead_letter_table = dead_letter_table
+        self.history_table = history_table or ""
+        # part_locations を更新したら呼ぶ（読み取りキャッシュのバージョンを上げる）
+        self.on_upsert = on_upsert
+        self.partitions = partitions
+        self.partition = partition
+        self.count_mode = count_mode
+        # トリガーが維持する件数テーブル（既定は `<backlog_table>_stats`）
+        self.stats_table = stats_table or f"{backlog_table}_stats"
+        self.stats_ttl = stats_ttl
+        # トリガーは文ごとに差分行を追記するだけなので、ドレインが定期的に基準行へ畳み込む
+        self.stats_compact_interval = stats_compact_interval
+        self._next_compaction = time.monotonic() + stats_compact_interval
+        # key -> (期限, 取得時刻, 値)。backlog 件数と dead-letter 件数で共有する
+        self._cache: Dict[str, Tuple[float, float, Any]] = {}
+        self._inflight: Dict[str, Event] = {}
+        self.layout = layout
+        self.partition_granularity = partition_granularity
+        self.partition_premake = max(0, partition_premake)
+        self.partition_maintenance_interval = partition_maintenance_interval
+        self._next_maintenance = 0.0
         self._connect = connect
+        self._metrics: Dict[str, int] = {
+            "runs": 0,
+            "drained": 0,
+            "upserted": 0,
+            "superseded": 0,
+            "quarantined": 0,
+            "failures": 0,
+        }
+        if layout == "partitioned":
+            self._metrics.update({"partitions_created": 0, "partitions_dropped": 0})
+        # 直近 1 回の結果（DrainWorker がバッチサイズ調整に使う）
+        self.last_run: Dict[str, float] = {"drained": 0, "quarantined": 0, "superseded": 0, "duration": 0.0}
 
     def is_configured(self) -> bool:
         return bool(self.dsn)
@@ -39,116 +361,425 @@ class BacklogDrainService:
         requested_limit = limit or self.limit
         if requested_limit <= 0:
             return 0
+        if self.layout == "partitioned" and time.monotonic() >= self._next_maintenance:
+            self.maintain_partitions()
+        if self.count_mode == "counter" and time.monotonic() >= self._next_compaction:
+            self.compact_stats()
 
         drained = 0
+        started = time.monotonic()
+        self.last_run = {"drained": 0, "quarantined": 0, "superseded": 0, "duration": 0.0}
         try:
             with self._connect(self.dsn) as conn, conn.cursor() as cur:
-                candidates = self._select_candidates(cur, requested_limit)
-                if not candidates:
+                candidates, invalid = self._select_candidates(cur, requested_limit)
+                if not candidates and not invalid:
                     logger.debug(
                         "Backlog drain skipped: no rows available (limit=%s)", requested_limit
                     )
                     conn.commit()
                     return 0
 
-                valid_rows = self._upsert_locations(cur, candidates)
-                if valid_rows:
-                    self._delete_backlog_rows(cur, [row[0] for row in valid_rows])
-                    drained = len(valid_rows)
-                    logger.info(
-                        "Backlog drain succeeded: processed=%s limit=%s table=%s",
-                        drained,
-                        requested_limit,
-                        self.backlog_table,
-                    )
-                else:
-                    logger.warning("No valid backlog rows processed (missing order/location codes)")
-
+                self._quarantine_rows(cur, invalid)
+                latest, superseded = collapse_latest(candidates)
+                # 上書きされた古い行も消費済みとして削除（パーティション構成では処理済みに）し、
+                # 移動履歴には全行を残す
+                self._consume_backlog_rows(cur, [row[0] for row in candidates])
+                # change_seq のロックを取る upsert は最後に回し、ワーカー同士が直列になる区間を
+                # upsert〜コミットだけにする。件数カウンタは差分行の追記なので消費の DELETE も
+                # 共有行ロックを取らない（bench_parallel_drain.py の row-wait が 0% になることで確認）
+                upserted = self._upsert_locations(cur, latest)
                 conn.commit()
+
+                drained = len(candidates)
+                if invalid:
+                    self._cache.pop("dead_letter", None)
+                if upserted and self.on_upsert is not None:
+                    self.on_upsert(len(upserted))
+                self._metrics["runs"] += 1
+                self._metrics["drained"] += drained
+                self._metrics["upserted"] += len(upserted)
+                self._metrics["superseded"] += superseded
+                self._metrics["quarantined"] += len(invalid)
+                self.last_run = {
+                    "drained": drained,
+                    "quarantined": len(invalid),
+                    "superseded": superseded,
+                    "duration": time.monotonic() - started,
+                }
+                logger.info(
+                    "Backlog drain succeeded: processed=%s upserted=%s superseded=%s quarantined=%s limit=%s table=%s",
+                    drained,
+                    len(upserted),
+                    superseded,
+                    len(invalid),
+                    requested_limit,
+                    self.backlog_table,
+                )
         except Exception as exc:  # noqa: BLE001
+            self._metrics["failures"] += 1
             logger.warning("Backlog drain failed: %s", exc)
         return drained
 
-    def count_backlog(self) -> int:
-        """Return number of pending backlog records."""
+    def metrics(self) -> Dict[str, int]:
+        """Return cumulative drain counters (runs, drained, upserted, superseded, quarantined, failures)."""
+        return dict(self._metrics)
+
+    def compact_stats(self) -> int:
+        """
+        Fold committed counter delta rows into the base row; returns the rows folded.
+
+        件数トリガーは共有行を更新せず差分行を追記する（ingest と並列ドレインが同じ行ロックで
+        待たないようにするため）。`drain_once` から `stats_compact_interval` 秒ごとに呼ばれ、
+        差分行が増え続けて読み取りの `SUM` が重くならないようにする。
+        """
+        if not self.dsn:
+            return 0
+        self._next_compaction = time.monotonic() + self.stats_compact_interval
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor() as cur:
+                cur.execute(_compact_statement(self.stats_table))
+                row = cur.fetchone()
+                conn.commit()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Backlog counter compaction failed: %s", exc)
+            return 0
+        return int(row[0] or 0) if row else 0
+
+    def maintain_partitions(self) -> Dict[str, int]:
+        """
+        Create upcoming backlog partitions and drop fully processed ones.
+
+        `schema_partitioned.sql` の関数を使う。`ensure_scan_backlog_partitions()` で先の区間を作り、
+        `drained_scan_backlog_partitions()` でロックを取らずに未処理行の無い過去パーティションを
+        選んでから 1 つずつ別トランザクションで外す。default パーティションが無い構成では
+        `DETACH PARTITION ... CONCURRENTLY`（親を ACCESS EXCLUSIVE でロックしない）、ある構成では
+        PostgreSQL が CONCURRENTLY を許さないため `drop_scan_backlog_partition()`（待ちは 200ms まで）。
+        1 つのパーティションの失敗は警告だけ出して次へ進む。`BacklogPartitionMaintainer` と
+        `drain_once` から `partition_maintenance_interval` 秒ごとに実行される。
+        """
+        result = {"created": 0, "dropped": 0}
+        if not self.dsn or self.layout != "partitioned":
+            return result
+
+        self._next_maintenance = time.monotonic() + self.partition_maintenance_interval
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor() as cur:
+                cur.execute(
+                    "SELECT ensure_scan_backlog_partitions(%s, %s, parent => %s)",
+                    (self.partition_granularity, self.partition_premake, self.backlog_table),
+                )
+                result["created"] = int(cur.fetchone()[0] or 0)
+                cur.execute(
+                    "SELECT NULLIF(partdefid, 0)::regclass::text FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+                    (self.backlog_table,),
+                )
+                row = cur.fetchone()
+                default_partition = row[0] if row else None
+                if default_partition:
+                    # 範囲外で default に入った行は処理済みになった分だけ消す（名前は regclass の出力で引用済み）
+                    cur.execute(
+                        sql.SQL("DELETE FROM {default} WHERE processed_at IS NOT NULL").format(
+                            default=sql.SQL(default_partition)
+                        )
+                    )
+                cur.execute(
+                    "SELECT partition_name, bound, detach_pending FROM drained_scan_backlog_partitions(%s)",
+                    (self.backlog_table,),
+                )
+                drained = cur.fetchall()
+                conn.commit()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Backlog partition maintenance failed: %s", exc)
+            return result
+
+        for partition_name, bound, detach_pending in drained:
+            try:
+                if default_partition:
+                    dropped = self._drop_partition(partition_name)
+                else:
+                    dropped = self._detach_partition_concurrently(partition_name, bound, detach_pending)
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Backlog partition %s was not dropped: %s", partition_name, exc)
+                continue
+            result["dropped"] += int(dropped)
+
+        self._metrics["partitions_created"] += result["created"]
+        self._metrics["partitions_dropped"] += result["dropped"]
+        if result["created"] or result["dropped"]:
+            logger.info(
+                "Backlog partitions maintained: created=%s dropped=%s table=%s",
+                result["created"],
+                result["dropped"],
+                self.backlog_table,
+            )
+        return result
+
+    def _drop_partition(self, partition_name: str) -> bool:
+        with self._connect(self.dsn) as conn, conn.cursor() as cur:
+            cur.execute("SELECT drop_scan_backlog_partition(%s, %s)", (partition_name, self.backlog_table))
+            dropped = bool(cur.fetchone()[0])
+            conn.commit()
+        return dropped
+
+    def _detach_partition_concurrently(self, partition_name: str, bound: str, detach_pending: bool) -> bool:
+        # CONCURRENTLY / FINALIZE はトランザクションブロックの外でしか実行できない。
+        # partition_name は drained_scan_backlog_partitions() が返す regclass の出力（引用済み）
+        mode = sql.SQL("FINALIZE" if detach_pending else "CONCURRENTLY")
+        with self._connect(self.dsn) as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        sql.SQL("ALTER TABLE {parent} DETACH PARTITION {partition} {mode}").format(
+                            parent=sql.Identifier(self.backlog_table),
+                            partition=sql.SQL(partition_name),
+                            mode=mode,
+                        )
+                    )
+                    # 一覧の後に未処理行が入っていたら付け直す
+                    cur.execute(
+                        "SELECT finish_scan_backlog_partition_detach(%s, %s, %s)",
+                        (partition_name, bound, self.backlog_table),
+                    )
+                    return bool(cur.fetchone()[0])
+            finally:
+                conn.autocommit = False
+
+    def oldest_pending_age(self) -> Optional[float]:
+        """Return seconds since the oldest pending backlog row was received (None when empty)."""
+        if not self.dsn:
+            return None
+
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor() as cur:
+                return self._oldest_age(cur)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Backlog lag query failed: %s", exc)
+            return None
+
+    def count_dead_letters(self) -> int:
+        """Return number of quarantined backlog rows (cached for `stats_ttl` seconds like the backlog stats)."""
         if not self.dsn:
-            logger.debug("Backlog count skipped: DSN not configured")
             return 0
+        count, _fresh = self._single_flight("dead_letter", self._load_dead_letter_count)
+        return int(count or 0)
 
+    def _load_dead_letter_count(self) -> Optional[int]:
         try:
             with self._connect(self.dsn) as conn, conn.cursor() as cur:
                 cur.execute(
-                    """
-                    SELECT COUNT(*) FROM scan_ingest_backlog
-                    """
+                    sql.SQL("SELECT COUNT(*) FROM {dead_letter}").format(
+                        dead_letter=sql.Identifier(self.dead_letter_table)
+                    )
                 )
                 (count,) = cur.fetchone()
                 return int(count)
         except Exception as exc:  # noqa: BLE001
-            logger.warning("Backlog count failed: %s", exc)
+            logger.warning("Dead-letter count failed: %s", exc)
+            return None
+
+    def list_dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Return the most recently quarantined rows."""
+        if not self.dsn:
+            return []
+
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(
+                    sql.SQL(
+                        """
+                        SELECT id, payload, received_at, reason, quarantined_at
+                        FROM {dead_letter}
+                        ORDER BY quarantined_at DESC, id DESC
+                        LIMIT %s
+                        """
+                    ).format(dead_letter=sql.Identifier(self.dead_letter_table)),
+                    (limit,),
+                )
+                return list(cur.fetchall())
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Dead-letter listing failed: %s", exc)
+            return []
+
+    def requeue_dead_letters(self, ids: List[int], patch: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Move quarantined rows back into the backlog.
+
+        `patch` を指定すると payload にマージしてから戻す（例: 欠けていた location_code を補う）。
+        patch 後も order_code / location_code が欠けている行があれば何も戻さず
+        `DeadLetterStillInvalid` を送出する。`metadata.scan_id` が既に backlog にあって
+        挿入されなかった行は dead-letter に残す。戻り値は backlog へ戻した件数。
+        """
+        if not self.dsn or not ids:
             return 0
 
-    def _select_candidates(self, cur, limit: int) -> List[Tuple[int, str, str, Optional[str]]]:
+        with self._connect(self.dsn) as conn, conn.cursor() as cur:
+            cur.execute(_requeue_candidates_statement(self.dead_letter_table), (Jsonb(patch or {}), list(ids)))
+            reasons = requeue_invalid_reasons(cur.fetchall())
+            if reasons:
+                raise DeadLetterStillInvalid(reasons)
+            cur.execute(
+                _requeue_statement(self.backlog_table, self.dead_letter_table),
+                (Jsonb(patch or {}), list(ids)),
+            )
+            requeued = len(cur.fetchall())
+            conn.commit()
+        self._cache.pop("dead_letter", None)
+        logger.info("Requeued %s dead-letter row(s) into %s", requeued, self.backlog_table)
+        return requeued
+
+    def count_backlog(self, exact: bool = False) -> int:
+        """Return number of pending backlog records (see `backlog_stats`)."""
+        return int(self.backlog_stats(exact=exact)["pending"])
+
+    def backlog_stats(self, exact: bool = False) -> Dict[str, Any]:
+        """
+        Return pending count and drain lag without scanning the backlog.
+
+        件数は `count_mode` に従って取得する。
+        - `counter`: トリガーで維持している `scan_ingest_backlog_stats`（基準行 + 差分行）の値
+        - `estimate`: プランナー統計（`pg_class.reltuples`）の概算
+        - `exact`: `COUNT(*)`
+        結果は `stats_ttl` 秒キャッシュし、期限切れ時に同時に来た呼び出しは
+        1 回の問い合わせ結果を共有する（single-flight）。`exact=True` はキャッシュを使わない。
+        問い合わせに失敗した場合は最後に取得できた値を `stale: True` 付きで返し、
+        一度も取得できていなければ `pending_mode: "unavailable"` を返す。
+        """
+        empty: Dict[str, Any] = {"pending": 0, "pending_mode": self.count_mode, "oldest_pending_age_seconds": None}
+        if not self.dsn:
+            logger.debug("Backlog count skipped: DSN not configured")
+            return empty
+        if exact:
+            return self._load_backlog_stats("exact") or dict(empty, pending_mode="unavailable")
+
+        stats, fresh = self._single_flight("backlog", lambda: self._load_backlog_stats(self.count_mode))
+        if stats is None:
+            return dict(empty, pending_mode="unavailable")
+        result = dict(stats)
+        if not fresh:
+            result["stale"] = True
+        return result
+
+    def _single_flight(self, key: str, load: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Return `(value, fresh)` from the `stats_ttl` cache, loading it once for concurrent callers.
+
+        `load()` が None を返した（失敗した）場合は、最後に取得できた値を `fresh=False` で返す
+        （一度も取得できていなければ None）。待っていた呼び出しも同じ結果を受け取る。
+        """
+        started = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > started:
+            return cached[2], True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            inflight.wait(timeout=5.0)
+        else:
+            event = self._inflight[key] = Event()
+            try:
+                value = load()
+                if value is not None:
+                    now = time.monotonic()
+                    self._cache[key] = (now + self.stats_ttl, now, value)
+            finally:
+                self._inflight.pop(key, None)
+                event.set()
+
+        cached = self._cache.get(key)
+        if cached is None:
+            return None, False
+        return cached[2], cached[1] >= started
+
+    def _load_backlog_stats(self, mode: str) -> Optional[Dict[str, Any]]:
+        try:
+            with self._connect(self.dsn) as conn, conn.cursor() as cur:
+                pending, used_mode = self._pending_count(cur, mode)
+                return {
+                    "pending": pending,
+                    "pending_mode": used_mode,
+                    "oldest_pending_age_seconds": self._oldest_age(cur),
+                }
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Backlog count failed: %s", exc)
+            return None
+
+    def _pending_count(self, cur, mode: str) -> Tuple[int, str]:
+        if mode == "counter":
+            cur.execute(_counter_statement(self.stats_table), (self.backlog_table,))
+            row = cur.fetchone()
+            if row is not None and row[0] is not None:
+                return max(0, int(row[0])), "counter"
+            logger.info("Backlog counter row missing for %s; falling back to COUNT(*)", self.backlog_table)
+        elif mode == "estimate" and self.layout == "plain":
+            # パーティション構成では処理済み行も reltuples に含まれるため使わない
+            cur.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                (self.backlog_table,),
+            )
+            row = cur.fetchone()
+            # 一度も ANALYZE されていないテーブルは -1 になる
+            if row is not None and row[0] is not None and int(row[0]) >= 0:
+                return int(row[0]), "estimate"
+
         cur.execute(
-            sql.SQL(
-                """
-                SELECT id,
-                       payload->>'order_code' AS order_code,
-                       payload->>'location_code' AS location_code,
-                       payload->>'device_id' AS device_id
-                FROM {backlog}
-                ORDER BY received_at
-                LIMIT %s
-                FOR UPDATE SKIP LOCKED
-                """
-            ).format(backlog=sql.Identifier(self.backlog_table)),
-            (limit,),
+            sql.SQL("SELECT COUNT(*) FROM {backlog}{pending}").format(
+                backlog=sql.Identifier(self.backlog_table), pending=_pending_filter(self.layout)
+            )
         )
-        rows = cur.fetchall()
-        candidates: List[Tuple[int, str, str, Optional[str]]] = []
-        for row in rows:
-            row_id, order_code, location_code, device_id = row
-            if not order_code or not location_code:
-                logger.warning(
-                    "Skipping backlog row id=%s due to missing order/location (order=%s, location=%s)",
-                    row_id,
-                    order_code,
-                    location_code,
-                )
-                continue
-            candidates.append((row_id, order_code, location_code, device_id))
-        return candidates
+        (count,) = cur.fetchone()
+        return int(count), "exact"
 
-    def _upsert_locations(
-        self,
-        cur,
-        candidates: Iterable[Tuple[int, str, str, Optional[str]]],
-    ) -> List[Tuple[int, str, str, Optional[str]]]:
-        processed: List[Tuple[int, str, str, Optional[str]]] = []
-        for row_id, order_code, location_code, device_id in candidates:
+    def _oldest_age(self, cur) -> Optional[float]:
+        cur.execute(
+            sql.SQL("SELECT EXTRACT(EPOCH FROM NOW() - MIN(received_at)) FROM {backlog}{pending}").format(
+                backlog=sql.Identifier(self.backlog_table), pending=_pending_filter(self.layout)
+            )
+        )
+        row = cur.fetchone()
+        return float(row[0]) if row and row[0] is not None else None
+
+    def _select_candidates(self, cur, limit: int) -> Tuple[List[CandidateRow], List[InvalidRow]]:
+        pending_only = self.layout == "partitioned"
+        if self.partitions > 1:
             cur.execute(
-                sql.SQL(
-                    """
-                    INSERT INTO {target} (order_code, location_code, device_id, updated_at)
-                    VALUES (%s, %s, %s, NOW())
-                    ON CONFLICT (order_code)
-                    DO UPDATE SET
-                        location_code = EXCLUDED.location_code,
-                        device_id = EXCLUDED.device_id,
-                        updated_at = NOW()
-                    """
-                ).format(target=sql.Identifier(self.target_table)),
-                (order_code, location_code, device_id),
+                _select_statement(self.backlog_table, partitioned=True, pending_only=pending_only),
+                (self.partitions, self.partition, limit),
             )
-            processed.append((row_id, order_code, location_code, device_id))
-        return processed
+        else:
+            cur.execute(_select_statement(self.backlog_table, pending_only=pending_only), (limit,))
+        return split_candidates(cur.fetchall())
 
-    def _delete_backlog_rows(self, cur, ids: List[int]) -> None:
-        if not ids:
+    def _quarantine_rows(self, cur, invalid: List[InvalidRow]) -> None:
+        if not invalid:
             return
+        ids = [row_id for row_id, _ in invalid]
         cur.execute(
-            sql.SQL("DELETE FROM {backlog} WHERE id = ANY(%s)").format(
-                backlog=sql.Identifier(self.backlog_table)
+            _quarantine_statement(self.backlog_table, self.dead_letter_table),
+            (ids, ids, [reason for _, reason in invalid]),
+        )
+
+    def _upsert_locations(
+        self,
+        cur,
+        candidates: Iterable[CandidateRow],
+    ) -> List[CandidateRow]:
+        """Upsert rows that already have unique order_codes (see `collapse_latest`)."""
+        processed = list(candidates)
+        if not processed:
+            return processed
+
+        cur.execute(
+            _upsert_statement(self.target_table),
+            (
+                [row[1] for row in processed],
+                [row[2] for row in processed],
+                [row[3] for row in processed],
             ),
-            (ids,),
         )
+        return processed
+
+    def _consume_backlog_rows(self, cur, ids: List[int]) -> None:
+        if not ids:
+            return
+        cur.execute(_consume_statement(self.backlog_table, self.layout, self.history_table), (ids,))
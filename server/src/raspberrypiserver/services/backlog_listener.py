@@ -0,0 +1,110 @@
+"""LISTEN/NOTIFY wake-ups for the backlog drain."""
+
+from __future__ import annotations
+
+import logging
+import socket
+from typing import Any, Callable, Dict
+
+import gevent
+import psycopg
+from gevent.socket import wait_read
+from psycopg import sql
+
+logger = logging.getLogger(__name__)
+
+
+class BacklogNotifyListener:
+    """
+    Hold a LISTEN connection and call `on_notify` when backlog rows are inserted.
+
+    `scan_ingest_backlog` の INSERT トリガーが `NOTIFY scan_backlog` を発行する。
+    ソケットが読めるようになるまで gevent で待ち、届いている通知をまとめて
+    読み切ってから `on_notify` を 1 回だけ呼ぶ（バースト時も 1 回のドレインに集約）。
+    取りこぼしは DrainWorker の遅いフォールバックポーリングで補う。
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        on_notify: Callable[[], None],
+        channel: str = "scan_backlog",
+        connect: Callable[..., Any] = psycopg.connect,
+        reconnect_interval: float = 5.0,
+        heartbeat_interval: float = 60.0,
+    ) -> None:
+        self.dsn = dsn
+        self.on_notify = on_notify
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._connect = connect
+        self._greenlet: gevent.Greenlet | None = None
+        self._stopped = False
+        self._conn: Any = None
+        self._stats: Dict[str, Any] = {"notifications": 0, "wakeups": 0, "reconnects": 0, "connected": False}
+
+    def start(self) -> "BacklogNotifyListener":
+        self._stopped = False
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self.run)
+        return self
+
+    def stop(self) -> None:
+        self._stopped = True
+        greenlet, self._greenlet = self._greenlet, None
+        if greenlet is not None:
+            greenlet.kill(block=False)
+        self._close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["channel"] = self.channel
+        return stats
+
+    def run(self) -> None:
+        """LISTEN until stopped, reconnecting after failures."""
+        while not self._stopped:
+            try:
+                self._listen()
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Backlog LISTEN connection lost: %s", exc)
+            self._close()
+            if self._stopped:
+                break
+            self._stats["reconnects"] += 1
+            gevent.sleep(self.reconnect_interval)
+
+    def _listen(self) -> None:
+        self._conn = self._connect(self.dsn, autocommit=True)
+        self._conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+        self._stats["connected"] = True
+        logger.info("Listening for backlog notifications on %s", self.channel)
+        # 接続前に入った行を取りこぼさないよう、開始時に 1 度起こす
+        self._wake(0)
+
+        while not self._stopped:
+            try:
+                wait_read(self._conn.fileno(), timeout=self.heartbeat_interval, timeout_exc=socket.timeout)
+            except socket.timeout:
+                # 一定時間通知がなくても接続が生きているか確認する
+                self._conn.execute("SELECT 1")
+                continue
+            received = sum(1 for _ in self._conn.notifies(timeout=0))
+            if received:
+                self._wake(received)
+
+    def _wake(self, received: int) -> None:
+        self._stats["notifications"] += received
+        self._stats["wakeups"] += 1
+        self.on_notify()
+
+    def _close(self) -> None:
+        self._stats["connected"] = False
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            conn.close()
+        except Exception:  # noqa: BLE001
+            pass
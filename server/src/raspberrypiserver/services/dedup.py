@@ -0,0 +1,104 @@
+"""Scan de-duplication keyed on `metadata.scan_id`."""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+class ScanDeduplicator:
+    """
+    Bounded LRU/TTL index of recently accepted scan ids.
+
+    Pi Zero の再送（`retry_failed_sends`）はタイムアウト後に同じ `scan_id` を送り直すため、
+    直近に受理した id を保持して重複をリポジトリ／ブロードキャストの手前で弾く。
+    エントリは `ttl` 秒で失効し、`capacity` を超えると最も古いものから追い出す。
+    プロセス再起動で失われるため、DB 側の一意制約と併用する前提。
+    """
+
+    def __init__(
+        self,
+        capacity: int = 20000,
+        ttl: float = 86400.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.capacity = max(1, capacity)
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def check_and_add(self, scan_id: str) -> bool:
+        """Return True if `scan_id` was already seen; otherwise remember it."""
+        if self.seen(scan_id):
+            return True
+        self.add(scan_id)
+        return False
+
+    def seen(self, scan_id: str) -> bool:
+        """
+        Return True if `scan_id` was already accepted (without remembering a new one).
+
+        保存の前に判定し、保存に成功してから `add()` する（失敗した再送を重複扱いにしない）。
+        """
+        now = self._clock()
+        self._expire(now)
+        if scan_id not in self._entries:
+            self._stats["misses"] += 1
+            return False
+        # 再送が続く間は期限を延長し、末尾へ移して期限順を保つ
+        self._entries[scan_id] = now + self.ttl
+        self._entries.move_to_end(scan_id)
+        self._stats["hits"] += 1
+        return True
+
+    def add(self, scan_id: str) -> None:
+        """Remember `scan_id` as accepted, evicting the oldest entries beyond `capacity`."""
+        self._entries[scan_id] = self._clock() + self.ttl
+        self._entries.move_to_end(scan_id)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self._stats["evicted"] += 1
+
+    def forget(self, scan_id: str) -> None:
+        """Drop `scan_id` so a later retry is accepted again."""
+        self._entries.pop(scan_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"size": len(self._entries), "capacity": self.capacity}
+        stats.update(self._stats)
+        return stats
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float) -> None:
+        # 参照順（= 期限順）に並んでいるので先頭から失効分だけ落とす
+        while self._entries:
+            _, expires_at = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._entries.popitem(last=False)
+
+
+def normalize_scan_id(scan_id: Any) -> Optional[str]:
+    """
+    Return the canonical form of a scan id (stripped, lower-case), or None if unusable.
+
+    受信時に `_normalize_payload` がこの形へ書き換えて保存するので、重複インデックス・
+    DB の一意インデックス（`payload->'metadata'->>'scan_id'`）・スプールが同じ値で比較する。
+    """
+    if not isinstance(scan_id, str) or not scan_id.strip():
+        return None
+    return scan_id.strip().lower()
+
+
+def extract_scan_id(payload: Any) -> Optional[str]:
+    """Return the normalized `metadata.scan_id` of a payload, if any."""
+    if not isinstance(payload, dict):
+        return None
+    metadata = payload.get("metadata")
+    if not isinstance(metadata, dict):
+        return None
+    return normalize_scan_id(metadata.get("scan_id"))
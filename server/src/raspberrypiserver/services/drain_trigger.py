@@ -0,0 +1,101 @@
+"""Coalescing background trigger for backlog drains."""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import gevent
+from gevent.event import Event
+
+logger = logging.getLogger(__name__)
+
+
+class DrainTrigger:
+    """
+    Run `drain_once` in a background greenlet when ingest signals new rows.
+
+    `/api/v1/scans` は `signal()` を呼ぶだけで応答し、ドレインはリクエスト経路の外で動く。
+    前回実行から `min_interval` 秒以内に届いたシグナルはまとめて 1 回のドレインにし、
+    1 回の件数は「シグナル数 × `per_signal`」を `max_batch` で頭打ちにする。
+    頭打ちで残った分は持ち越し、満杯で終わった間は次の実行を続ける（空振りで打ち切る）。
+    """
+
+    def __init__(
+        self,
+        service: Any,
+        per_signal: int,
+        min_interval: float = 0.5,
+        max_batch: Optional[int] = None,
+    ) -> None:
+        self.service = service
+        self.per_signal = max(1, per_signal)
+        self.min_interval = max(0.0, min_interval)
+        self.max_batch = max_batch or getattr(service, "limit", None) or self.per_signal
+        self._wakeup = Event()
+        self._signals = 0
+        self._owed = 0
+        self._last_run = 0.0
+        self._worker: gevent.Greenlet | None = None
+        self._stopped = False
+        self._stats: Dict[str, Any] = {"signals": 0, "runs": 0, "drained": 0, "last_drained": None}
+
+    def signal(self) -> None:
+        """Request a drain; returns immediately."""
+        self._signals += 1
+        self._stats["signals"] += 1
+        if self._worker is None or self._worker.dead:
+            self._worker = gevent.spawn(self._run)
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopped = True
+        worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.kill(block=False)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["pending_signals"] = self._signals
+        stats["owed_rows"] = self._owed
+        stats["min_interval"] = self.min_interval
+        stats["max_batch"] = self.max_batch
+        return stats
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait()
+            wait_for = self._last_run + self.min_interval - time.monotonic()
+            if wait_for > 0:
+                # 待っている間に届いたシグナルも今回の実行へまとめる
+                gevent.sleep(wait_for)
+            self._wakeup.clear()
+            signals, self._signals = self._signals, 0
+            owed = self._owed + signals * self.per_signal
+            if owed <= 0:
+                continue
+
+            limit = min(owed, self.max_batch)
+            self._last_run = time.monotonic()
+            try:
+                drained = self.service.drain_once(limit=limit)
+            except Exception as exc:  # noqa: BLE001
+                # 持ち越し分は次のシグナルで再試行する（ここで再実行すると失敗を繰り返す）
+                self._owed = owed
+                logger.warning("Background backlog drain failed: %s", exc)
+                continue
+            self._stats["runs"] += 1
+            self._stats["drained"] += drained
+            self._stats["last_drained"] = drained
+            # 上限まで取れたなら backlog にまだ残っている可能性がある
+            self._owed = owed - limit if drained >= limit else 0
+            if self._owed:
+                self._wakeup.set()
+            logger.debug(
+                "Background backlog drain: signals=%s limit=%s drained=%s owed=%s",
+                signals,
+                limit,
+                drained,
+                self._owed,
+            )
@@ -0,0 +1,134 @@
+"""Continuous backlog drain worker with adaptive (AIMD) batch sizing."""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import gevent
+from gevent.event import Event
+
+logger = logging.getLogger(__name__)
+
+
+class DrainWorker:
+    """
+    Keep draining the backlog in a long-running greenlet.
+
+    バッチサイズは AIMD で調整する。1 回のドレインが `target_duration` 以内に満杯で終われば
+    `increase_step` ずつ増やし、超えたら半分にする（`min_batch`〜`max_batch` の範囲）。
+    backlog が空になったら `idle_interval` 秒スリープし、`signal()` で即座に起こせる。
+    起床時は backlog の深さを見て、それ以上のバッチを要求しない。
+    """
+
+    def __init__(
+        self,
+        service: Any,
+        max_batch: int = 200,
+        min_batch: int = 10,
+        target_duration: float = 0.2,
+        idle_interval: float = 5.0,
+        increase_step: Optional[int] = None,
+        error_backoff: float = 5.0,
+    ) -> None:
+        self.service = service
+        self.max_batch = max(1, max_batch)
+        self.min_batch = max(1, min(min_batch, self.max_batch))
+        self.target_duration = target_duration
+        self.idle_interval = idle_interval
+        self.increase_step = increase_step or max(1, self.max_batch // 10)
+        self.error_backoff = error_backoff
+        self.batch_size = self.min_batch
+        self._wakeup = Event()
+        self._greenlet: gevent.Greenlet | None = None
+        self._stopped = False
+        self._throughput = 0.0
+        self._stats: Dict[str, Any] = {
+            "runs": 0,
+            "drained": 0,
+            "idle_sleeps": 0,
+            "lag_seconds": None,
+            "last_duration": None,
+        }
+
+    def start(self) -> "DrainWorker":
+        """Spawn the worker greenlet (no-op when already running)."""
+        self._stopped = False
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self.run)
+        return self
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        greenlet, self._greenlet = self._greenlet, None
+        if greenlet is not None:
+            greenlet.kill(block=False)
+
+    def signal(self) -> None:
+        """Wake the worker immediately (e.g. new rows were ingested)."""
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["batch_size"] = self.batch_size
+        stats["throughput_per_sec"] = round(self._throughput, 2)
+        stats["running"] = self._greenlet is not None and not self._greenlet.dead
+        return stats
+
+    def run(self) -> None:
+        """Drain until stopped; blocks the calling greenlet."""
+        self._limit_to_depth()
+        while not self._stopped:
+            # step() の前に消す。ドレイン中に届いた signal() は残り、次の待機をすぐ抜ける
+            self._wakeup.clear()
+            if self.step():
+                gevent.sleep(0)
+                continue
+            if not self._wakeup.is_set():
+                self._stats["idle_sleeps"] += 1
+                self._wakeup.wait(timeout=self.idle_interval)
+            self._limit_to_depth()
+
+    def step(self) -> bool:
+        """
+        Run one drain and adapt the batch size.
+
+        backlog にまだ行が残っていそうなら True を返す。
+        """
+        batch = self.batch_size
+        started = time.monotonic()
+        try:
+            drained = self.service.drain_once(limit=batch)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Drain worker run failed: %s", exc)
+            gevent.sleep(self.error_backoff)
+            return False
+
+        last_run = getattr(self.service, "last_run", None) or {}
+        consumed = drained + int(last_run.get("quarantined", 0))
+        duration = time.monotonic() - started
+        self._stats["runs"] += 1
+        self._stats["drained"] += drained
+        self._stats["last_duration"] = round(duration, 4)
+        if duration > 0 and consumed:
+            rate = consumed / duration
+            self._throughput = rate if not self._throughput else 0.8 * self._throughput + 0.2 * rate
+
+        full = consumed >= batch
+        if duration > self.target_duration:
+            self.batch_size = max(self.min_batch, batch // 2)
+        elif full:
+            self.batch_size = min(self.max_batch, batch + self.increase_step)
+
+        if full:
+            self._stats["lag_seconds"] = self.service.oldest_pending_age()
+        else:
+            self._stats["lag_seconds"] = None
+        return full
+
+    def _limit_to_depth(self) -> None:
+        depth = self.service.count_backlog()
+        if depth > 0:
+            self.batch_size = max(self.min_batch, min(self.batch_size, depth))
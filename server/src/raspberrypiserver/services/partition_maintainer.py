@@ -0,0 +1,62 @@
+"""Background partition maintenance for the time-partitioned scan backlog."""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict
+
+import gevent
+from gevent.event import Event
+
+logger = logging.getLogger(__name__)
+
+
+class BacklogPartitionMaintainer:
+    """
+    Run `BacklogDrainService.maintain_partitions()` on its own schedule.
+
+    ドレイン（常駐ワーカー・受信時の自動ドレイン）が止まっていても、先のパーティションの
+    作成と処理済みパーティションの削除を `interval` 秒ごとに続ける。起動直後にも 1 回実行する。
+    """
+
+    def __init__(self, service: Any, interval: float = 300.0) -> None:
+        self.service = service
+        self.interval = interval
+        self._wakeup = Event()
+        self._greenlet: gevent.Greenlet | None = None
+        self._stopped = False
+        self._stats: Dict[str, Any] = {"runs": 0, "created": 0, "dropped": 0}
+
+    def start(self) -> "BacklogPartitionMaintainer":
+        """Spawn the maintenance greenlet (no-op when already running)."""
+        self._stopped = False
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self.run)
+        return self
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        greenlet, self._greenlet = self._greenlet, None
+        if greenlet is not None:
+            greenlet.kill(block=False)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["interval"] = self.interval
+        stats["running"] = self._greenlet is not None and not self._greenlet.dead
+        return stats
+
+    def run(self) -> None:
+        """Maintain partitions until stopped; blocks the calling greenlet."""
+        while not self._stopped:
+            try:
+                result = self.service.maintain_partitions()
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Backlog partition maintenance failed: %s", exc)
+            else:
+                self._stats["runs"] += 1
+                self._stats["created"] += result["created"]
+                self._stats["dropped"] += result["dropped"]
+            self._wakeup.clear()
+            self._wakeup.wait(timeout=self.interval)
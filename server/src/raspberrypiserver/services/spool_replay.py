@@ -0,0 +1,217 @@
+"""Background replay of the local scan spool into PostgreSQL."""
+
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Set, Tuple
+
+import gevent
+from gevent.event import Event
+
+from raspberrypiserver.database.breaker import OUTAGE_ERRORS, CircuitOpenError
+from raspberrypiserver.services.dedup import extract_scan_id
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolReplayer:
+    """
+    Move spooled scans back into `scan_ingest_backlog` once the database is reachable.
+
+    `interval` 秒ごと（または `signal()` で即座に）スプールを確認し、封印済みセグメントを
+    古い順に 1 セグメント 1 トランザクションで COPY する。コミット後にセグメントを削除する
+    ので、途中で失敗・クラッシュしても次回に同じセグメントを再送するだけで済む
+    （`metadata.scan_id` の重複は挿入しない）。ブレーカーが open の間は DB に触れない。
+
+    DB 停止以外の理由（不正なデータなど）で同じセグメントが `max_failures` 回続けて
+    失敗したら、セグメントを二分しながら再送して失敗するレコードだけを隔離し、
+    次へ進む（スプールが空にならず ingest が直接書き込みへ戻れなくなるのを防ぐ）。
+    途中で DB が落ちても、コミット済みの半分は次回の再送で重複として弾かれる。
+    隔離件数は `/healthz` に出る。
+    """
+
+    def __init__(
+        self,
+        repository: Any,
+        spool: Any,
+        breaker: Any = None,
+        interval: float = 5.0,
+        max_failures: int = 3,
+    ) -> None:
+        self.repository = repository
+        self.spool = spool
+        self.breaker = breaker
+        self.interval = interval
+        self.max_failures = max(1, max_failures)
+        self._segment_failures: Dict[int, int] = {}
+        self._wakeup = Event()
+        self._greenlet: gevent.Greenlet | None = None
+        self._stopped = False
+        self._rate = 0.0
+        self._stats: Dict[str, Any] = {
+            "replayed": 0,
+            "duplicates": 0,
+            "segments": 0,
+            "skipped_segments": 0,
+            "failures": 0,
+            "last_error": None,
+            "last_replay_at": None,
+        }
+
+    def start(self) -> "SpoolReplayer":
+        """Spawn the replay greenlet (no-op when already running)."""
+        self._stopped = False
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self.run)
+        return self
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        greenlet, self._greenlet = self._greenlet, None
+        if greenlet is not None:
+            greenlet.kill(block=False)
+
+    def signal(self) -> None:
+        """Try a replay now instead of waiting for the next interval."""
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.spool.stats()
+        stats.update(self._stats)
+        stats["replay_rate_per_sec"] = round(self._rate, 2)
+        stats["interval"] = self.interval
+        stats["running"] = self._greenlet is not None and not self._greenlet.dead
+        return stats
+
+    def run(self) -> None:
+        """Replay until stopped; blocks the calling greenlet."""
+        while not self._stopped:
+            self._wakeup.clear()
+            self._wakeup.wait(timeout=self.interval)
+            if self._stopped or not self.spool.depth:
+                continue
+            if self.breaker is not None and self.breaker.state == "open":
+                continue
+            segments = self._stats["segments"] + self._stats["skipped_segments"]
+            try:
+                self.replay_once()
+            except Exception as exc:  # noqa: BLE001
+                self._stats["failures"] += 1
+                self._stats["last_error"] = str(exc)
+                logger.warning("Scan spool replay failed (depth=%s): %s", self.spool.depth, exc)
+                continue
+            if self.spool.depth and self._stats["segments"] + self._stats["skipped_segments"] > segments:
+                # 再送中に追記された分も続けて流し、直接書き込みへ早く戻る
+                self._wakeup.set()
+
+    def replay_once(self) -> int:
+        """
+        Replay every sealed segment; returns the number of rows inserted.
+
+        失敗したセグメントで止め、例外をそのまま送出する（残りは次回）。隔離した
+        セグメントは飛ばして続ける。
+        """
+        inserted = 0
+        seen: Set[str] = set()
+        for segment_id in self.spool.pending_segments():
+            records = self.spool.read(segment_id)
+            unique, scan_ids = _unique_records(records, seen)
+            started = time.monotonic()
+            bad: List[Dict[str, Any]] = []
+            try:
+                rows = self.repository.copy_records(unique)
+            except (CircuitOpenError, *OUTAGE_ERRORS):
+                raise
+            except Exception as exc:  # noqa: BLE001
+                if not self._count_failure(segment_id):
+                    raise
+                rows, bad = self._replay_bisect(unique, exc)
+            duration = time.monotonic() - started
+            if bad:
+                self._quarantine(segment_id, bad, len(records))
+                scan_ids -= {extract_scan_id(record.get("payload")) for record in bad}
+            else:
+                self.spool.discard(segment_id)
+            self._segment_failures.pop(segment_id, None)
+            seen |= scan_ids
+
+            inserted += rows
+            self._stats["replayed"] += rows
+            self._stats["duplicates"] += len(records) - len(bad) - rows
+            self._stats["segments"] += 1
+            self._stats["last_replay_at"] = datetime.now(timezone.utc).isoformat()
+            if duration > 0 and records:
+                rate = len(records) / duration
+                self._rate = rate if not self._rate else 0.8 * self._rate + 0.2 * rate
+        if inserted:
+            logger.info("Replayed %s spooled scan(s) into the backlog", inserted)
+        return inserted
+
+    def _count_failure(self, segment_id: int) -> bool:
+        """Count a non-outage failure; True once the segment has failed `max_failures` times."""
+        failures = self._segment_failures.get(segment_id, 0) + 1
+        self._segment_failures[segment_id] = failures
+        return failures >= self.max_failures
+
+    def _replay_bisect(
+        self, records: List[Dict[str, Any]], exc: Exception
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Replay `records` in halves until the failing ones are isolated.
+
+        (挿入した行数, 単独でも失敗したレコード) を返す。DB 停止はそのまま送出する。
+        """
+        if len(records) <= 1:
+            self._stats["last_error"] = str(exc)
+            return 0, list(records)
+        inserted = 0
+        bad: List[Dict[str, Any]] = []
+        middle = len(records) // 2
+        for half in (records[:middle], records[middle:]):
+            try:
+                inserted += self.repository.copy_records(half)
+            except (CircuitOpenError, *OUTAGE_ERRORS):
+                raise
+            except Exception as half_exc:  # noqa: BLE001
+                rows, failed = self._replay_bisect(half, half_exc)
+                inserted += rows
+                bad.extend(failed)
+        return inserted, bad
+
+    def _quarantine(self, segment_id: int, bad: List[Dict[str, Any]], total: int) -> None:
+        failures = self._segment_failures.get(segment_id, 0)
+        moved = self.spool.quarantine_records(segment_id, bad)
+        self._stats["skipped_segments"] += 1
+        self._stats["failures"] += 1
+        logger.error(
+            "Scan spool segment %s failed %s replay(s); moved %s of %s scan(s) to %s: %s",
+            segment_id,
+            failures,
+            moved,
+            total,
+            self.spool.quarantine_dir,
+            self._stats["last_error"],
+        )
+
+
+def _unique_records(records: List[Dict[str, Any]], seen: Set[str]) -> Tuple[List[Dict[str, Any]], Set[str]]:
+    """
+    Keep the first record per `metadata.scan_id` (records without one are all kept).
+
+    `seen` は書き換えず、このセグメントで新たに見た scan_id を返す（再送に成功した
+    セグメントの分だけ呼び出し側が `seen` へ加える）。scan_id は ingest と同じ
+    `extract_scan_id` で正規化して比べる。
+    """
+    unique = []
+    scan_ids: Set[str] = set()
+    for record in records:
+        scan_id = extract_scan_id(record.get("payload"))
+        if scan_id is not None:
+            if scan_id in seen or scan_id in scan_ids:
+                continue
+            scan_ids.add(scan_id)
+        unique.append(record)
+    return unique, scan_ids
@@ -0,0 +1,188 @@
+"""Backlog drain on the embedded SQLite backend."""
+
+from __future__ import annotations
+
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from raspberrypiserver.repositories.sqlite import SQLiteDatabase, parse_time, utcnow_text
+
+from .backlog import (
+    BacklogDrainService,
+    CandidateRow,
+    DeadLetterStillInvalid,
+    InvalidRow,
+    requeue_invalid_reasons,
+    split_candidates,
+)
+
+logger = logging.getLogger(__name__)
+
+# id の集合は json_each で 1 つのパラメータとして渡す（件数が変わっても同じ文を再利用できる）
+_SELECT_CANDIDATES = """
+SELECT id, order_code, location_code, device_id
+FROM scan_ingest_backlog
+ORDER BY received_at, id
+LIMIT ?
+"""
+
+_QUARANTINE = """
+INSERT INTO scan_ingest_dead_letter (id, payload, received_at, reason, quarantined_at)
+SELECT id, payload, received_at, ?, ?
+FROM scan_ingest_backlog
+WHERE id = ?
+ON CONFLICT (id) DO NOTHING
+"""
+
+_UPSERT = """
+INSERT INTO part_locations (order_code, location_code, device_id, updated_at, change_seq)
+VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM part_locations))
+ON CONFLICT (order_code) DO UPDATE SET
+    location_code = excluded.location_code,
+    device_id = excluded.device_id,
+    updated_at = excluded.updated_at,
+    change_seq = excluded.change_seq
+"""
+
+_HISTORY = """
+INSERT INTO part_location_history (backlog_id, order_code, location_code, device_id, moved_at, recorded_at)
+SELECT id, order_code, location_code, device_id, received_at, ?
+FROM scan_ingest_backlog
+WHERE id IN (SELECT value FROM json_each(?))
+"""
+
+_DELETE = "DELETE FROM scan_ingest_backlog WHERE id IN (SELECT value FROM json_each(?))"
+
+
+class SQLiteBacklogDrainService(BacklogDrainService):
+    """
+    `BacklogDrainService` on SQLite.
+
+    取得・隔離・後勝ちの集約・upsert・履歴追記・削除を 1 トランザクションで行う流れは
+    PostgreSQL 版と共通で、SQL だけを差し替える。SQLite は書き込みが 1 本に直列化
+    されるため、`change_seq` は `MAX(change_seq) + 1` で採番しても順序が保たれる。
+    件数は常に COUNT(*)（`idx_scan_ingest_backlog_drain_order` を走査）。
+    """
+
+    def __init__(
+        self,
+        database: SQLiteDatabase,
+        limit: int = 100,
+        history: bool = True,
+        on_upsert: Optional[Callable[[int], Any]] = None,
+    ) -> None:
+        super().__init__(
+            dsn=database.path,
+            limit=limit,
+            connect=database.connect,
+            count_mode="exact",
+            history_table="part_location_history" if history else "",
+            on_upsert=on_upsert,
+        )
+        self.database = database
+
+    def _select_candidates(self, cur, limit: int) -> Tuple[List[CandidateRow], List[InvalidRow]]:
+        cur.execute(_SELECT_CANDIDATES, (limit,))
+        return split_candidates(cur.fetchall())
+
+    def _quarantine_rows(self, cur, invalid: List[InvalidRow]) -> None:
+        if not invalid:
+            return
+        now = utcnow_text()
+        cur.executemany(_QUARANTINE, [(reason, now, row_id) for row_id, reason in invalid])
+        cur.execute(_DELETE, (json.dumps([row_id for row_id, _ in invalid]),))
+
+    def _upsert_locations(self, cur, candidates) -> List[CandidateRow]:
+        processed = list(candidates)
+        if not processed:
+            return processed
+        now = utcnow_text()
+        cur.executemany(_UPSERT, [(row[1], row[2], row[3], now) for row in processed])
+        return processed
+
+    def _consume_backlog_rows(self, cur, ids: List[int]) -> None:
+        if not ids:
+            return
+        encoded = json.dumps(ids)
+        if self.history_table:
+            cur.execute(_HISTORY, (utcnow_text(), encoded))
+        cur.execute(_DELETE, (encoded,))
+
+    def _pending_count(self, cur, mode: str) -> Tuple[int, str]:
+        cur.execute("SELECT COUNT(*) FROM scan_ingest_backlog")
+        (count,) = cur.fetchone()
+        return int(count), "exact"
+
+    def _oldest_age(self, cur) -> Optional[float]:
+        cur.execute("SELECT MIN(received_at) FROM scan_ingest_backlog")
+        row = cur.fetchone()
+        oldest = parse_time(row[0]) if row else None
+        if oldest is None:
+            return None
+        return (datetime.now(timezone.utc) - oldest).total_seconds()
+
+    def _load_dead_letter_count(self) -> Optional[int]:
+        try:
+            with self._connect() as conn, conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM scan_ingest_dead_letter")
+                (count,) = cur.fetchone()
+                return int(count)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Dead-letter count failed: %s", exc)
+            return None
+
+    def list_dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        try:
+            with self._connect() as conn, conn.cursor(row_factory=dict) as cur:
+                cur.execute(
+                    """
+                    SELECT id, payload, received_at, reason, quarantined_at
+                    FROM scan_ingest_dead_letter
+                    ORDER BY quarantined_at DESC, id DESC
+                    LIMIT ?
+                    """,
+                    (limit,),
+                )
+                rows = cur.fetchall()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Dead-letter listing failed: %s", exc)
+            return []
+        for row in rows:
+            row["payload"] = json.loads(row["payload"])
+            row["received_at"] = parse_time(row["received_at"])
+            row["quarantined_at"] = parse_time(row["quarantined_at"])
+        return rows
+
+    def requeue_dead_letters(self, ids: List[int], patch: Optional[Dict[str, Any]] = None) -> int:
+        if not ids:
+            return 0
+
+        requeued = 0
+        with self._connect() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, payload, received_at FROM scan_ingest_dead_letter WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(ids)),),
+            )
+            # PostgreSQL 版の `payload || patch` と同じくトップレベルのキーを上書きする
+            rows = [
+                (row_id, {**json.loads(payload), **(patch or {})}, received_at)
+                for row_id, payload, received_at in cur.fetchall()
+            ]
+            reasons = requeue_invalid_reasons((row_id, merged) for row_id, merged, _ in rows)
+            if reasons:
+                raise DeadLetterStillInvalid(reasons)
+            for row_id, merged, received_at in sorted(rows, key=lambda row: (row[2], row[0])):
+                cur.execute(
+                    "INSERT INTO scan_ingest_backlog (payload, received_at) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                    (json.dumps(merged, ensure_ascii=False), received_at),
+                )
+                # scan_id が既に backlog にあって入らなかった行は dead-letter に残す
+                if cur.rowcount > 0:
+                    cur.execute("DELETE FROM scan_ingest_dead_letter WHERE id = ?", (row_id,))
+                    requeued += 1
+            conn.commit()
+        self._cache.pop("dead_letter", None)
+        logger.info("Requeued %s dead-letter row(s) into %s", requeued, self.backlog_table)
+        return requeued
@@ -1,7 +1,9 @@
+from unittest.mock import MagicMock
+
 from flask.testing import FlaskClient
 
 from raspberrypiserver.app import create_app
-from raspberrypiserver.services.backlog import BacklogDrainService
+from raspberrypiserver.services.backlog import BacklogDrainService, DeadLetterStillInvalid
 
 
 class FakeDrainService:
@@ -10,6 +12,9 @@ class FakeDrainService:
         self._drained = drained
         self.last_limit = None
         self._pending = 0
+        self.dead_letters: list = []
+        self.requeued = None
+        self.last_exact = None
 
     def is_configured(self) -> bool:
         return True
@@ -21,6 +26,27 @@ class FakeDrainService:
     def count_backlog(self) -> int:
         return self._pending
 
+    def backlog_stats(self, exact: bool = False) -> dict:
+        self.last_exact = exact
+        return {
+            "pending": self._pending,
+            "pending_mode": "exact" if exact else "counter",
+            "oldest_pending_age_seconds": 1.5 if self._pending else None,
+        }
+
+    def metrics(self) -> dict:
+        return {"runs": 0}
+
+    def count_dead_letters(self) -> int:
+        return len(self.dead_letters)
+
+    def list_dead_letters(self, limit: int = 50) -> list:
+        return self.dead_letters[:limit]
+
+    def requeue_dead_letters(self, ids, patch=None) -> int:
+        self.requeued = (ids, patch)
+        return len(ids)
+
     def set_pending(self, value: int) -> None:
         self._pending = value
 
@@ -91,9 +117,28 @@ def test_backlog_status_reports_metrics():
     assert resp.get_json() == {
         "status": "ok",
         "pending": 42,
+        "pending_mode": "counter",
+        "oldest_pending_age_seconds": 1.5,
         "drain_limit": 75,
         "auto_drain_on_ingest": 15,
+        "dead_letter": 0,
+        "metrics": {"runs": 0},
     }
+    assert fake_service.last_exact is False
+
+
+def test_backlog_status_exact_query_bypasses_estimate():
+    app = create_app()
+    fake_service = FakeDrainService()
+    fake_service.set_pending(7)
+    app.config["BACKLOG_DRAIN_SERVICE"] = fake_service
+
+    client: FlaskClient = app.test_client()
+    body = client.get("/api/v1/admin/backlog-status?exact=1").get_json()
+
+    assert fake_service.last_exact is True
+    assert body["pending"] == 7
+    assert body["pending_mode"] == "exact"
 
 
 def test_admin_drain_backlog_uses_real_service():
@@ -194,6 +239,60 @@ def test_backlog_status_handles_service_errors():
     assert resp.get_json() == {
         "status": "ok",
         "pending": 0,
+        "pending_mode": "unavailable",
+        "oldest_pending_age_seconds": None,
         "drain_limit": 33,
         "auto_drain_on_ingest": 5,
+        "dead_letter": 0,
+        "metrics": {
+            "runs": 0,
+            "drained": 0,
+            "upserted": 0,
+            "superseded": 0,
+            "quarantined": 0,
+            "failures": 0,
+        },
     }
+
+
+def test_dead_letters_listing_and_requeue():
+    app = create_app()
+    fake_service = FakeDrainService()
+    fake_service.dead_letters = [
+        {
+            "id": 9,
+            "payload": {"location_code": "RACK-A1"},
+            "reason": "missing-order_code",
+            "received_at": None,
+            "quarantined_at": None,
+        }
+    ]
+    app.config["BACKLOG_DRAIN_SERVICE"] = fake_service
+    client: FlaskClient = app.test_client()
+
+    resp = client.get("/api/v1/admin/dead-letters?limit=5")
+    assert resp.status_code == 200
+    assert resp.get_json()["entries"][0]["reason"] == "missing-order_code"
+
+    resp = client.post(
+        "/api/v1/admin/dead-letters/requeue",
+        json={"ids": [9], "patch": {"order_code": "ORD-9"}},
+    )
+    assert resp.status_code == 200
+    assert resp.get_json() == {"status": "ok", "requeued": 1}
+    assert fake_service.requeued == ([9], {"order_code": "ORD-9"})
+
+    resp = client.post("/api/v1/admin/dead-letters/requeue", json={"ids": "9"})
+    assert resp.status_code == 400
+
+    fake_service.requeue_dead_letters = MagicMock(side_effect=DeadLetterStillInvalid({9: "missing-location_code"}))
+    resp = client.post("/api/v1/admin/dead-letters/requeue", json={"ids": [9]})
+    assert resp.status_code == 400
+    assert resp.get_json() == {
+        "status": "error",
+        "reason": "still-invalid",
+        "invalid": [{"id": 9, "reason": "missing-location_code"}],
+    }
+
+    status = client.get("/api/v1/admin/backlog-status").get_json()
+    assert status["dead_letter"] == 1
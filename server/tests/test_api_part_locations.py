@@ -49,5 +49,271 @@ def test_part_locations_uses_custom_repository(monkeypatch):
                 "device_id": "D1",
                 "updated_at": None,
             }
-        ]
+        ],
+        "next_cursor": None,
     }
+
+
+class FakeHistoryRepo:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def trail(self, order_code, limit=100, before=None):
+        self.calls.append(("trail", order_code, limit, before))
+        rows = [row for row in self.rows if row["order_code"] == order_code]
+        if before:
+            rows = [row for row in rows if row["id"] < before[1]]
+        return rows[:limit]
+
+    def window(self, start, end, limit=100, after=None):
+        self.calls.append(("window", start, end, limit, after))
+        return self.rows[:limit]
+
+
+def _history_rows():
+    from datetime import datetime, timezone
+
+    return [
+        {
+            "id": 3 - index,
+            "order_code": "ORD-1",
+            "location_code": f"RACK-{3 - index}",
+            "device_id": None,
+            "moved_at": datetime(2026, 10, 17, 10, 3 - index, tzinfo=timezone.utc),
+        }
+        for index in range(3)
+    ]
+
+
+def test_part_location_trail_paginates_with_cursor():
+    app = create_app()
+    history = FakeHistoryRepo(_history_rows())
+    app.config["PART_LOCATION_HISTORY_REPOSITORY"] = history
+    client: FlaskClient = app.test_client()
+
+    first = client.get("/api/v1/orders/ORD-1/history?limit=2").get_json()
+    assert [entry["location_code"] for entry in first["entries"]] == ["RACK-3", "RACK-2"]
+    assert first["entries"][0]["moved_at"] == "2026-10-17T10:03:00+00:00"
+    assert first["next_cursor"]
+
+    second = client.get(f"/api/v1/orders/ORD-1/history?limit=2&cursor={first['next_cursor']}").get_json()
+    assert [entry["location_code"] for entry in second["entries"]] == ["RACK-1"]
+    assert second["next_cursor"] is None
+    assert history.calls[-1][3] == ["2026-10-17T10:02:00+00:00", 2]
+
+
+def test_part_location_history_window_requires_valid_range():
+    app = create_app()
+    history = FakeHistoryRepo(_history_rows())
+    app.config["PART_LOCATION_HISTORY_REPOSITORY"] = history
+    client: FlaskClient = app.test_client()
+
+    resp = client.get("/api/v1/part-location-history?from=2026-10-17T11:00:00")
+    assert resp.status_code == 400
+    assert resp.get_json()["reason"] == "invalid-range"
+
+    resp = client.get("/api/v1/part-location-history?from=2026-10-17T09:00:00&to=2026-10-17T11:00:00&cursor=@@")
+    assert resp.status_code == 400
+
+    resp = client.get("/api/v1/part-location-history?from=2026-10-17T09:00:00&to=2026-10-17T11:00:00")
+    assert resp.status_code == 200
+    assert len(resp.get_json()["entries"]) == 3
+    _, start, end, limit, after = history.calls[-1]
+    assert start.tzinfo is not None and end.hour == 11
+    assert (limit, after) == (101, None)
+
+
+def test_part_location_history_disabled_for_memory_backend():
+    app = create_app()
+    client: FlaskClient = app.test_client()
+
+    resp = client.get("/api/v1/orders/ORD-1/history")
+    assert resp.status_code == 200
+    assert resp.get_json() == {"status": "disabled", "entries": [], "next_cursor": None}
+
+
+class SnapshotRepo:
+    def __init__(self):
+        from datetime import datetime, timedelta, timezone
+
+        base = datetime(2026, 10, 17, 9, 0, tzinfo=timezone.utc)
+        self.rows = [
+            {
+                "order_code": f"ORD-{index}",
+                "location_code": "RACK-A1",
+                "device_id": None,
+                "updated_at": base - timedelta(minutes=index),
+            }
+            for index in range(5)
+        ]
+        self.list_calls = []
+
+    def list(self, limit=200, after=None):
+        self.list_calls.append((limit, after))
+        rows = self.rows
+        if after:
+            rows = [row for row in rows if (row["updated_at"].isoformat(), row["order_code"]) < tuple(after)]
+        return rows[:limit]
+
+    def snapshot(self):
+        return self.rows[0]["updated_at"]
+
+
+def test_part_locations_keyset_pagination():
+    app = create_app()
+    repo = SnapshotRepo()
+    app.config["PART_LOCATION_REPOSITORY"] = repo
+    client: FlaskClient = app.test_client()
+
+    first = client.get("/api/v1/part-locations?limit=2").get_json()
+    assert [entry["order_code"] for entry in first["entries"]] == ["ORD-0", "ORD-1"]
+    second = client.get(f"/api/v1/part-locations?limit=2&cursor={first['next_cursor']}").get_json()
+    assert [entry["order_code"] for entry in second["entries"]] == ["ORD-2", "ORD-3"]
+    third = client.get(f"/api/v1/part-locations?limit=2&cursor={second['next_cursor']}").get_json()
+    assert [entry["order_code"] for entry in third["entries"]] == ["ORD-4"]
+    assert third["next_cursor"] is None
+
+    assert client.get("/api/v1/part-locations?cursor=not-a-cursor").status_code == 400
+
+
+
+def test_part_locations_rejects_cursors_with_wrong_types():
+    from raspberrypiserver.api.cursors import encode_cursor
+
+    app = create_app()
+    repo = SnapshotRepo()
+    app.config["PART_LOCATION_REPOSITORY"] = repo
+    app.config["PART_LOCATION_HISTORY_REPOSITORY"] = FakeHistoryRepo(_history_rows())
+    client: FlaskClient = app.test_client()
+
+    for values in (["yesterday", "ORD-1"], [12, "ORD-1"], ["2026-10-17T09:00:00+00:00", 5]):
+        resp = client.get(f"/api/v1/part-locations?cursor={encode_cursor(values)}")
+        assert resp.status_code == 400
+        assert resp.get_json()["reason"] == "invalid-cursor"
+    assert repo.list_calls == []
+
+    bad_id = encode_cursor(["2026-10-17T10:02:00+00:00", "2"])
+    assert client.get(f"/api/v1/orders/ORD-1/history?cursor={bad_id}").status_code == 400
+    window = "/api/v1/part-location-history?from=2026-10-17T09:00:00&to=2026-10-17T11:00:00"
+    assert client.get(f"{window}&cursor={encode_cursor(['not-a-time', 2])}").status_code == 400
+
+def test_part_locations_etag_returns_304_without_fetching_rows():
+    app = create_app()
+    repo = SnapshotRepo()
+    app.config["PART_LOCATION_REPOSITORY"] = repo
+    client: FlaskClient = app.test_client()
+
+    resp = client.get("/api/v1/part-locations?limit=3")
+    etag = resp.headers["ETag"]
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "no-cache"
+    assert len(repo.list_calls) == 1
+
+    resp = client.get("/api/v1/part-locations?limit=3", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.data == b""
+    assert resp.headers["ETag"] == etag
+    assert len(repo.list_calls) == 1
+
+    # 別の limit は別の表現なので一致しない
+    resp = client.get("/api/v1/part-locations?limit=4", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+
+    from datetime import timedelta
+
+    repo.rows[0]["updated_at"] += timedelta(seconds=1)
+    resp = client.get("/api/v1/part-locations?limit=3", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+class ChangesRepo:
+    def __init__(self):
+        self.rows = [
+            {"order_code": f"ORD-{seq}", "location_code": "RACK-A1", "device_id": None, "updated_at": None, "change_seq": seq}
+            for seq in (3, 5, 8)
+        ]
+        self.calls = []
+
+    def list(self, limit=200, after=None):
+        return []
+
+    def changes(self, since=0, limit=200):
+        self.calls.append((since, limit))
+        return [row for row in self.rows if row["change_seq"] > since][:limit]
+
+
+def test_part_location_changes_returns_delta_since_cursor():
+    app = create_app()
+    repo = ChangesRepo()
+    app.config["PART_LOCATION_REPOSITORY"] = repo
+    client: FlaskClient = app.test_client()
+
+    first = client.get("/api/v1/part-locations/changes?limit=2").get_json()
+    assert [entry["order_code"] for entry in first["changes"]] == ["ORD-3", "ORD-5"]
+    assert first["has_more"] is True
+    assert first["deleted"] == []
+    assert repo.calls[-1] == (0, 3)
+
+    second = client.get(f"/api/v1/part-locations/changes?limit=2&since={first['next_cursor']}").get_json()
+    assert [entry["order_code"] for entry in second["changes"]] == ["ORD-8"]
+    assert second["has_more"] is False
+
+    # 変更が無くても同じ位置の cursor を返す
+    idle = client.get(f"/api/v1/part-locations/changes?since={second['next_cursor']}").get_json()
+    assert idle["changes"] == []
+    assert idle["next_cursor"] == second["next_cursor"]
+
+    assert client.get("/api/v1/part-locations/changes?since=bogus").status_code == 400
+
+
+def test_part_location_changes_memory_backend():
+    app = create_app()
+    repo = app.config["SCAN_REPOSITORY"]
+    client: FlaskClient = app.test_client()
+    body = client.get("/api/v1/part-locations/changes").get_json()
+    assert body["changes"] == [] and body["has_more"] is False
+
+    repo.save({"order_code": "A", "location_code": "R1"})
+    repo.save({"order_code": "B", "location_code": "R1"})
+    cursor = client.get("/api/v1/part-locations/changes").get_json()["next_cursor"]
+    repo.save({"order_code": "A", "location_code": "R2"})
+    body = client.get(f"/api/v1/part-locations/changes?since={cursor}").get_json()
+    assert [(e["order_code"], e["location_code"]) for e in body["changes"]] == [("A", "R2")]
+
+
+def test_point_lookup_and_reverse_index_memory_backend():
+    app = create_app()
+    repo = app.config["SCAN_REPOSITORY"]
+    repo.save({"order_code": "A", "location_code": "RACK-Z9", "device_id": "DEV-1"})
+    repo.save_many(
+        [
+            {"order_code": "B", "location_code": "RACK-Z9"},
+            {"order_code": "C", "location_code": "RACK-A1"},
+        ]
+    )
+    client: FlaskClient = app.test_client()
+
+    body = client.get("/api/v1/orders/A/location").get_json()
+    assert body["status"] == "ok"
+    assert body["entry"]["location_code"] == "RACK-Z9"
+    assert body["entry"]["device_id"] == "DEV-1"
+    stored = app.config["PART_LOCATION_REPOSITORY"].get("A")
+    assert body["entry"]["updated_at"] == stored["updated_at"].isoformat()
+    assert client.get("/api/v1/orders/ZZZ/location").status_code == 404
+
+    # 差分同期の経路と同じ名前の注文も引ける
+    repo.save({"order_code": "changes", "location_code": "RACK-C3"})
+    assert client.get("/api/v1/orders/changes/location").get_json()["entry"]["location_code"] == "RACK-C3"
+
+    body = client.get("/api/v1/locations/RACK-Z9/orders").get_json()
+    assert [entry["order_code"] for entry in body["entries"]] == ["B", "A"]
+
+    # 移動すると元の棚の一覧から消える
+    repo.save({"order_code": "A", "location_code": "RACK-A1"})
+    assert [e["order_code"] for e in client.get("/api/v1/locations/RACK-Z9/orders").get_json()["entries"]] == ["B"]
+    assert [
+        e["order_code"] for e in client.get("/api/v1/locations/RACK-A1/orders?limit=1").get_json()["entries"]
+    ] == ["A"]
+    assert client.get("/api/v1/locations/EMPTY/orders").get_json()["entries"] == []
@@ -1,9 +1,10 @@
 from pathlib import Path
 from unittest.mock import MagicMock
 
+import gevent
 from flask.testing import FlaskClient
 
-from raspberrypiserver.app import create_app, socketio
+from raspberrypiserver.app import create_app, create_drain_trigger, socketio
 
 
 def test_scans_endpoint_echoes_payload():
@@ -68,12 +69,17 @@ def test_scans_endpoint_triggers_auto_drain_when_configured():
     drain_service = FakeDrain()
     app.config["BACKLOG_DRAIN_SERVICE"] = drain_service
     app.config["AUTO_DRAIN_ON_INGEST"] = 15
+    app.config["AUTO_DRAIN_MIN_INTERVAL_MS"] = 0
+    app.config["BACKLOG_DRAIN_TRIGGER"] = create_drain_trigger(app, drain_service)
 
     client: FlaskClient = app.test_client()
     response = client.post("/api/v1/scans", json={"order_code": "X", "location_code": "L"})
 
     assert response.status_code == 202
-    assert response.get_json()["backlog_drained"] == 7
+    assert response.get_json()["backlog_drain"] == "queued"
+    assert drain_service.called_with is None  # drain runs off the request path
+
+    gevent.sleep(0.01)
     assert drain_service.called_with == 15
 
 
@@ -81,13 +87,14 @@ def test_scans_endpoint_auto_drain_skipped_when_service_missing():
     app = create_app()
     app.config["AUTO_DRAIN_ON_INGEST"] = 20
     app.config["BACKLOG_DRAIN_SERVICE"] = None
+    app.config["BACKLOG_DRAIN_TRIGGER"] = create_drain_trigger(app, None)
 
     client: FlaskClient = app.test_client()
     response = client.post("/api/v1/scans", json={"order_code": "Z", "location_code": "L"})
 
     assert response.status_code == 202
     body = response.get_json()
-    assert "backlog_drained" not in body
+    assert "backlog_drain" not in body
 
 
 def test_socketio_emission_occurs():
@@ -135,3 +142,220 @@ def test_socketio_uses_configured_path(monkeypatch, tmp_path):
         assert app.config["SOCKETIO_PATH"] == "/custom.io"
     finally:
         monkeypatch.delenv("RPI_SERVER_CONFIG", raising=False)
+
+
+def test_scans_batch_accepts_json_array_with_per_item_results():
+    app = create_app()
+    mock_broadcast = MagicMock()
+    app.config["BROADCAST_SERVICE"] = mock_broadcast
+
+    client: FlaskClient = app.test_client()
+    response = client.post(
+        "/api/v1/scans/batch",
+        json=[
+            {"order_code": " B-1 ", "location_code": "RACK-A1"},
+            {"location_code": "RACK-A2"},
+            {"order_code": "B-3", "location_code": "RACK-A3", "device_id": "HANDHELD-01"},
+        ],
+    )
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["status"] == "partial"
+    assert body["accepted"] == 2
+    assert body["rejected"] == 1
+    assert body["results"] == [
+        {"index": 0, "status": "accepted"},
+        {"index": 1, "status": "error", "reason": "missing-order_code"},
+        {"index": 2, "status": "accepted"},
+    ]
+
+    repo = app.config["SCAN_REPOSITORY"]
+    assert [item["order_code"] for item in repo.recent(10)] == ["B-1", "B-3"]
+    assert mock_broadcast.emit.call_count == 2
+
+
+def test_scans_batch_accepts_ndjson_body():
+    app = create_app()
+    client: FlaskClient = app.test_client()
+
+    body = "\n".join(
+        [
+            '{"order_code": "N-1", "location_code": "L-1"}',
+            "not-json",
+            "",
+            '{"order_code": "N-2", "location_code": "L-2"}',
+        ]
+    )
+    response = client.post("/api/v1/scans/batch", data=body, content_type="application/x-ndjson")
+
+    assert response.status_code == 202
+    data = response.get_json()
+    assert data["accepted"] == 2
+    assert data["results"][1] == {"index": 1, "status": "error", "reason": "invalid-json"}
+
+
+def test_scans_batch_rejects_empty_and_oversized_batches():
+    app = create_app()
+    app.config["SCAN_BATCH_MAX_ITEMS"] = 2
+    client: FlaskClient = app.test_client()
+
+    response = client.post("/api/v1/scans/batch", json=[])
+    assert response.status_code == 400
+    assert response.get_json()["reason"] == "empty-batch"
+
+    items = [{"order_code": f"O-{i}", "location_code": "L"} for i in range(3)]
+    response = client.post("/api/v1/scans/batch", json=items)
+    assert response.status_code == 413
+    assert response.get_json()["reason"] == "batch-too-large"
+
+    response = client.post("/api/v1/scans/batch", json=[{"location_code": "L"}])
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "rejected"
+
+    # 受理 0 件なら重複が混ざっていても partial / 202 にしない
+    scan = {"order_code": "O-1", "location_code": "L", "metadata": {"scan_id": "rej-1"}}
+    assert client.post("/api/v1/scans", json=scan).status_code == 202
+    response = client.post("/api/v1/scans/batch", json=[scan, {"location_code": "L"}])
+    assert response.status_code == 400
+    body = response.get_json()
+    assert (body["status"], body["accepted"], body["duplicates"], body["rejected"]) == ("rejected", 0, 1, 1)
+
+
+def test_scans_endpoint_returns_duplicate_for_repeated_scan_id():
+    app = create_app()
+    mock_broadcast = MagicMock()
+    app.config["BROADCAST_SERVICE"] = mock_broadcast
+    repo = app.config["SCAN_REPOSITORY"]
+
+    client: FlaskClient = app.test_client()
+    payload = {
+        "order_code": "DUP-1",
+        "location_code": "RACK-A1",
+        "metadata": {"scan_id": "0f8c2d1e-1111-4c1e-9a61-2d7f0c2e0001"},
+    }
+    first = client.post("/api/v1/scans", json=payload)
+    second = client.post("/api/v1/scans", json=payload)
+
+    assert first.status_code == 202
+    assert second.status_code == 200
+    assert second.get_json()["status"] == "duplicate"
+    assert second.get_json()["scan_id"] == "0f8c2d1e-1111-4c1e-9a61-2d7f0c2e0001"
+    assert len(list(repo.recent(10))) == 1
+    assert mock_broadcast.emit.call_count == 1
+
+
+def test_scans_batch_marks_duplicates_within_and_across_requests():
+    app = create_app()
+    client: FlaskClient = app.test_client()
+    item = {"order_code": "DUP-2", "location_code": "L", "metadata": {"scan_id": "scan-2"}}
+
+    response = client.post("/api/v1/scans/batch", json=[item, item])
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["accepted"] == 1
+    assert body["duplicates"] == 1
+    assert body["results"][1] == {"index": 1, "status": "duplicate"}
+
+    response = client.post("/api/v1/scans/batch", json=[item])
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "duplicate"
+
+
+def test_scans_endpoint_stores_normalized_scan_id_and_rejects_blank_ids():
+    app = create_app()
+    client: FlaskClient = app.test_client()
+    repo = app.config["SCAN_REPOSITORY"]
+
+    response = client.post(
+        "/api/v1/scans",
+        json={"order_code": "N-1", "location_code": "L", "metadata": {"scan_id": "  SCAN-ABC "}},
+    )
+    assert response.status_code == 202
+    assert response.get_json()["received"]["metadata"]["scan_id"] == "scan-abc"
+    assert list(repo.recent(1))[0]["metadata"]["scan_id"] == "scan-abc"
+
+    retry = client.post(
+        "/api/v1/scans",
+        json={"order_code": "N-1", "location_code": "L", "metadata": {"scan_id": "scan-abc"}},
+    )
+    assert retry.get_json()["status"] == "duplicate"
+
+    blank = client.post(
+        "/api/v1/scans",
+        json={"order_code": "N-1", "location_code": "L", "metadata": {"scan_id": "  "}},
+    )
+    assert blank.status_code == 400
+    assert blank.get_json()["reason"] == "invalid-scan_id"
+
+
+def test_failed_save_does_not_mark_scan_id_as_seen():
+    app = create_app()
+    client: FlaskClient = app.test_client()
+    repo = app.config["SCAN_REPOSITORY"]
+    original_save_many = repo.save_many
+    repo.save = MagicMock(side_effect=RuntimeError("database down"))
+    repo.save_many = MagicMock(side_effect=RuntimeError("database down"))
+    payload = {"order_code": "RETRY-1", "location_code": "L", "metadata": {"scan_id": "retry-1"}}
+
+    failed = client.post("/api/v1/scans", json=payload)
+    assert failed.status_code == 503
+    assert failed.get_json()["reason"] == "persistence-failed"
+    failed_batch = client.post("/api/v1/scans/batch", json=[payload])
+    assert failed_batch.status_code == 503
+    assert len(app.config["SCAN_DEDUP_INDEX"]) == 0
+
+    del repo.save
+    repo.save_many = original_save_many
+    retry = client.post("/api/v1/scans", json=payload)
+    assert retry.status_code == 202
+    assert retry.get_json()["status"] == "accepted"
+
+
+def test_rows_dropped_by_storage_are_reported_as_duplicates():
+    app = create_app()
+    client: FlaskClient = app.test_client()
+    repo = app.config["SCAN_REPOSITORY"]
+    broadcaster = MagicMock()
+    app.config["BROADCAST_SERVICE"] = broadcaster
+    # DB の一意インデックスに既にある scan_id（重複インデックスは再起動で空）
+    repo.save = MagicMock(return_value=False)
+    repo.save_many = MagicMock(side_effect=lambda payloads: [p for p in payloads if "metadata" not in p])
+    known = {"order_code": "DUP-1", "location_code": "L", "metadata": {"scan_id": "dup-1"}}
+    fresh = {"order_code": "NEW-1", "location_code": "L"}
+
+    single = client.post("/api/v1/scans", json=known)
+    assert single.status_code == 200
+    assert single.get_json()["status"] == "duplicate"
+
+    known["metadata"]["scan_id"] = "dup-2"
+    batch = client.post("/api/v1/scans/batch", json=[known, fresh])
+    body = batch.get_json()
+    assert batch.status_code == 202
+    assert body["accepted"] == 1
+    assert body["duplicates"] == 1
+    assert [result["status"] for result in body["results"]] == ["duplicate", "accepted"]
+    assert [call.args[1]["order_code"] for call in broadcaster.emit.call_args_list] == ["NEW-1"]
+
+    known["metadata"]["scan_id"] = "dup-3"
+    only_known = client.post("/api/v1/scans/batch", json=[known])
+    assert only_known.status_code == 200
+    assert only_known.get_json()["status"] == "duplicate"
+
+
+def test_group_commit_timeout_answers_503():
+    from raspberrypiserver.repositories import ScanCommitTimeout
+
+    app = create_app()
+    client: FlaskClient = app.test_client()
+    repo = app.config["SCAN_REPOSITORY"]
+    repo.save = MagicMock(side_effect=ScanCommitTimeout("scan group commit did not finish within 5.0s"))
+    repo.save_many = repo.save
+    payload = {"order_code": "SLOW-1", "location_code": "L", "metadata": {"scan_id": "slow-1"}}
+
+    response = client.post("/api/v1/scans", json=payload)
+    batch = client.post("/api/v1/scans/batch", json=[payload])
+
+    assert response.status_code == 503
+    assert response.get_json()["reason"] == "persistence-failed"
+    assert batch.status_code == 503
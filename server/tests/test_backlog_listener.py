@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import socket
+
+import gevent
+
+from raspberrypiserver.services.backlog_listener import BacklogNotifyListener
+
+
+class FakeListenConnection:
+    """LISTEN 接続の代わりに socketpair の片側を fileno として返す."""
+
+    def __init__(self) -> None:
+        self.server, self.client = socket.socketpair()
+        self.client.setblocking(False)
+        self.executed: list = []
+        self.closed = False
+
+    def execute(self, query, params=None):
+        self.executed.append(str(query))
+
+    def fileno(self) -> int:
+        return self.client.fileno()
+
+    def notifies(self, timeout=None):
+        try:
+            data = self.client.recv(1024)
+        except BlockingIOError:
+            data = b""
+        for _ in data:
+            yield object()
+
+    def close(self) -> None:
+        self.closed = True
+        self.server.close()
+        self.client.close()
+
+    def notify(self, count: int = 1) -> None:
+        self.server.send(b"n" * count)
+
+
+def test_listener_collapses_burst_into_one_wakeup():
+    conn = FakeListenConnection()
+    connect_kwargs = {}
+    wakeups: list[int] = []
+
+    def fake_connect(dsn, **kwargs):
+        connect_kwargs.update(kwargs)
+        return conn
+
+    listener = BacklogNotifyListener(
+        "postgresql://example",
+        on_notify=lambda: wakeups.append(1),
+        connect=fake_connect,
+    ).start()
+    gevent.sleep(0.01)
+
+    assert connect_kwargs == {"autocommit": True}
+    assert any("LISTEN" in query for query in conn.executed)
+    assert len(wakeups) == 1  # initial wake-up covers rows inserted before LISTEN
+
+    conn.notify(5)
+    gevent.sleep(0.01)
+
+    assert len(wakeups) == 2
+    stats = listener.stats()
+    assert stats["notifications"] == 5
+    assert stats["connected"] is True
+
+    listener.stop()
+    assert conn.closed is True
+
+
+def test_listener_reconnects_after_failure():
+    attempts: list[int] = []
+    conn = FakeListenConnection()
+
+    def flaky_connect(dsn, **kwargs):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("connection refused")
+        return conn
+
+    listener = BacklogNotifyListener(
+        "postgresql://example",
+        on_notify=lambda: None,
+        connect=flaky_connect,
+        reconnect_interval=0.001,
+    ).start()
+    gevent.sleep(0.02)
+
+    assert len(attempts) == 2
+    assert listener.stats()["reconnects"] == 1
+    assert listener.stats()["connected"] is True
+    listener.stop()
@@ -2,10 +2,14 @@
 
 from __future__ import annotations
 
+import time
 from typing import Any, Dict, List, Optional, Tuple
 
+import psycopg
+import pytest
+
 from raspberrypiserver.repositories.scans import DatabaseScanRepository
-from raspberrypiserver.services.backlog import BacklogDrainService
+from raspberrypiserver.services.backlog import BacklogDrainService, collapse_latest
 
 
 class _StubCursor:
@@ -24,7 +28,12 @@ class _StubCursor:
         if self._select_mode:
             self._select_mode = False
         else:
-            if "INSERT INTO" in str(query):
+            if "scan_ingest_dead_letter" in str(query):
+                self._conn.quarantined.append(params)
+            elif "part_location_history" in str(query):
+                # 消費（DELETE / 処理済み化）と履歴追記は 1 文
+                self._conn.deleted_ids = params[0]
+            elif "INSERT INTO" in str(query):
                 self._conn.insert_calls.append(params)
             elif "DELETE FROM" in str(query):
                 self._conn.deleted_ids = params[0]
@@ -42,6 +51,7 @@ class _StubConnection:
         self.queries: List[Tuple[Any, Any]] = []
         self.insert_calls: List[Tuple[str, str, Optional[str]]] = []
         self.deleted_ids: List[int] | None = None
+        self.quarantined: List[Tuple[Any, ...]] = []
         self.committed = False
 
     def __enter__(self) -> "_StubConnection":  # noqa: D401
@@ -79,9 +89,8 @@ def test_backlog_drain_upserts_and_deletes() -> None:
 
     assert drained == 2
     assert conn.committed is True
-    assert len(conn.insert_calls) == 2
-    assert conn.insert_calls[0][0:2] == ("ORD-1", "LOC-1")
-    assert conn.insert_calls[1][0:2] == ("ORD-2", "LOC-2")
+    # one set-based upsert carrying the whole batch as arrays
+    assert conn.insert_calls == [(["ORD-1", "ORD-2"], ["LOC-1", "LOC-2"], ["DEV-1", None])]
     assert conn.deleted_ids == [1, 2]
 
 
@@ -101,8 +110,317 @@ def test_backlog_drain_skips_invalid_rows() -> None:
 
     assert drained == 1
     assert conn.deleted_ids == [3]
-    assert len(conn.insert_calls) == 1
-    assert conn.insert_calls[0][0:2] == ("ORD-3", "LOC-3")
+    assert conn.insert_calls == [(["ORD-3"], ["LOC-3"], [None])]
+    # invalid rows move to the dead-letter table in the same transaction
+    assert conn.quarantined == [([1, 2], [1, 2], ["missing-order_code", "missing-location_code"])]
+    assert service.metrics()["quarantined"] == 2
+
+
+def test_backlog_drain_quarantines_batch_of_only_invalid_rows() -> None:
+    conn = _StubConnection([(7, None, None, None)])
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: conn)
+
+    assert service.drain_once(5) == 0
+    assert conn.quarantined == [([7], [7], ["missing-order_code"])]
+    assert conn.insert_calls == []
+    assert conn.committed is True
+
+
+def test_backlog_drain_reuses_composed_statements() -> None:
+    first = _StubConnection([(1, "ORD-1", "LOC-1", None)])
+    second = _StubConnection([(2, "ORD-2", "LOC-2", None)])
+    connections = iter([first, second])
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: next(connections))
+    service.drain_once(5)
+    service.drain_once(5)
+
+    assert [query for query, _ in first.queries] == [query for query, _ in second.queries]
+    assert all(a is b for (a, _), (b, _) in zip(first.queries, second.queries))
+    assert "unnest" in first.queries[-1][0].as_string(None)
+
+
+def test_backlog_drain_collapses_duplicate_order_codes() -> None:
+    rows = [
+        (1, "ORD-1", "LOC-OLD", "DEV-1"),
+        (2, "ORD-2", "LOC-2", None),
+        (3, "ORD-1", "LOC-NEW", "DEV-2"),
+    ]
+    conn = _StubConnection(rows)
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: conn)
+    drained = service.drain_once(10)
+
+    assert drained == 3
+    assert conn.insert_calls == [(["ORD-2", "ORD-1"], ["LOC-2", "LOC-NEW"], [None, "DEV-2"])]
+    assert conn.deleted_ids == [1, 2, 3]
+    metrics = service.metrics()
+    assert metrics["superseded"] == 1
+    assert metrics["upserted"] == 2
+    assert metrics["drained"] == 3
+
+
+def test_backlog_drain_takes_change_seq_lock_last() -> None:
+    conn = _StubConnection([(1, None, "LOC-1", None), (2, "ORD-2", "LOC-2", None)])
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: conn)
+    service.drain_once(10)
+
+    # ロックを取る upsert はコミット直前（隔離・消費・履歴の後）
+    statements = [query.as_string(None) for query, _ in conn.queries]
+    locking = [index for index, text in enumerate(statements) if "pg_advisory_xact_lock" in text]
+    assert locking == [len(statements) - 1]
+    assert conn.committed is True
+
+
+def test_collapse_latest_keeps_last_row_per_order() -> None:
+    rows, superseded = collapse_latest(
+        [
+            (1, "A", "L1", None),
+            (2, "A", "L2", None),
+            (3, "A", "L3", None),
+        ]
+    )
+    assert rows == [(3, "A", "L3", None)]
+    assert superseded == 2
+
+
+def test_backlog_drain_partition_filters_by_order_hash() -> None:
+    conn = _StubConnection([(1, "ORD-1", "LOC-1", None)])
+    service = BacklogDrainService(
+        dsn="postgresql://example",
+        connect=lambda _dsn: conn,
+        partitions=4,
+        partition=2,
+    )
+
+    assert service.drain_once(25) == 1
+
+    select_query, select_params = conn.queries[0]
+    assert "hashtext" in select_query.as_string(None)
+    assert select_params == (4, 2, 25)
+
+
+def test_backlog_drain_selects_typed_columns() -> None:
+    conn = _StubConnection([(1, "ORD-1", "LOC-1", None)])
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: conn)
+    service.drain_once(5)
+
+    select_sql = conn.queries[0][0].as_string(None)
+    assert "SELECT id, order_code, location_code, device_id" in select_sql
+    assert "payload->>" not in select_sql
+
+
+_DRAINED_PARTITIONS = [
+    ("scan_ingest_backlog_p20261001", "FOR VALUES FROM ('2026-10-01') TO ('2026-10-02')", False),
+    ("scan_ingest_backlog_p20261002", "FOR VALUES FROM ('2026-10-02') TO ('2026-10-03')", False),
+]
+
+
+def test_backlog_drain_partitioned_layout_marks_rows_processed() -> None:
+    maintenance = _StatsConnection(
+        {
+            "ensure_scan_backlog_partitions": (1,),
+            "partdefid": ("scan_ingest_backlog_default",),
+            "drained_scan_backlog_partitions": _DRAINED_PARTITIONS,
+            "drop_scan_backlog_partition": (True,),
+        },
+        [],
+    )
+    conn = _StubConnection([(1, "ORD-1", "LOC-1", None), (2, "ORD-2", "LOC-2", None)])
+    connections = iter([maintenance, maintenance, maintenance, conn])
+    service = BacklogDrainService(
+        dsn="postgresql://example",
+        connect=lambda _dsn: next(connections),
+        layout="partitioned",
+    )
+
+    assert service.drain_once(10) == 2
+
+    select_sql = conn.queries[0][0].as_string(None)
+    assert "processed_at IS NULL" in select_sql
+    finalize_sql = conn.queries[1][0].as_string(None)
+    assert "UPDATE \"scan_ingest_backlog\" SET processed_at = NOW()" in finalize_sql
+    assert "DELETE" not in finalize_sql
+    assert conn.queries[1][1] == ([1, 2],)
+    metrics = service.metrics()
+    assert metrics["partitions_created"] == 1
+    assert metrics["partitions_dropped"] == 2
+
+
+def test_partition_maintenance_drops_each_partition_in_its_own_transaction() -> None:
+    log: List[str] = []
+    connects: List[int] = []
+
+    class _BusyConnection(_StatsConnection):
+        def execute(self, query, params=None) -> None:
+            super().execute(query, params)
+            if "drop_scan_backlog_partition" in self._log[-1] and params[0].endswith("1001"):
+                raise psycopg.errors.LockNotAvailable("canceling statement due to lock timeout")
+
+    def fake_connect(_dsn: str) -> _StatsConnection:
+        connects.append(1)
+        return _BusyConnection(
+            {
+                "ensure_scan_backlog_partitions": (0,),
+                "partdefid": ("scan_ingest_backlog_default",),
+                "drained_scan_backlog_partitions": _DRAINED_PARTITIONS,
+                "drop_scan_backlog_partition": (True,),
+            },
+            log,
+        )
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=fake_connect, layout="partitioned")
+
+    assert service.maintain_partitions() == {"created": 0, "dropped": 1}
+    assert len(connects) == 3
+    assert any('DELETE FROM scan_ingest_backlog_default WHERE processed_at IS NOT NULL' in query for query in log)
+    assert not any("LOCK TABLE" in query or "CONCURRENTLY" in query for query in log)
+
+
+def test_partition_maintenance_detaches_concurrently_without_default_partition() -> None:
+    log: List[str] = []
+    connections: List[_StatsConnection] = []
+
+    def fake_connect(_dsn: str) -> _StatsConnection:
+        conn = _StatsConnection(
+            {
+                "ensure_scan_backlog_partitions": (0,),
+                "partdefid": (None,),
+                "drained_scan_backlog_partitions": _DRAINED_PARTITIONS[:1]
+                + [("scan_ingest_backlog_p20261002", _DRAINED_PARTITIONS[1][1], True)],
+                "finish_scan_backlog_partition_detach": (True,),
+            },
+            log,
+        )
+        connections.append(conn)
+        return conn
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=fake_connect, layout="partitioned")
+
+    assert service.maintain_partitions() == {"created": 0, "dropped": 2}
+    assert 'ALTER TABLE "scan_ingest_backlog" DETACH PARTITION scan_ingest_backlog_p20261001 CONCURRENTLY' in log
+    # 中断された CONCURRENTLY は FINALIZE で完了させる
+    assert 'ALTER TABLE "scan_ingest_backlog" DETACH PARTITION scan_ingest_backlog_p20261002 FINALIZE' in log
+    assert not any("DELETE FROM" in query for query in log)
+    assert all(conn.autocommit is False for conn in connections)
+
+
+def test_partition_maintainer_runs_without_draining() -> None:
+    import gevent
+
+    from raspberrypiserver.services import BacklogPartitionMaintainer
+
+    class _Service:
+        calls = 0
+
+        def maintain_partitions(self):
+            self.calls += 1
+            return {"created": 2, "dropped": 0}
+
+    service = _Service()
+    maintainer = BacklogPartitionMaintainer(service, interval=60).start()
+    gevent.sleep(0.01)
+    maintainer.stop()
+
+    assert service.calls == 1
+    assert maintainer.stats()["created"] == 2
+    assert maintainer.stats()["running"] is False
+
+
+def test_backlog_partition_maintenance_runs_on_interval() -> None:
+    log: List[str] = []
+    service = BacklogDrainService(
+        dsn="postgresql://example",
+        connect=lambda _dsn: _StatsConnection({"ensure": (0,), "drop_drained": (0,)}, log),
+        layout="partitioned",
+        partition_granularity="hour",
+        partition_maintenance_interval=3600,
+    )
+
+    service.drain_once(5)
+    service.drain_once(5)
+
+    assert sum("ensure_scan_backlog_partitions" in query for query in log) == 1
+
+
+def test_backlog_service_rejects_unknown_layout() -> None:
+    with pytest.raises(ValueError):
+        BacklogDrainService(dsn="postgresql://example", layout="sharded")
+    with pytest.raises(ValueError):
+        BacklogDrainService(dsn="postgresql://example", layout="partitioned", partition_granularity="week")
+
+
+def test_backlog_drain_appends_history_in_consume_statement() -> None:
+    conn = _StubConnection([(1, "ORD-1", "LOC-1", None)])
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: conn)
+    service.drain_once(5)
+
+    consume_sql = conn.queries[1][0].as_string(None)
+    assert 'DELETE FROM "scan_ingest_backlog"' in consume_sql
+    assert 'INSERT INTO "part_location_history"' in consume_sql
+    assert "received_at" in consume_sql
+
+
+def test_backlog_drain_without_history_only_deletes() -> None:
+    conn = _StubConnection([(1, "ORD-1", "LOC-1", None)])
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: conn, history_table="")
+    service.drain_once(5)
+
+    consume_sql = conn.queries[1][0].as_string(None)
+    assert consume_sql == 'DELETE FROM "scan_ingest_backlog" WHERE id = ANY(%s)'
+    assert conn.deleted_ids == [1]
+
+
+def test_history_repository_keyset_queries() -> None:
+    from datetime import datetime, timezone
+
+    from raspberrypiserver.repositories import DatabasePartLocationHistoryRepository
+
+    log: List[Any] = []
+
+    class _HistoryConnection(_StatsConnection):
+        def cursor(self, row_factory=None):
+            return self
+
+        def execute(self, query, params=None) -> None:
+            log.append((query.as_string(None), params))
+
+        def fetchall(self):
+            return [{"id": 1}]
+
+    repo = DatabasePartLocationHistoryRepository(
+        "postgresql://example", connect=lambda _dsn: _HistoryConnection({}, [])
+    )
+    assert repo.trail("ORD-1", limit=11, before=["2026-10-17T10:00:00+00:00", 5]) == [{"id": 1}]
+    trail_sql, trail_params = log[-1]
+    assert "(moved_at, id) < (%s::timestamptz, %s)" in trail_sql
+    assert trail_params == ("ORD-1", "2026-10-17T10:00:00+00:00", 5, 11)
+
+    start = datetime(2026, 10, 17, tzinfo=timezone.utc)
+    end = datetime(2026, 10, 18, tzinfo=timezone.utc)
+    repo.window(start, end, limit=3, after=["2026-10-17T10:00:00+00:00", 5])
+    window_sql, window_params = log[-1]
+    assert "ORDER BY moved_at, id" in window_sql
+    assert window_params == (start, end, "2026-10-17T10:00:00+00:00", "2026-10-17T10:00:00+00:00", 5, 3)
+
+
+def test_backlog_drain_notifies_on_upsert() -> None:
+    bumps: List[int] = []
+    conn = _StubConnection([(1, "ORD-1", "LOC-1", None), (2, "ORD-1", "LOC-2", None)])
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: conn, on_upsert=bumps.append)
+
+    service.drain_once(5)
+    assert bumps == [1]
+
+    empty = _StubConnection([])
+    service._connect = lambda _dsn: empty  # noqa: SLF001
+    service.drain_once(5)
+    assert bumps == [1]
+
+
+def test_backlog_drain_rejects_invalid_partition() -> None:
+    with pytest.raises(ValueError):
+        BacklogDrainService(dsn="postgresql://example", partitions=2, partition=2)
 
 
 def test_backlog_drain_handles_empty_selection() -> None:
@@ -131,6 +449,7 @@ def test_backlog_drain_handles_exception() -> None:
 
     service = BacklogDrainService(dsn="postgresql://example", connect=failing_connect)
     assert service.drain_once(25) == 0
+    assert service.metrics()["failures"] == 1
 
 
 class _RepoCursor:
@@ -147,6 +466,11 @@ class _RepoCursor:
         self._store["query"] = query
         self._store["params"] = params
 
+    def fetchall(self) -> List[tuple]:
+        conflicts = self._store.get("conflicts", set())
+        scan_ids = [(param.obj.get("metadata") or {}).get("scan_id") for param in self._store["params"]]
+        return [(scan_id,) for scan_id in scan_ids if scan_id not in conflicts]
+
 
 class _RepoConnection:
     def __init__(self, store: Dict[str, Any]) -> None:
@@ -219,3 +543,343 @@ def test_backlog_count_returns_pending() -> None:
 def test_backlog_count_skips_when_unconfigured() -> None:
     service = BacklogDrainService(dsn="")
     assert service.count_backlog() == 0
+
+
+class _StatsConnection:
+    """Answer backlog stats queries by matching a fragment of the SQL text."""
+
+    rowcount = 0
+
+    def __init__(self, answers: Dict[str, Any], log: List[str]) -> None:
+        self._answers = answers
+        self._log = log
+        self._last: Any = None
+        self.autocommit = False
+
+    def __enter__(self) -> "_StatsConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    def cursor(self) -> "_StatsConnection":
+        return self
+
+    def execute(self, query, params=None) -> None:
+        text = query.as_string(None) if hasattr(query, "as_string") else str(query)
+        self._log.append(text)
+        self._last = next((value for key, value in self._answers.items() if key in text), None)
+
+    def fetchone(self):
+        return self._last
+
+    def fetchall(self):
+        return self._last if isinstance(self._last, list) else []
+
+    def commit(self) -> None:
+        pass
+
+
+def _stats_service(answers: Dict[str, Any], **kwargs) -> Tuple[BacklogDrainService, List[str], List[int]]:
+    log: List[str] = []
+    connects: List[int] = []
+
+    def fake_connect(_dsn: str) -> _StatsConnection:
+        connects.append(1)
+        return _StatsConnection(answers, log)
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=fake_connect, **kwargs)
+    return service, log, connects
+
+
+def test_backlog_stats_reads_counter_and_caches() -> None:
+    service, log, connects = _stats_service(
+        {"scan_ingest_backlog_stats": (12,), "EXTRACT(EPOCH": (4.5,)},
+        stats_ttl=60,
+    )
+
+    first = service.backlog_stats()
+    second = service.backlog_stats()
+
+    assert first == {"pending": 12, "pending_mode": "counter", "oldest_pending_age_seconds": 4.5}
+    assert second == first
+    assert len(connects) == 1
+    assert not any("COUNT(*)" in query for query in log)
+
+
+def test_backlog_stats_counter_adds_uncompacted_deltas() -> None:
+    service, log, _ = _stats_service({"scan_ingest_backlog_stats": (3,), "EXTRACT(EPOCH": (None,)})
+
+    service.backlog_stats()
+
+    counter_sql = next(query for query in log if "scan_ingest_backlog_stats" in query)
+    assert 'SUM(d.delta) FROM "scan_ingest_backlog_stats_delta"' in counter_sql
+    assert "UPDATE" not in counter_sql
+
+
+def test_backlog_drain_compacts_counter_deltas_on_interval(monkeypatch) -> None:
+    log: List[str] = []
+    service = BacklogDrainService(
+        dsn="postgresql://example",
+        connect=lambda _dsn: _StatsConnection({"DELETE FROM \"scan_ingest_backlog_stats_delta\"": (4,)}, log),
+        stats_compact_interval=30,
+    )
+    clock = [time.monotonic()]
+    monkeypatch.setattr("raspberrypiserver.services.backlog.time.monotonic", lambda: clock[0])
+
+    service.drain_once(5)
+    assert not any("stats_delta" in query for query in log)
+
+    clock[0] += 31
+    service.drain_once(5)
+    service.drain_once(5)
+
+    compactions = [query for query in log if 'DELETE FROM "scan_ingest_backlog_stats_delta"' in query]
+    assert len(compactions) == 1
+    assert "ON CONFLICT (table_name) DO UPDATE" in compactions[0]
+
+
+def test_backlog_drain_skips_compaction_outside_counter_mode(monkeypatch) -> None:
+    log: List[str] = []
+    service = BacklogDrainService(
+        dsn="postgresql://example",
+        connect=lambda _dsn: _StatsConnection({}, log),
+        count_mode="estimate",
+        stats_compact_interval=0,
+    )
+
+    service.drain_once(5)
+
+    assert not any("stats_delta" in query for query in log)
+
+
+def test_backlog_stats_exact_bypasses_cache_and_uses_table_name() -> None:
+    service, log, connects = _stats_service(
+        {"scan_ingest_backlog_stats": (12,), "COUNT(*)": (9,), "EXTRACT(EPOCH": (None,)},
+        backlog_table="custom_backlog",
+    )
+    service.backlog_stats()
+
+    stats = service.backlog_stats(exact=True)
+
+    assert stats == {"pending": 9, "pending_mode": "exact", "oldest_pending_age_seconds": None}
+    assert len(connects) == 2
+    assert any('COUNT(*) FROM "custom_backlog"' in query for query in log)
+    assert not any("FROM scan_ingest_backlog " in query for query in log)
+
+
+def test_backlog_stats_falls_back_when_counter_missing() -> None:
+    service, _, _ = _stats_service({"scan_ingest_backlog_stats": None, "COUNT(*)": (5,)})
+    assert service.backlog_stats()["pending_mode"] == "exact"
+    assert service.count_backlog() == 5
+
+
+def test_backlog_stats_estimate_uses_reltuples() -> None:
+    service, _, _ = _stats_service({"reltuples": (1000,)}, count_mode="estimate")
+    stats = service.backlog_stats()
+    assert stats["pending"] == 1000
+    assert stats["pending_mode"] == "estimate"
+
+
+def test_backlog_stats_single_flight() -> None:
+    import gevent
+
+    calls: List[int] = []
+
+    def slow_connect(_dsn: str) -> _StatsConnection:
+        calls.append(1)
+        gevent.sleep(0.01)
+        return _StatsConnection({"scan_ingest_backlog_stats": (3,)}, [])
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=slow_connect)
+
+    results = [g.value for g in gevent.joinall([gevent.spawn(service.count_backlog) for _ in range(5)])]
+
+    assert results == [3] * 5
+    assert len(calls) == 1
+
+
+def test_backlog_stats_keeps_last_value_when_refresh_fails() -> None:
+    import gevent
+
+    state = {"fail": False}
+
+    def flaky_connect(_dsn: str) -> _StatsConnection:
+        if state["fail"]:
+            gevent.sleep(0.01)
+            raise psycopg.OperationalError("connection refused")
+        return _StatsConnection({"scan_ingest_backlog_stats": (7,), "EXTRACT(EPOCH": (1.0,)}, [])
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=flaky_connect, stats_ttl=0)
+    assert service.backlog_stats()["pending"] == 7
+
+    state["fail"] = True
+    results = [g.value for g in gevent.joinall([gevent.spawn(service.backlog_stats) for _ in range(3)])]
+
+    assert all(result["pending"] == 7 and result["stale"] is True for result in results)
+
+
+def test_backlog_stats_reports_unavailable_without_any_value() -> None:
+    def failing_connect(_dsn: str):
+        raise psycopg.OperationalError("connection refused")
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=failing_connect)
+
+    assert service.backlog_stats()["pending_mode"] == "unavailable"
+
+
+def test_counter_table_follows_backlog_table() -> None:
+    service, log, _ = _stats_service({"custom_backlog_stats": (4,)}, backlog_table="custom_backlog")
+
+    assert service.backlog_stats()["pending"] == 4
+    assert any('FROM "custom_backlog_stats"' in query for query in log)
+
+
+def test_dead_letter_count_is_cached_until_requeue() -> None:
+    service, log, connects = _stats_service({"COUNT(*)": (2,)}, stats_ttl=60)
+
+    assert service.count_dead_letters() == 2
+    assert service.count_dead_letters() == 2
+    assert len(connects) == 1
+
+    service.requeue_dead_letters([1])
+    service.count_dead_letters()
+    assert len(connects) == 3
+
+
+def test_backlog_service_rejects_unknown_count_mode() -> None:
+    with pytest.raises(ValueError):
+        BacklogDrainService(dsn="postgresql://example", count_mode="approximate")
+
+
+def test_database_scan_repository_save_many_uses_single_insert() -> None:
+    calls: Dict[str, Any] = {"connects": 0}
+
+    def fake_connect(_dsn: str) -> _RepoConnection:
+        calls["connects"] += 1
+        return _RepoConnection(calls)
+
+    repo = DatabaseScanRepository(
+        dsn="postgresql://example",
+        buffer_size=10,
+        connect_factory=fake_connect,
+    )
+    payloads = [
+        {"order_code": "BATCH-1", "location_code": "RACK-A1"},
+        {"order_code": "BATCH-2", "location_code": "RACK-A2"},
+        {"order_code": "BATCH-3", "location_code": "RACK-A3"},
+    ]
+
+    repo.save_many(payloads)
+
+    assert calls["connects"] == 1
+    assert calls["committed"] is True
+    assert [param.obj["order_code"] for param in calls["params"]] == ["BATCH-1", "BATCH-2", "BATCH-3"]
+    assert [item["order_code"] for item in repo.recent(5)] == ["BATCH-1", "BATCH-2", "BATCH-3"]
+
+
+def test_database_scan_repository_returns_only_rows_that_survive_on_conflict() -> None:
+    calls: Dict[str, Any] = {"conflicts": {"S-2"}}
+    repo = DatabaseScanRepository(
+        dsn="postgresql://example",
+        connect_factory=lambda _dsn: _RepoConnection(calls),
+    )
+    payloads = [
+        {"order_code": "C-1", "location_code": "RACK-A1", "metadata": {"scan_id": "S-1"}},
+        {"order_code": "C-2", "location_code": "RACK-A1", "metadata": {"scan_id": "S-2"}},
+        {"order_code": "C-3", "location_code": "RACK-A1"},
+    ]
+
+    stored = repo.save_many(payloads)
+
+    assert "RETURNING" in calls["query"].as_string(None)
+    assert [item["order_code"] for item in stored] == ["C-1", "C-3"]
+    assert [item["order_code"] for item in repo.recent(5)] == ["C-1", "C-3"]
+    assert repo.stats()["conflicts"] == 1
+    assert repo.save(payloads[1]) is False
+
+
+def test_database_scan_repository_does_not_buffer_failed_inserts() -> None:
+    def failing_connect(_dsn: str):
+        raise psycopg.errors.UndefinedTable("scan_ingest_backlog")
+
+    repo = DatabaseScanRepository(dsn="postgresql://example", connect_factory=failing_connect)
+
+    with pytest.raises(psycopg.errors.UndefinedTable):
+        repo.save({"order_code": "LOST", "location_code": "RACK-A1"})
+    assert list(repo.recent(5)) == []
+
+
+def test_database_scan_repository_partitioned_layout_skips_scan_id_conflict() -> None:
+    calls: Dict[str, Any] = {}
+    repo = DatabaseScanRepository(
+        dsn="postgresql://example",
+        connect_factory=lambda _dsn: _RepoConnection(calls),
+        layout="partitioned",
+    )
+
+    repo.save({"order_code": "P-1", "location_code": "RACK-A1"})
+
+    statement = calls["query"].as_string(None)
+    assert "INSERT INTO scan_ingest_backlog" in statement
+    assert "ON CONFLICT" not in statement
+
+
+def test_requeue_dead_letters_merges_patch() -> None:
+    store: Dict[str, Any] = {"queries": []}
+
+    class _RequeueCursor(_RepoCursor):
+        def execute(self, query, params=None) -> None:
+            super().execute(query, params)
+            self._store["queries"].append((query.as_string(None), params))
+
+        def fetchall(self):
+            if len(self._store["queries"]) == 1:
+                return [
+                    (4, {"order_code": "ORD-4", "location_code": "RACK-A1"}),
+                    (5, {"order_code": "ORD-5", "location_code": "RACK-A1"}),
+                ]
+            return [(4,), (5,)]
+
+    class _RequeueConnection(_RepoConnection):
+        def cursor(self) -> _RequeueCursor:
+            return _RequeueCursor(self._store)
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: _RequeueConnection(store))
+    requeued = service.requeue_dead_letters([4, 5], patch={"location_code": "RACK-A1"})
+
+    assert requeued == 2
+    assert store["committed"] is True
+    patch, ids = store["params"]
+    assert ids == [4, 5]
+    assert patch.obj == {"location_code": "RACK-A1"}
+    requeue_sql = store["queries"][1][0]
+    # dead-letter から消すのは backlog へ実際に入った行だけ
+    assert "RETURNING payload, received_at" in requeue_sql
+    assert requeue_sql.index("INSERT INTO") < requeue_sql.index('DELETE FROM "scan_ingest_dead_letter"')
+
+
+def test_requeue_dead_letters_rejects_rows_still_invalid_after_patch() -> None:
+    from raspberrypiserver.services import DeadLetterStillInvalid
+
+    store: Dict[str, Any] = {}
+
+    class _InvalidCursor(_RepoCursor):
+        def fetchall(self):
+            return [
+                (4, {"order_code": "ORD-4", "location_code": "RACK-A1"}),
+                (5, {"order_code": " ", "location_code": "RACK-A1"}),
+            ]
+
+    class _InvalidConnection(_RepoConnection):
+        def cursor(self) -> _InvalidCursor:
+            return _InvalidCursor(self._store)
+
+    service = BacklogDrainService(dsn="postgresql://example", connect=lambda _dsn: _InvalidConnection(store))
+
+    with pytest.raises(DeadLetterStillInvalid) as excinfo:
+        service.requeue_dead_letters([4, 5], patch={"location_code": "RACK-A1"})
+
+    assert excinfo.value.reasons == {5: "missing-order_code"}
+    assert store["committed"] is False
+    assert "FOR UPDATE" in store["query"].as_string(None)
\ No newline at end of file
@@ -0,0 +1,146 @@
+from contextlib import contextmanager
+from pathlib import Path
+
+import psycopg
+import pytest
+import tomli_w
+
+from raspberrypiserver.app import create_app, initialize_services, load_configuration
+from raspberrypiserver.database import CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FlakyConnect:
+    """`connect(dsn)` stand-in that fails while `down` is set."""
+
+    def __init__(self) -> None:
+        self.down = False
+        self.calls = 0
+
+    @contextmanager
+    def __call__(self, dsn=None):
+        self.calls += 1
+        if self.down:
+            raise psycopg.OperationalError("connection refused")
+        yield object()
+
+
+def _guarded(threshold: int = 2, interval: float = 5.0):
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=threshold, probe_interval=interval, clock=clock)
+    inner = FlakyConnect()
+    return breaker, breaker.wrap(inner), inner, clock
+
+
+def _attempt(connect) -> None:
+    with connect("postgresql://db"):
+        pass
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast() -> None:
+    breaker, connect, inner, _clock = _guarded(threshold=2)
+    inner.down = True
+
+    for _ in range(2):
+        with pytest.raises(psycopg.OperationalError):
+            _attempt(connect)
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        _attempt(connect)
+    assert inner.calls == 2  # open の間は接続を試みない
+    stats = breaker.stats()
+    assert stats["rejected"] == 1
+    assert stats["opened"] == 1
+    assert stats["retry_in_seconds"] == 5.0
+    assert "connection refused" in stats["last_error"]
+
+
+def test_half_open_probe_closes_breaker_on_success() -> None:
+    breaker, connect, inner, clock = _guarded(threshold=1)
+    inner.down = True
+    with pytest.raises(psycopg.OperationalError):
+        _attempt(connect)
+
+    inner.down = False
+    clock.now = 5.0
+    assert breaker.state == "half_open"
+    _attempt(connect)
+
+    assert breaker.state == "closed"
+    assert breaker.stats()["probes"] == 1
+    _attempt(connect)
+    assert inner.calls == 3
+
+
+def test_failed_probe_reopens_breaker() -> None:
+    breaker, connect, inner, clock = _guarded(threshold=1)
+    inner.down = True
+    with pytest.raises(psycopg.OperationalError):
+        _attempt(connect)
+
+    clock.now = 5.0
+    with pytest.raises(psycopg.OperationalError):
+        _attempt(connect)
+    assert breaker.state == "open"
+    assert breaker.stats()["retry_in_seconds"] == 5.0
+    with pytest.raises(CircuitOpenError):
+        _attempt(connect)
+
+
+def test_sql_errors_do_not_trip_breaker() -> None:
+    breaker, connect, _inner, _clock = _guarded(threshold=1)
+
+    with pytest.raises(psycopg.errors.UndefinedTable):
+        with connect("postgresql://db"):
+            raise psycopg.errors.UndefinedTable("missing")
+
+    assert breaker.state == "closed"
+
+
+def test_healthz_reports_breaker_state(tmp_path: Path) -> None:
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "database": {"dsn": "postgresql://app:app@db/sensordb", "breaker_failures": 1},
+        },
+        config_path.open("wb"),
+    )
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+    client = app.test_client()
+
+    body = client.get("/healthz").get_json()
+    assert body["status"] == "ok"
+    assert body["database"]["state"] == "closed"
+
+    app.config["DB_CIRCUIT_BREAKER"].record_failure(psycopg.OperationalError("down"))
+    body = client.get("/healthz").get_json()
+    assert body["status"] == "degraded"
+    assert body["database"]["state"] == "open"
+
+
+def test_breaker_can_be_disabled(tmp_path: Path) -> None:
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "database": {"dsn": "postgresql://app:app@db/sensordb", "breaker_failures": 0},
+        },
+        config_path.open("wb"),
+    )
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+
+    assert app.config["DB_CIRCUIT_BREAKER"] is None
+    assert "database" not in app.test_client().get("/healthz").get_json()
@@ -0,0 +1,223 @@
+"""共有コネクションプールのテスト."""
+
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import pytest
+import tomli_w
+
+from raspberrypiserver.app import create_app, initialize_services, load_configuration
+from raspberrypiserver.database import ConnectionPool, PoolTimeout
+
+
+class _PoolCursor:
+    def __init__(self, conn: "_PoolConnection") -> None:
+        self._conn = conn
+
+    def __enter__(self) -> "_PoolCursor":  # noqa: D401
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:  # noqa: D401
+        pass
+
+    def execute(self, query, params=None) -> None:
+        if self._conn.fail_check:
+            raise RuntimeError("server closed the connection")
+        self._conn.queries.append(query)
+
+
+class _PoolConnection:
+    def __init__(self) -> None:
+        self.queries: list = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        self.fail_check = False
+        self.fail_commit = False
+
+    def cursor(self) -> _PoolCursor:
+        return _PoolCursor(self)
+
+    def commit(self) -> None:
+        if self.fail_commit:
+            raise RuntimeError("could not commit")
+        self.commits += 1
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def _pool(**kwargs) -> tuple[ConnectionPool, list[_PoolConnection]]:
+    opened: list[_PoolConnection] = []
+
+    def fake_connect(_dsn: str) -> _PoolConnection:
+        conn = _PoolConnection()
+        opened.append(conn)
+        return conn
+
+    return ConnectionPool("postgresql://example", connect=fake_connect, **kwargs), opened
+
+
+def test_pool_reuses_connection_and_commits_on_exit() -> None:
+    pool, opened = _pool(max_size=2)
+
+    with pool.connect("postgresql://example") as conn:
+        assert pool.stats()["in_use"] == 1
+    with pool.connect() as again:
+        assert again is conn
+
+    assert len(opened) == 1
+    assert conn.commits == 2
+    stats = pool.stats()
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+    assert stats["requests"] == 2
+
+
+def test_pool_rolls_back_on_error() -> None:
+    pool, opened = _pool()
+
+    with pytest.raises(ValueError):
+        with pool.connect():
+            raise ValueError("boom")
+
+    assert opened[0].rollbacks == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_pool_times_out_when_exhausted() -> None:
+    pool, _ = _pool(max_size=1, timeout=0.01)
+
+    with pool.connect():
+        with pytest.raises(PoolTimeout):
+            with pool.connect():
+                pass
+
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["requests_waited"] == 1
+    assert stats["waiting"] == 0
+    assert stats["wait_time_ms"] > 0
+
+
+def test_pool_discards_connection_failing_health_check() -> None:
+    pool, opened = _pool(check_interval=0)
+
+    with pool.connect() as conn:
+        pass
+    conn.fail_check = True
+
+    with pool.connect() as fresh:
+        assert fresh is not conn
+
+    assert conn.closed is True
+    assert len(opened) == 2
+    assert pool.stats()["connections_discarded"] == 1
+
+
+def test_pool_closes_connections_idle_beyond_max_idle() -> None:
+    pool, opened = _pool(min_size=0, max_idle=0.001, check_interval=-1)
+
+    with pool.connect():
+        pass
+    time.sleep(0.005)
+    with pool.connect():
+        pass
+
+    assert opened[0].closed is True
+    assert pool.stats()["size"] == 1
+
+
+def test_pool_reaps_expired_idle_connections_on_checkin() -> None:
+    pool, opened = _pool(min_size=0, max_size=3, max_idle=0.01, check_interval=-1)
+
+    with pool.connect(), pool.connect():
+        pass
+    time.sleep(0.02)
+    # the LIFO keeps reusing the newest connection; the older one is reaped on the next return
+    with pool.connect():
+        pass
+
+    assert sum(conn.closed for conn in opened) == 2
+    assert pool.stats()["idle"] == 1
+
+
+def test_pool_discards_connection_and_raises_when_commit_fails() -> None:
+    pool, opened = _pool()
+
+    with pytest.raises(RuntimeError, match="could not commit"):
+        with pool.connect() as conn:
+            conn.fail_commit = True
+
+    assert conn.closed is True
+    stats = pool.stats()
+    assert stats["idle"] == 0
+    assert stats["in_use"] == 0
+    assert stats["connections_discarded"] == 1
+
+
+def test_db_backend_shares_pool_and_exposes_stats(tmp_path: Path) -> None:
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "database": {"dsn": "postgresql://app:app@db/sensordb", "pool_max_size": 3},
+        },
+        config_path.open("wb"),
+    )
+
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+
+    pool = app.config["DB_POOL"]
+    assert isinstance(pool, ConnectionPool)
+    assert pool.max_size == 3
+    connect = app.config["SCAN_REPOSITORY"]._connect_factory  # noqa: SLF001
+    assert connect.connect == pool.connect
+    assert connect.breaker is app.config["DB_CIRCUIT_BREAKER"]
+    assert app.config["BACKLOG_DRAIN_SERVICE"]._connect is connect  # noqa: SLF001
+    assert app.config["PART_LOCATION_REPOSITORY"].inner._connect is connect  # noqa: SLF001
+
+    resp = app.test_client().get("/api/v1/admin/db-pool")
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["status"] == "ok"
+    assert body["pool"]["max_size"] == 3
+    assert body["pool"]["in_use"] == 0
+
+
+def test_db_pool_endpoint_disabled_for_memory_backend() -> None:
+    app = create_app()
+    resp = app.test_client().get("/api/v1/admin/db-pool")
+    assert resp.get_json() == {"status": "disabled"}
+
+
+def test_reinitialize_flushes_previous_repository_before_closing_pool(tmp_path: Path) -> None:
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "SCAN_REPOSITORY_DURABILITY": "async",
+            "SCAN_REPOSITORY_FLUSH_INTERVAL_MS": 60000,
+            "database": {"dsn": "postgresql://app:app@db/sensordb"},
+        },
+        config_path.open("wb"),
+    )
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+    pool = app.config["DB_POOL"]
+    opened: list[_PoolConnection] = []
+    pool._connect = lambda _dsn: opened.append(_PoolConnection()) or opened[-1]  # noqa: SLF001
+    app.config["SCAN_REPOSITORY"].save({"order_code": "LAST", "location_code": "L"})
+
+    initialize_services(app)
+
+    assert opened and "INSERT INTO scan_ingest_backlog" in opened[0].queries[0].as_string(None)
+    assert opened[0].closed is True
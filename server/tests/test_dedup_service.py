@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from raspberrypiserver.services.dedup import ScanDeduplicator, extract_scan_id
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_check_and_add_detects_repeat():
+    dedup = ScanDeduplicator(capacity=10, ttl=60)
+
+    assert dedup.check_and_add("a") is False
+    assert dedup.check_and_add("a") is True
+    assert dedup.stats()["hits"] == 1
+    assert dedup.stats()["misses"] == 1
+
+
+def test_seen_does_not_record_until_added():
+    dedup = ScanDeduplicator(capacity=10, ttl=60)
+
+    assert dedup.seen("a") is False
+    assert dedup.seen("a") is False
+    dedup.add("a")
+    assert dedup.seen("a") is True
+    assert len(dedup) == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    dedup = ScanDeduplicator(capacity=10, ttl=30, clock=clock)
+
+    dedup.check_and_add("a")
+    clock.now = 31
+    assert dedup.check_and_add("a") is False
+
+
+def test_capacity_evicts_least_recently_seen():
+    dedup = ScanDeduplicator(capacity=2, ttl=60)
+
+    dedup.check_and_add("a")
+    dedup.check_and_add("b")
+    dedup.check_and_add("a")  # refresh a
+    dedup.check_and_add("c")  # evicts b
+
+    assert len(dedup) == 2
+    assert dedup.check_and_add("a") is True
+    assert dedup.check_and_add("b") is False
+    assert dedup.stats()["evicted"] >= 1
+
+
+def test_extract_scan_id_normalizes_value():
+    assert extract_scan_id({"metadata": {"scan_id": " ABC-1 "}}) == "abc-1"
+    assert extract_scan_id({"metadata": {"scan_id": 5}}) is None
+    assert extract_scan_id({"order_code": "X"}) is None
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import gevent
+
+from raspberrypiserver.services.drain_trigger import DrainTrigger
+
+
+class FakeDrain:
+    def __init__(self, limit: int = 200) -> None:
+        self.limit = limit
+        self.calls: list[int] = []
+
+    def drain_once(self, limit=None) -> int:
+        self.calls.append(limit)
+        return limit
+
+
+def test_signals_are_coalesced_into_one_run():
+    service = FakeDrain()
+    trigger = DrainTrigger(service, per_signal=10, min_interval=0)
+
+    for _ in range(5):
+        trigger.signal()
+    gevent.sleep(0.01)
+
+    assert service.calls == [50]
+    assert trigger.stats()["runs"] == 1
+    assert trigger.stats()["signals"] == 5
+    trigger.stop()
+
+
+def test_run_size_is_capped_by_max_batch():
+    service = FakeDrain(limit=30)
+    trigger = DrainTrigger(service, per_signal=10, min_interval=0)
+
+    for _ in range(10):
+        trigger.signal()
+    gevent.sleep(0.01)
+
+    assert service.calls == [30, 30, 30, 10]
+    trigger.stop()
+
+
+def test_capped_burst_is_carried_over_until_drained():
+    service = FakeDrain()
+    trigger = DrainTrigger(service, per_signal=1, min_interval=0, max_batch=10)
+
+    for _ in range(50):
+        trigger.signal()
+    gevent.sleep(0.01)
+
+    assert service.calls == [10] * 5
+    assert trigger.stats()["drained"] == 50
+    assert trigger.stats()["owed_rows"] == 0
+    trigger.stop()
+
+
+def test_carry_over_stops_when_backlog_runs_dry():
+    class ShortBacklog(FakeDrain):
+        def drain_once(self, limit=None) -> int:
+            self.calls.append(limit)
+            return min(limit, 4)
+
+    service = ShortBacklog()
+    trigger = DrainTrigger(service, per_signal=1, min_interval=0, max_batch=10)
+
+    for _ in range(50):
+        trigger.signal()
+    gevent.sleep(0.01)
+
+    assert service.calls == [10]
+    assert trigger.stats()["owed_rows"] == 0
+    trigger.stop()
+
+
+def test_min_interval_delays_follow_up_runs():
+    service = FakeDrain()
+    trigger = DrainTrigger(service, per_signal=1, min_interval=0.05, max_batch=100)
+
+    trigger.signal()
+    gevent.sleep(0.01)
+    trigger.signal()
+    trigger.signal()
+    gevent.sleep(0.01)
+    assert service.calls == [1]
+
+    gevent.sleep(0.06)
+    assert service.calls == [1, 2]
+    trigger.stop()
+
+
+def test_initialize_services_builds_trigger_once(tmp_path):
+    import tomli_w
+
+    from raspberrypiserver.app import create_app, initialize_services, load_configuration, shutdown_services
+
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "AUTO_DRAIN_ON_INGEST": 25,
+            "AUTO_DRAIN_MAX_BATCH": 100,
+            "database": {"dsn": "postgresql://app:app@db/sensordb"},
+        },
+        config_path.open("wb"),
+    )
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+
+    trigger = app.config["BACKLOG_DRAIN_TRIGGER"]
+    assert isinstance(trigger, DrainTrigger)
+    assert trigger.service is app.config["BACKLOG_DRAIN_SERVICE"]
+    assert (trigger.per_signal, trigger.max_batch) == (25, 100)
+
+    initialize_services(app)
+    assert app.config["BACKLOG_DRAIN_TRIGGER"] is not trigger
+    shutdown_services(app)
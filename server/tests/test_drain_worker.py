@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import gevent
+import tomli_w
+
+from raspberrypiserver.app import create_app, initialize_services, load_configuration, shutdown_services
+from raspberrypiserver.services.drain_worker import DrainWorker
+
+
+class FakeDrain:
+    def __init__(self, pending: int, duration: float = 0.0) -> None:
+        self.pending = pending
+        self.duration = duration
+        self.calls: list[int] = []
+        self.last_run = {"quarantined": 0}
+
+    def drain_once(self, limit=None) -> int:
+        self.calls.append(limit)
+        if self.duration:
+            gevent.sleep(self.duration)
+        drained = min(limit, self.pending)
+        self.pending -= drained
+        return drained
+
+    def count_backlog(self) -> int:
+        return self.pending
+
+    def oldest_pending_age(self):
+        return 1.5 if self.pending else None
+
+
+def test_batch_grows_additively_while_runs_are_fast_and_full():
+    service = FakeDrain(pending=1000)
+    worker = DrainWorker(service, max_batch=100, min_batch=10, increase_step=10)
+
+    for _ in range(3):
+        assert worker.step() is True
+
+    assert service.calls == [10, 20, 30]
+    assert worker.batch_size == 40
+    assert worker.stats()["lag_seconds"] == 1.5
+
+
+def test_batch_halves_when_run_is_slow():
+    service = FakeDrain(pending=1000, duration=0.02)
+    worker = DrainWorker(service, max_batch=100, min_batch=10, target_duration=0.001)
+    worker.batch_size = 80
+
+    worker.step()
+
+    assert worker.batch_size == 40
+
+
+def test_batch_size_is_bounded_by_drain_limit():
+    service = FakeDrain(pending=10_000)
+    worker = DrainWorker(service, max_batch=50, min_batch=10, increase_step=30)
+
+    for _ in range(5):
+        worker.step()
+
+    assert worker.batch_size == 50
+    assert max(service.calls) == 50
+
+
+def test_worker_sleeps_when_empty_and_wakes_on_signal():
+    service = FakeDrain(pending=15)
+    worker = DrainWorker(service, max_batch=100, min_batch=10, idle_interval=60).start()
+
+    gevent.sleep(0.01)
+    assert service.pending == 0
+    runs = worker.stats()["runs"]
+    assert worker.stats()["idle_sleeps"] == 1
+
+    service.pending = 5
+    worker.signal()
+    gevent.sleep(0.01)
+
+    assert service.pending == 0
+    assert worker.stats()["runs"] == runs + 1
+    assert worker.stats()["running"] is True
+    worker.stop()
+    gevent.sleep(0)
+    assert worker.stats()["running"] is False
+
+
+def test_signal_during_drain_is_not_lost():
+    service = FakeDrain(pending=5, duration=0.02)
+    worker = DrainWorker(service, max_batch=100, min_batch=10, idle_interval=60).start()
+
+    gevent.sleep(0.005)  # 1 回目のドレイン中
+    assert len(service.calls) == 1
+    service.pending += 3
+    worker.signal()
+    gevent.sleep(0.06)
+
+    assert service.pending == 0
+    assert len(service.calls) == 2
+    worker.stop()
+
+
+def test_create_app_starts_worker_when_enabled(tmp_path):
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "BACKLOG_DRAIN_LIMIT": 80,
+            "BACKLOG_DRAIN_WORKER_ENABLED": True,
+            "database": {"dsn": "postgresql://app:app@db/sensordb"},
+        },
+        config_path.open("wb"),
+    )
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+
+    worker = app.config["BACKLOG_DRAIN_WORKER"]
+    assert isinstance(worker, DrainWorker)
+    assert worker.max_batch == 80
+    shutdown_services(app)
+    assert worker.stats()["running"] is False
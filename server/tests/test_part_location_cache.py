@@ -0,0 +1,135 @@
+"""CachedPartLocationRepository のテスト."""
+
+from __future__ import annotations
+
+from typing import List
+
+import gevent
+from flask.testing import FlaskClient
+
+from raspberrypiserver.app import create_app
+from raspberrypiserver.repositories import CachedPartLocationRepository
+
+
+class CountingRepo:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.calls: List[int] = []
+        self.delay = delay
+        self.rows = [{"order_code": "A", "location_code": "R1"}]
+
+    def list(self, limit: int = 200):
+        self.calls.append(limit)
+        if self.delay:
+            gevent.sleep(self.delay)
+        return list(self.rows)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cache_serves_hits_until_version_bump() -> None:
+    inner = CountingRepo()
+    cache = CachedPartLocationRepository(inner, ttl=60)
+
+    assert cache.list(10) == inner.rows
+    assert cache.list(10) == inner.rows
+    assert inner.calls == [10]
+
+    inner.rows = [{"order_code": "A", "location_code": "R2"}]
+    cache.bump(1)
+    assert cache.list(10)[0]["location_code"] == "R2"
+    assert inner.calls == [10, 10]
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["version"]) == (1, 2, 1)
+
+
+def test_cache_keys_by_query_shape_and_expires() -> None:
+    inner = CountingRepo()
+    clock = FakeClock()
+    cache = CachedPartLocationRepository(inner, ttl=5, clock=clock)
+
+    cache.list(10)
+    cache.list(20)
+    cache.list(10)
+    assert inner.calls == [10, 20]
+
+    clock.now += 6
+    cache.list(10)
+    assert inner.calls == [10, 20, 10]
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    inner = CountingRepo()
+    cache = CachedPartLocationRepository(inner, ttl=60, max_entries=2)
+
+    cache.list(1)
+    cache.list(2)
+    cache.list(1)
+    cache.list(3)  # evicts limit=2
+    cache.list(1)
+    cache.list(2)
+
+    assert inner.calls == [1, 2, 3, 2]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_cache_coalesces_concurrent_misses() -> None:
+    inner = CountingRepo(delay=0.01)
+    cache = CachedPartLocationRepository(inner, ttl=60)
+
+    greenlets = [gevent.spawn(cache.list, 50) for _ in range(5)]
+    gevent.joinall(greenlets)
+
+    assert all(g.value == inner.rows for g in greenlets)
+    assert inner.calls == [50]
+
+
+def test_cached_results_are_copies() -> None:
+    cache = CachedPartLocationRepository(CountingRepo(), ttl=60)
+    cache.list(5).clear()
+    assert len(cache.list(5)) == 1
+
+
+def test_part_location_cache_status_endpoint() -> None:
+    app = create_app()
+    client: FlaskClient = app.test_client()
+    assert client.get("/api/v1/admin/part-location-cache").get_json() == {"status": "disabled"}
+
+    cache = CachedPartLocationRepository(CountingRepo(), ttl=60)
+    app.config["PART_LOCATION_REPOSITORY"] = cache
+    client.get("/api/v1/part-locations?limit=5")
+    client.get("/api/v1/part-locations?limit=5")
+
+    body = client.get("/api/v1/admin/part-location-cache").get_json()
+    assert body["status"] == "ok"
+    assert body["cache"]["hits"] == 1
+    assert body["cache"]["misses"] == 1
+    assert body["cache"]["hit_ratio"] == 0.5
+
+
+def test_cache_holds_snapshot_until_bump() -> None:
+    class SnapshotRepo(CountingRepo):
+        def __init__(self) -> None:
+            super().__init__()
+            self.snapshots = 0
+
+        def snapshot(self):
+            self.snapshots += 1
+            return 41
+
+    inner = SnapshotRepo()
+    cache = CachedPartLocationRepository(inner, ttl=60)
+
+    assert cache.snapshot() == 41
+    cache.snapshot()
+    assert inner.snapshots == 1
+    cache.bump()
+    cache.snapshot()
+    assert inner.snapshots == 2
+    assert CachedPartLocationRepository(CountingRepo()).snapshot() is None
@@ -0,0 +1,60 @@
+"""InMemoryPartLocationRepository（キー付き所在ストア）のテスト."""
+
+from __future__ import annotations
+
+from raspberrypiserver.repositories import InMemoryPartLocationRepository, InMemoryScanRepository
+
+
+def _store(capacity: int = 100):
+    scans = InMemoryScanRepository(capacity=10)
+    return scans, InMemoryPartLocationRepository(scans, capacity=capacity)
+
+
+def test_store_keeps_latest_location_per_order():
+    scans, store = _store()
+    scans.save({"order_code": "A", "location_code": "R1"})
+    scans.save({"order_code": "B", "location_code": "R1", "device_id": "DEV-1"})
+    scans.save({"order_code": "A", "location_code": "R2"})
+
+    rows = list(store.list(10))
+    assert [(row["order_code"], row["location_code"]) for row in rows] == [("A", "R2"), ("B", "R1")]
+    assert set(rows[0]) == {"order_code", "location_code", "device_id", "updated_at"}
+    assert rows[0]["updated_at"] > rows[1]["updated_at"]
+    assert store.snapshot() == 3
+
+
+def test_store_keyset_pagination_matches_database_order():
+    scans, store = _store()
+    # 同一バッチでも updated_at は単調増加になる
+    scans.save_many([{"order_code": f"ORD-{index}", "location_code": "R1"} for index in range(5)])
+
+    first = list(store.list(2))
+    assert [row["order_code"] for row in first] == ["ORD-4", "ORD-3"]
+    after = [first[-1]["updated_at"].isoformat(), first[-1]["order_code"]]
+    second = list(store.list(2, after=after))
+    assert [row["order_code"] for row in second] == ["ORD-2", "ORD-1"]
+    assert list(store.list(2, after=["not-a-time", "X"])) == []
+
+
+def test_store_evicts_least_recently_updated_order():
+    scans, store = _store(capacity=2)
+    scans.save({"order_code": "A", "location_code": "R1"})
+    scans.save({"order_code": "B", "location_code": "R1"})
+    scans.save({"order_code": "A", "location_code": "R1"})
+    scans.save({"order_code": "C", "location_code": "R2"})
+
+    assert store.get("B") is None
+    assert [row["order_code"] for row in store.by_location("R1")] == ["A"]
+    assert store.evictions == 1
+
+
+def test_store_changes_follow_update_order():
+    scans, store = _store()
+    scans.save({"order_code": "A", "location_code": "R1"})
+    scans.save({"order_code": "B", "location_code": "R1"})
+    scans.save({"order_code": "A", "location_code": "R2"})
+
+    assert [(row["order_code"], row["change_seq"]) for row in store.changes(0)] == [("B", 2), ("A", 3)]
+    assert [row["order_code"] for row in store.changes(2)] == ["A"]
+    assert [row["order_code"] for row in store.changes(0, limit=1)] == ["B"]
+    assert store.changes(3) == []
@@ -2,10 +2,17 @@ from __future__ import annotations
 
 from pathlib import Path
 
+import gevent
+import pytest
 import tomli_w
 
 from raspberrypiserver.app import create_app, initialize_services, load_configuration
-from raspberrypiserver.repositories import DatabaseScanRepository, InMemoryScanRepository
+from raspberrypiserver.repositories import (
+    DatabaseScanRepository,
+    InMemoryScanRepository,
+    ScanCommitTimeout,
+    ScanQueueFull,
+)
 from raspberrypiserver.services import BacklogDrainService
 
 
@@ -33,6 +40,9 @@ class FakeCursor:
     def execute(self, query, params):
         self.executed.append((query, params))
 
+    def fetchall(self):
+        return [((param.obj.get("metadata") or {}).get("scan_id"),) for param in self.executed[-1][1]]
+
 
 class FakeConnection:
     def __init__(self):
@@ -52,6 +62,28 @@ class FakeConnection:
         self.commit_called = True
 
 
+
+def test_scan_ring_buffer_wraps_and_round_trips_payloads():
+    from raspberrypiserver.repositories.scans import ScanRingBuffer
+
+    ring = ScanRingBuffer(3)
+    payloads = [
+        {"order_code": f"ORD-{index}", "location_code": "RACK-" + "A1", "metadata": {"scan_id": str(index)}}
+        for index in range(5)
+    ]
+    ring.extend(payloads[:4])
+    ring.append({"order_code": "ORD-4", "device_id": None, "extra": 1})
+
+    assert len(ring) == 3
+    assert ring.recent(10) == [payloads[2], payloads[3], {"order_code": "ORD-4", "device_id": None, "extra": 1}]
+    assert ring.recent(1) == [{"order_code": "ORD-4", "device_id": None, "extra": 1}]
+    assert ring.recent(0) == []
+    # 同じ所在コードは 1 つの文字列を共有する
+    first, second = ring.recent(3)[:2]
+    assert first["location_code"] is second["location_code"]
+    assert ScanRingBuffer(0).recent(5) == []
+
+
 def test_database_repository_selection(tmp_path: Path, monkeypatch):
     config_path = tmp_path / "config.toml"
     tomli_w.dump(
@@ -138,3 +170,267 @@ def test_backlog_drain_service_uses_upsert(monkeypatch):
     assert any("INSERT INTO" in q for q, _ in conn.queries)
     assert conn.deleted == [1]
     assert conn.committed is True
+
+
+class RecordingConnection(FakeConnection):
+    def __init__(self, log):
+        super().__init__()
+        self.log = log
+
+    def commit(self):
+        super().commit()
+        self.log.append([params for _, params in self.cursor_obj.executed])
+
+
+def _write_behind_repo(durability, **kwargs):
+    commits = []
+    repo = DatabaseScanRepository(
+        dsn="postgresql://example",
+        connect_factory=lambda dsn: RecordingConnection(commits),
+        durability=durability,
+        **kwargs,
+    )
+    return repo, commits
+
+
+def test_write_behind_async_save_returns_before_commit():
+    repo, commits = _write_behind_repo("async", flush_size=10, flush_interval=60)
+
+    repo.save({"order_code": "A"})
+    repo.save({"order_code": "B"})
+
+    assert commits == []
+    assert repo.stats()["pending"] == 2
+    # 直近バッファにはコミット後にだけ載る
+    assert list(repo.recent(2)) == []
+
+    assert repo.flush() == 2
+    assert len(commits) == 1
+    assert [p.obj["order_code"] for p in commits[0][0]] == ["A", "B"]
+    assert repo.stats()["batches"] == 1
+    assert [item["order_code"] for item in repo.recent(2)] == ["A", "B"]
+
+
+def test_write_behind_flushes_in_background_when_batch_full():
+    repo, commits = _write_behind_repo("async", flush_size=2, flush_interval=60)
+
+    repo.save_many([{"order_code": "A"}, {"order_code": "B"}])
+    gevent.sleep(0.01)
+
+    assert len(commits) == 1
+    assert repo.stats()["pending"] == 0
+
+
+def test_write_behind_group_mode_waits_for_group_commit():
+    repo, commits = _write_behind_repo("group", flush_size=100, flush_interval=0.001)
+
+    repo.save({"order_code": "G"})
+
+    assert len(commits) == 1
+    assert repo.stats()["flushed"] == 1
+
+
+def test_write_behind_group_mode_raises_when_group_commit_fails():
+    import psycopg
+
+    def failing_connect(dsn):
+        raise psycopg.errors.UndefinedTable("scan_ingest_backlog")
+
+    repo = DatabaseScanRepository(
+        dsn="postgresql://example",
+        connect_factory=failing_connect,
+        durability="group",
+        flush_size=100,
+        flush_interval=0.001,
+    )
+
+    with pytest.raises(psycopg.errors.UndefinedTable):
+        repo.save({"order_code": "G"})
+    assert repo.stats()["flushed"] == 0
+
+
+def test_write_behind_group_mode_raises_when_group_commit_times_out():
+    commits = []
+
+    def slow_connect(dsn):
+        gevent.sleep(0.2)
+        return RecordingConnection(commits)
+
+    repo = DatabaseScanRepository(
+        dsn="postgresql://example",
+        connect_factory=slow_connect,
+        durability="group",
+        flush_size=100,
+        flush_interval=0.001,
+        group_timeout=0.01,
+    )
+
+    with pytest.raises(ScanCommitTimeout):
+        repo.save({"order_code": "SLOW"})
+    repo.close()
+
+
+def test_write_behind_close_waits_for_in_flight_batch():
+    commits = []
+
+    def slow_connect(dsn):
+        gevent.sleep(0.05)
+        return RecordingConnection(commits)
+
+    repo = DatabaseScanRepository(
+        dsn="postgresql://example",
+        connect_factory=slow_connect,
+        durability="async",
+        flush_size=1,
+        flush_interval=60,
+    )
+    repo.save({"order_code": "IN-FLIGHT"})
+    gevent.sleep(0.01)  # flusher has taken the batch and is inside the INSERT
+    assert repo.stats()["pending"] == 0
+
+    repo.close()
+
+    assert [p.obj["order_code"] for p in commits[0][0]] == ["IN-FLIGHT"]
+    assert repo.stats()["flushed"] == 1
+
+
+def test_initialize_services_does_not_stack_exit_hooks(tmp_path: Path, monkeypatch):
+    import atexit
+
+    from raspberrypiserver import app as app_module
+
+    registered = []
+    monkeypatch.setattr(atexit, "register", lambda *args, **kwargs: registered.append(args))
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "SCAN_REPOSITORY_DURABILITY": "async",
+            "database": {"dsn": "postgresql://app:app@db/sensordb"},
+        },
+        config_path.open("wb"),
+    )
+    app = create_app()
+    for _ in range(3):
+        load_configuration(app, config_path=str(config_path))
+        initialize_services(app)
+
+    assert registered == []
+    assert app in app_module._LIVE_APPS  # noqa: SLF001
+    app_module.shutdown_services(app)
+    assert app not in app_module._LIVE_APPS  # noqa: SLF001
+
+
+def test_write_behind_overflow_policies():
+    # flusher greenlet does not run until the caller yields, so the queue fills up
+    repo, commits = _write_behind_repo("async", flush_size=2, flush_interval=60, queue_size=2, overflow="drop")
+    repo.save_many([{"order_code": "A"}, {"order_code": "B"}])
+    with pytest.raises(ScanQueueFull):
+        repo.save({"order_code": "C"})
+    assert repo.stats()["dropped"] == 1
+    assert repo.stats()["pending"] == 2
+
+    repo, commits = _write_behind_repo("async", flush_size=2, flush_interval=60, queue_size=2)
+    repo.save_many([{"order_code": "A"}, {"order_code": "B"}])
+    repo.save({"order_code": "C"})
+    assert repo.stats()["overflow_flushes"] == 1
+    assert len(commits) == 1
+    assert repo.stats()["pending"] == 1
+
+
+def test_write_behind_close_flushes_pending_rows():
+    repo, commits = _write_behind_repo("async", flush_size=100, flush_interval=60)
+    repo.save({"order_code": "LAST"})
+
+    repo.close()
+
+    assert len(commits) == 1
+    repo.save({"order_code": "AFTER-CLOSE"})
+    assert len(commits) == 2
+
+
+def test_part_location_repository_keyset_and_snapshot():
+    from raspberrypiserver.repositories import DatabasePartLocationRepository
+
+    class RowCursor(FakeCursor):
+        def execute(self, query, params=None):
+            self.executed.append((query, params))
+
+        def fetchall(self):
+            return [{"order_code": "ORD-1"}]
+
+        def fetchone(self):
+            return (42,)
+
+    class RowConnection(FakeConnection):
+        def __init__(self):
+            super().__init__()
+            self.cursor_obj = RowCursor()
+
+        def cursor(self, row_factory=None):
+            return self.cursor_obj
+
+    conn = RowConnection()
+    repo = DatabasePartLocationRepository("postgresql://example", connect=lambda _dsn: conn)
+
+    assert repo.list(3, after=["2026-10-17T09:00:00+00:00", "ORD-9"]) == [{"order_code": "ORD-1"}]
+    query, params = conn.cursor_obj.executed[-1]
+    text = query.as_string(None)
+    assert "(updated_at, order_code) < (%s::timestamptz, %s)" in text
+    assert "ORDER BY updated_at DESC, order_code DESC" in text
+    assert params == ("2026-10-17T09:00:00+00:00", "ORD-9", 3)
+
+    repo.list(3)
+    assert conn.cursor_obj.executed[-1][1] == (3,)
+    assert repo.snapshot() == 42
+    assert "MAX(change_seq)" in conn.cursor_obj.executed[-1][0]
+    assert "COUNT" not in conn.cursor_obj.executed[-1][0]
+
+    repo.changes(since=41, limit=10)
+    query, params = conn.cursor_obj.executed[-1]
+    assert "WHERE change_seq > %s" in query
+    assert "ORDER BY change_seq" in query
+    assert params == (41, 10)
+
+
+def test_drain_upsert_bumps_change_sequence_under_lock():
+    from raspberrypiserver.services.backlog import _upsert_statement
+
+    text = _upsert_statement("part_locations").as_string(None)
+    assert "pg_advisory_xact_lock(hashtext('part_locations.change_seq'))" in text
+    assert "change_seq = DEFAULT" in text
+
+
+def test_part_location_repository_point_and_reverse_lookup():
+    from raspberrypiserver.repositories import DatabasePartLocationRepository
+
+    class RowCursor(FakeCursor):
+        def execute(self, query, params=None):
+            self.executed.append((query, params))
+
+        def fetchall(self):
+            return [{"order_code": "ORD-1"}]
+
+        def fetchone(self):
+            return {"order_code": "ORD-1", "location_code": "RACK-Z9"}
+
+    class RowConnection(FakeConnection):
+        def __init__(self):
+            super().__init__()
+            self.cursor_obj = RowCursor()
+
+        def cursor(self, row_factory=None):
+            return self.cursor_obj
+
+    conn = RowConnection()
+    repo = DatabasePartLocationRepository("postgresql://example", connect=lambda _dsn: conn)
+
+    assert repo.get("ORD-1")["location_code"] == "RACK-Z9"
+    query, params = conn.cursor_obj.executed[-1]
+    assert "WHERE order_code = %s" in query and params == ("ORD-1",)
+
+    assert repo.by_location("RACK-Z9", limit=5) == [{"order_code": "ORD-1"}]
+    query, params = conn.cursor_obj.executed[-1]
+    assert "WHERE location_code = %s" in query
+    assert "ORDER BY updated_at DESC, order_code DESC" in query
+    assert params == ("RACK-Z9", 5)
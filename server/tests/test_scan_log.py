@@ -0,0 +1,101 @@
+"""LogScanRepository（追記型セグメントログ）のテスト."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import gevent
+import tomli_w
+
+from raspberrypiserver.app import create_app, initialize_services, load_configuration
+from raspberrypiserver.repositories import InMemoryPartLocationRepository, LogScanRepository
+
+
+def _scan(index: int) -> dict:
+    return {"order_code": f"ORD-{index}", "location_code": "RACK-A1", "metadata": {"scan_id": f"s-{index}"}}
+
+
+def test_log_appends_and_recovers_after_restart(tmp_path: Path):
+    repo = LogScanRepository(tmp_path, fsync_interval=0)
+    repo.save(_scan(1))
+    repo.save_many([_scan(2), _scan(3)])
+    assert list(repo.recent(2)) == [_scan(2), _scan(3)]
+    assert repo.stats()["fsyncs"] == 2
+    repo.close()
+
+    reopened = LogScanRepository(tmp_path)
+    assert list(reopened.recent(10)) == [_scan(1), _scan(2), _scan(3)]
+    reopened.save(_scan(4))
+    assert list(reopened.recent(1)) == [_scan(4)]
+    reopened.close()
+
+
+def test_log_truncates_torn_tail_record(tmp_path: Path):
+    repo = LogScanRepository(tmp_path, fsync_interval=0)
+    repo.save_many([_scan(1), _scan(2)])
+    repo.close()
+
+    segment = next(tmp_path.glob("*.seg"))
+    intact = segment.stat().st_size
+    with segment.open("ab") as handle:
+        handle.write(b"\x40\x00\x00\x00\x00\x00")  # 書きかけのヘッダ
+
+    reopened = LogScanRepository(tmp_path)
+    assert segment.stat().st_size == intact
+    assert reopened.stats()["truncated_bytes"] == 6
+    assert list(reopened.recent(5)) == [_scan(1), _scan(2)]
+    reopened.close()
+
+
+def test_log_rotates_segments_and_reads_across_them(tmp_path: Path):
+    repo = LogScanRepository(tmp_path, segment_bytes=200, max_segments=3, fsync_interval=0)
+    for index in range(10):
+        repo.save(_scan(index))
+
+    stats = repo.stats()
+    assert stats["rotations"] > 0
+    assert stats["segments"] == 3
+    recent = list(repo.recent(4))
+    assert recent == [_scan(index) for index in range(6, 10)]
+    repo.close()
+
+    # 再起動時は最後のセグメントだけを走査する
+    reopened = LogScanRepository(tmp_path, segment_bytes=200, max_segments=3)
+    assert reopened.stats()["segment_records"] < 10
+    assert list(reopened.recent(4)) == recent
+    reopened.close()
+
+
+def test_log_group_fsync_runs_in_background(tmp_path: Path):
+    repo = LogScanRepository(tmp_path, fsync_interval=0.01, fsync_batch=100)
+    repo.save(_scan(1))
+    repo.save(_scan(2))
+    assert repo.stats()["unsynced"] == 2
+    gevent.sleep(0.05)
+    stats = repo.stats()
+    assert stats["unsynced"] == 0
+    assert stats["fsyncs"] == 1
+    repo.close()
+
+
+def test_log_backend_selection_rebuilds_part_locations(tmp_path: Path):
+    seeded = LogScanRepository(tmp_path / "log", fsync_interval=0)
+    seeded.save({"order_code": "A", "location_code": "R1"})
+    seeded.close()
+
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump({"SCAN_REPOSITORY_BACKEND": "log", "SCAN_LOG_DIR": str(tmp_path / "log")}, config_path.open("wb"))
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+
+    repo = app.config["SCAN_REPOSITORY"]
+    assert isinstance(repo, LogScanRepository)
+    part_repo = app.config["PART_LOCATION_REPOSITORY"]
+    assert isinstance(part_repo, InMemoryPartLocationRepository)
+    assert part_repo.get("A")["location_code"] == "R1"
+
+    body = app.test_client().get("/api/v1/admin/scan-log").get_json()
+    assert body["status"] == "ok"
+    assert body["log"]["segment_records"] == 1
+    repo.close()
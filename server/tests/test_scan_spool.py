@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import psycopg
+import pytest
+import tomli_w
+
+from raspberrypiserver.app import create_app, initialize_services, load_configuration, shutdown_services
+from raspberrypiserver.database import CircuitOpenError
+from raspberrypiserver.repositories import DatabaseScanRepository, ScanSpool, ScanSpoolFull
+from raspberrypiserver.services import SpoolReplayer
+
+
+def _refuse(dsn):
+    raise psycopg.OperationalError("connection refused")
+
+
+class FakeCopy:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+
+class FakeCursor:
+    def __init__(self, inserted):
+        self.executed = []
+        self.copied = []
+        self.rowcount = inserted
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+
+    def copy(self, statement):
+        self.executed.append(statement)
+        return FakeCopy(self.copied)
+
+
+class FakeConnection:
+    def __init__(self, inserted=0):
+        self.cursor_obj = FakeCursor(inserted)
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def cursor(self):
+        return self.cursor_obj
+
+    def commit(self):
+        self.committed = True
+
+
+class RecordingRepository:
+    def __init__(self, fail: bool = False, reject_orders=()):
+        self.fail = fail
+        self.reject_orders = set(reject_orders)
+        self.batches = []
+
+    def copy_records(self, records):
+        if self.fail:
+            raise psycopg.OperationalError("still down")
+        if any(record["payload"]["order_code"] in self.reject_orders for record in records):
+            raise psycopg.errors.InvalidTextRepresentation("invalid input syntax for type json")
+        self.batches.append(list(records))
+        return len(records)
+
+
+def _scan(order: str, scan_id: str | None = None) -> dict:
+    payload = {"order_code": order, "location_code": "RACK-A1"}
+    if scan_id:
+        payload["metadata"] = {"scan_id": scan_id}
+    return payload
+
+
+def test_spool_tracks_depth_and_recovers_after_restart(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    spool.append([_scan("A"), _scan("B")])
+    assert spool.depth == 2
+    spool.close()
+
+    reopened = ScanSpool(tmp_path, fsync_interval=0)
+    assert reopened.depth == 2
+    [segment] = reopened.pending_segments()
+    records = reopened.read(segment)
+    assert [record["payload"]["order_code"] for record in records] == ["A", "B"]
+    assert all("received_at" in record for record in records)
+
+    assert reopened.discard(segment) == 2
+    assert reopened.depth == 0
+    assert reopened.stats()["recovered"] == 2
+
+
+def test_pending_segments_does_not_seal_while_older_segments_remain(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    spool.append([_scan("A")])
+    first = spool.pending_segments()
+    spool.append([_scan("B")])
+
+    assert spool.pending_segments() == first
+    spool.discard(first[0])
+    assert len(spool.pending_segments()) == 1
+    assert spool.depth == 1
+
+
+def test_full_spool_refuses_writes_and_keeps_pending_segments(tmp_path: Path) -> None:
+    # 1 レコード 1 セグメントになる大きさにして上限を 2 セグメントにする
+    spool = ScanSpool(tmp_path, segment_bytes=1, max_segments=2, fsync_interval=0)
+    spool.append([_scan("A")])
+    spool.append([_scan("B")])
+
+    with pytest.raises(ScanSpoolFull):
+        spool.append([_scan("C")])
+    assert spool.depth == 2
+    stats = spool.stats()
+    assert stats["full"] is True
+    assert stats["rejected"] == 1
+
+    # 古いセグメントは消えずに残り、再送で空けば再び受け付ける
+    [first, *_] = spool.pending_segments()
+    assert [record["payload"]["order_code"] for record in spool.read(first)] == ["A"]
+    spool.discard(first)
+    spool.append([_scan("C")])
+    assert spool.depth == 2
+    assert spool.stats()["full"] is False
+
+
+def test_full_spool_fails_the_save(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, segment_bytes=1, max_segments=1, fsync_interval=0)
+    repo = DatabaseScanRepository("postgresql://db", connect_factory=_refuse, spool=spool)
+    repo.save(_scan("A"))
+
+    with pytest.raises(ScanSpoolFull):
+        repo.save(_scan("B"))
+    assert spool.depth == 1
+
+def test_outage_writes_are_spooled_and_keep_order(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    calls = []
+
+    def connect(dsn):
+        calls.append(dsn)
+        return _refuse(dsn)
+
+    repo = DatabaseScanRepository("postgresql://db", connect_factory=connect, spool=spool)
+    repo.save(_scan("A"))
+    assert spool.depth == 1
+    assert len(calls) == 1
+
+    # スプールに残りがある間は DB に触れずスプールへ追記する
+    repo._connect_factory = lambda dsn: FakeConnection()  # noqa: SLF001
+    repo.save(_scan("B"))
+    assert spool.depth == 2
+    assert repo.stats()["spooled"] == 2
+
+
+def test_circuit_open_writes_are_spooled(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+
+    def connect(dsn):
+        raise CircuitOpenError("database circuit is open")
+
+    repo = DatabaseScanRepository("postgresql://db", connect_factory=connect, spool=spool)
+    repo.save_many([_scan("A"), _scan("B")])
+
+    assert spool.depth == 2
+
+
+def test_non_outage_errors_are_not_spooled(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+
+    def connect(dsn):
+        raise psycopg.errors.UndefinedTable("scan_ingest_backlog")
+
+    repo = DatabaseScanRepository("postgresql://db", connect_factory=connect, spool=spool)
+    with pytest.raises(psycopg.errors.UndefinedTable):
+        repo.save(_scan("A"))
+
+    assert spool.depth == 0
+
+
+def test_copy_records_streams_rows_through_copy(tmp_path: Path) -> None:
+    conn = FakeConnection(inserted=1)
+    repo = DatabaseScanRepository("postgresql://db", connect_factory=lambda dsn: conn)
+
+    inserted = repo.copy_records(
+        [{"received_at": "2026-10-18T09:00:00+00:00", "payload": _scan("A", "s-1")}]
+    )
+
+    assert inserted == 1
+    assert conn.committed is True
+    cur = conn.cursor_obj
+    assert any("COPY scan_spool_replay" in str(query) for query in cur.executed)
+    [(payload, received_at)] = cur.copied
+    assert json.loads(payload) == _scan("A", "s-1")
+    assert received_at == "2026-10-18T09:00:00+00:00"
+    assert "NOT EXISTS" in str(cur.executed[-1])
+    assert "DISTINCT ON" in str(cur.executed[-1])
+    assert "part_location_history" in str(cur.executed[-1])
+
+
+def test_copy_records_skips_the_history_check_without_a_history_table() -> None:
+    conn = FakeConnection(inserted=1)
+    repo = DatabaseScanRepository("postgresql://db", connect_factory=lambda dsn: conn, history_table="")
+
+    repo.copy_records([{"received_at": "2026-10-18T09:00:00+00:00", "payload": _scan("A")}])
+
+    assert "part_location_history" not in str(conn.cursor_obj.executed[-1])
+
+
+def test_replayer_copies_segments_and_dedups_scan_ids(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    spool.append([_scan("A", "s-1"), _scan("A", "s-1"), _scan("B")])
+    repo = RecordingRepository()
+    replayer = SpoolReplayer(repo, spool)
+
+    assert replayer.replay_once() == 2
+    assert [record["payload"]["order_code"] for record in repo.batches[0]] == ["A", "B"]
+    stats = replayer.stats()
+    assert stats["depth"] == 0
+    assert stats["replayed"] == 2
+    assert stats["duplicates"] == 1
+    assert stats["replay_rate_per_sec"] > 0
+
+
+def test_failed_replay_keeps_the_segment(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    spool.append([_scan("A")])
+    repo = RecordingRepository(fail=True)
+    replayer = SpoolReplayer(repo, spool)
+
+    with pytest.raises(psycopg.OperationalError):
+        replayer.replay_once()
+    assert spool.depth == 1
+
+    repo.fail = False
+    assert replayer.replay_once() == 1
+    assert spool.depth == 0
+
+
+def test_replayer_dedups_on_normalized_scan_ids(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    spool.append([_scan("A", " S-1 "), _scan("A", "s-1")])
+    repo = RecordingRepository()
+
+    assert SpoolReplayer(repo, spool).replay_once() == 1
+
+
+def test_replayer_quarantines_a_segment_that_keeps_failing(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    spool.append([_scan("BAD", "s-1")])
+    spool.pending_segments()
+    spool.append([_scan("A", "s-1"), _scan("B")])
+    repo = RecordingRepository(reject_orders={"BAD"})
+    replayer = SpoolReplayer(repo, spool, max_failures=2)
+
+    # DB 停止は隔離の回数に数えない
+    repo.fail = True
+    for _ in range(3):
+        with pytest.raises(psycopg.OperationalError):
+            replayer.replay_once()
+    repo.fail = False
+
+    with pytest.raises(psycopg.errors.InvalidTextRepresentation):
+        replayer.replay_once()
+    assert spool.depth == 3
+
+    # 2 回目で隔離し、次の回で後ろのセグメントを流す（隔離した行の scan_id では弾かない）
+    assert replayer.replay_once() == 0
+    assert spool.depth == 2
+    assert replayer.replay_once() == 2
+    assert [record["payload"]["order_code"] for record in repo.batches[0]] == ["A", "B"]
+    assert spool.depth == 0
+    stats = replayer.stats()
+    assert stats["skipped_segments"] == 1
+    assert stats["quarantined"] == 1
+    assert stats["quarantined_segments"] == 1
+    assert len(list(spool.quarantine_dir.glob("*.seg"))) == 1
+
+    reopened = ScanSpool(tmp_path, fsync_interval=0)
+    assert reopened.depth == 0
+    assert reopened.stats()["quarantined_segments"] == 1
+
+
+def test_replayer_quarantines_only_the_bad_records_of_a_segment(tmp_path: Path) -> None:
+    spool = ScanSpool(tmp_path, fsync_interval=0)
+    spool.append([_scan("A", "s-1"), _scan("BAD", "s-2"), _scan("B"), _scan("C", "s-3"), _scan("BAD", "s-4")])
+    repo = RecordingRepository(reject_orders={"BAD"})
+    replayer = SpoolReplayer(repo, spool, max_failures=1)
+
+    assert replayer.replay_once() == 3
+    replayed = [record["payload"]["order_code"] for batch in repo.batches for record in batch]
+    assert replayed == ["A", "B", "C"]
+    assert spool.depth == 0
+    stats = replayer.stats()
+    assert stats["quarantined"] == 2
+    assert stats["duplicates"] == 0
+
+    [quarantined] = spool.quarantine_dir.glob("*.seg")
+    archive = ScanSpool(tmp_path / "inspect", fsync_interval=0)
+    archive.close()
+    quarantined.replace(tmp_path / "inspect" / "00000001.seg")
+    reopened = ScanSpool(tmp_path / "inspect", fsync_interval=0)
+    [segment] = reopened.pending_segments()
+    assert [record["payload"]["metadata"]["scan_id"] for record in reopened.read(segment)] == ["s-2", "s-4"]
+
+def test_db_backend_wires_spool_and_reports_it(tmp_path: Path) -> None:
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {
+            "SCAN_REPOSITORY_BACKEND": "db",
+            "SCAN_SPOOL_DIR": str(tmp_path / "spool"),
+            "database": {"dsn": "postgresql://app:app@db/sensordb"},
+        },
+        config_path.open("wb"),
+    )
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+
+    replayer = app.config["SCAN_SPOOL_REPLAYER"]
+    assert isinstance(replayer, SpoolReplayer)
+    assert app.config["SCAN_REPOSITORY"].spool is replayer.spool
+
+    service = app.config["BACKLOG_DRAIN_SERVICE"]
+    service.backlog_stats = lambda exact=False: {
+        "pending": 0,
+        "pending_mode": "counter",
+        "oldest_pending_age_seconds": None,
+    }
+    service.count_dead_letters = lambda: 0
+    body = app.test_client().get("/api/v1/admin/backlog-status").get_json()
+    assert body["spool"]["depth"] == 0
+    assert "replay_rate_per_sec" in body["spool"]
+
+    health = app.test_client().get("/healthz").get_json()
+    assert health["spool"]["depth"] == 0
+    assert health["spool"]["quarantined_segments"] == 0
+
+    (replayer.spool.quarantine_dir).mkdir()
+    (replayer.spool.quarantine_dir / "20261018T090000-00000001.seg").write_bytes(b"")
+    health = app.test_client().get("/healthz").get_json()
+    assert health["status"] == "degraded"
+    assert health["spool"]["quarantined_segments"] == 1
+
+    shutdown_services(app)
+    assert replayer.stats()["running"] is False
@@ -0,0 +1,162 @@
+"""SQLite (WAL) バックエンドのテスト."""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from pathlib import Path
+
+import gevent
+import pytest
+import tomli_w
+from flask.testing import FlaskClient
+
+from raspberrypiserver.app import create_app, initialize_services, load_configuration, shutdown_services
+from raspberrypiserver.repositories import SQLiteDatabase, SQLitePartLocationRepository, SQLiteScanRepository
+from raspberrypiserver.services import SQLiteBacklogDrainService
+
+
+def _sqlite_app(tmp_path: Path):
+    config_path = tmp_path / "config.toml"
+    tomli_w.dump(
+        {"SCAN_REPOSITORY_BACKEND": "sqlite", "SQLITE_PATH": str(tmp_path / "db.sqlite3")},
+        config_path.open("wb"),
+    )
+    app = create_app()
+    load_configuration(app, config_path=str(config_path))
+    initialize_services(app)
+    return app
+
+
+def test_sqlite_drain_matches_postgres_semantics(tmp_path: Path):
+    database = SQLiteDatabase(str(tmp_path / "db.sqlite3"))
+    assert database.connect().cursor().execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    scans = SQLiteScanRepository(database)
+    service = SQLiteBacklogDrainService(database, limit=10)
+    locations = SQLitePartLocationRepository(database)
+
+    scans.save_many(
+        [
+            {"order_code": "A", "location_code": "R1", "metadata": {"scan_id": "s-1"}},
+            {"order_code": "B", "location_code": "R1", "device_id": "DEV-1"},
+            {"order_code": "A", "location_code": "R2"},
+            {"order_code": "C"},
+        ]
+    )
+    # 再送は無視し、保存しなかったことを返す（直近バッファにも載せない）
+    assert scans.save({"order_code": "A", "location_code": "R9", "metadata": {"scan_id": "s-1"}}) is False
+    assert [row["order_code"] for row in scans.recent(1)] == ["C"]
+    assert service.backlog_stats()["pending"] == 4
+
+    assert service.drain_once() == 3
+    assert service.metrics()["superseded"] == 1
+    assert service.metrics()["quarantined"] == 1
+    assert service.count_backlog(exact=True) == 0
+
+    rows = list(locations.list(10))
+    assert [(row["order_code"], row["location_code"]) for row in rows] == [("B", "R1"), ("A", "R2")]
+    assert locations.get("B")["device_id"] == "DEV-1"
+    assert [row["order_code"] for row in locations.by_location("R1")] == ["B"]
+    assert [(row["order_code"], row["change_seq"]) for row in locations.changes(0)] == [("B", 1), ("A", 2)]
+    assert locations.snapshot() == 2
+
+    dead = service.list_dead_letters()
+    assert dead[0]["reason"] == "missing-location_code"
+    assert service.requeue_dead_letters([dead[0]["id"]], patch={"location_code": "R3"}) == 1
+    assert service.drain_once() == 1
+    assert locations.get("C")["location_code"] == "R3"
+    assert [row["order_code"] for row in locations.changes(2)] == ["C"]
+    database.close()
+
+
+def test_sqlite_requeue_keeps_conflicting_and_rejects_invalid_rows(tmp_path: Path):
+    from raspberrypiserver.services import DeadLetterStillInvalid
+
+    database = SQLiteDatabase(str(tmp_path / "db.sqlite3"))
+    scans = SQLiteScanRepository(database)
+    service = SQLiteBacklogDrainService(database, limit=10)
+    scans.save_many([{"order_code": "D", "metadata": {"scan_id": "s-9"}}, {"order_code": "E"}])
+    service.drain_once()
+    dead = {row["payload"]["order_code"]: row["id"] for row in service.list_dead_letters()}
+
+    with pytest.raises(DeadLetterStillInvalid) as excinfo:
+        service.requeue_dead_letters(list(dead.values()))
+    assert excinfo.value.reasons == {dead["D"]: "missing-location_code", dead["E"]: "missing-location_code"}
+    assert len(service.list_dead_letters()) == 2
+
+    # 再送された同じ scan_id が先に backlog へ入っている行は dead-letter に残す
+    scans.save({"order_code": "D", "location_code": "R1", "metadata": {"scan_id": "s-9"}})
+    assert service.requeue_dead_letters(list(dead.values()), patch={"location_code": "R2"}) == 1
+    assert [row["id"] for row in service.list_dead_letters()] == [dead["D"]]
+    database.close()
+
+
+def test_sqlite_backend_serves_the_same_api(tmp_path: Path):
+    app = _sqlite_app(tmp_path)
+    client: FlaskClient = app.test_client()
+
+    resp = client.post("/api/v1/scans", json={"order_code": "ORD-1", "location_code": "RACK-A1"})
+    assert resp.status_code in (200, 202)
+    client.post("/api/v1/scans", json={"order_code": "ORD-1", "location_code": "RACK-B2"})
+    assert client.get("/api/v1/admin/backlog-status").get_json()["pending"] == 2
+
+    body = client.post("/api/v1/admin/drain-backlog").get_json()
+    assert body["drained"] == 2
+
+    entries = client.get("/api/v1/part-locations").get_json()["entries"]
+    assert [(e["order_code"], e["location_code"]) for e in entries] == [("ORD-1", "RACK-B2")]
+    assert client.get("/api/v1/orders/ORD-1/location").get_json()["entry"]["location_code"] == "RACK-B2"
+    trail = client.get("/api/v1/orders/ORD-1/history").get_json()
+    assert [e["location_code"] for e in trail["entries"]] == ["RACK-B2", "RACK-A1"]
+    changes = client.get("/api/v1/part-locations/changes").get_json()
+    assert [e["order_code"] for e in changes["changes"]] == ["ORD-1"]
+    app.config["SQLITE_DATABASE"].close()
+
+
+def test_sqlite_failed_save_raises_and_skips_recent_buffer(tmp_path: Path):
+    database = SQLiteDatabase(str(tmp_path / "db.sqlite3"))
+    scans = SQLiteScanRepository(database)
+    scans.save({"order_code": "A", "location_code": "R1"})
+
+    database.connect().cursor().execute("DROP TABLE scan_ingest_backlog")
+    with pytest.raises(sqlite3.OperationalError):
+        scans.save({"order_code": "B", "location_code": "R2"})
+    assert [scan["order_code"] for scan in scans.recent()] == ["A"]
+
+    indexes = {
+        row[0]
+        for row in database.connect().cursor().execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    }
+    assert "idx_part_location_history_moved_at" in indexes
+    assert not any(name.startswith("brin_") for name in indexes)
+
+
+def test_sqlite_sessions_run_in_the_threadpool_one_greenlet_at_a_time(tmp_path: Path):
+    database = SQLiteDatabase(str(tmp_path / "db.sqlite3"))
+    scans = SQLiteScanRepository(database)
+    database._conn.create_function("thread_id", 0, threading.get_ident)  # noqa: SLF001
+
+    with database.connect() as conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO scan_ingest_backlog (payload, received_at) VALUES (?, ?)", ('{"order_code": "A"}', "t"))
+        writer = gevent.spawn(scans.save, {"order_code": "B", "location_code": "R1"})
+        gevent.sleep(0.01)
+        # 別 greenlet の保存はこのセッションのコミットまで待つ
+        assert not writer.dead
+    writer.join(timeout=1)
+
+    assert writer.value is True
+    [(thread_id,)] = database.connect().cursor().execute("SELECT thread_id()").fetchall()
+    assert thread_id != threading.get_ident()
+    assert [row["order_code"] for row in scans.recent()] == ["B"]
+    database.close()
+
+
+def test_shutdown_services_closes_the_sqlite_database(tmp_path: Path):
+    app = _sqlite_app(tmp_path)
+    database = app.config["SQLITE_DATABASE"]
+
+    shutdown_services(app)
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        database.connect().cursor()
+    database.close()  # 2 回目は何もしない